@@ -0,0 +1,220 @@
+"""
+Admission control for the monitoring endpoints.
+
+Camera monitoring is the expensive part of the app: starting a session opens
+the camera and calibrates synchronously for a few seconds, every open video
+feed holds a worker thread, and the dashboard posts monitoring data several
+times a second. When many sessions start together (a shift change) that work
+used to pile up until bookings and dashboards slowed down with it. Instead,
+each kind of work gets a fixed budget and anything over it is refused at once
+with a Retry-After header:
+
+    MONITORING_MAX_SESSIONS      camera sessions open at once            (503)
+    MONITORING_MAX_CALIBRATIONS  calibrations running at once            (503)
+    MONITORING_MAX_STREAMS       video feeds served by Flask at once     (503)
+    MONITORING_MAX_IN_FLIGHT     /api/monitor/ requests being handled    (503)
+    MONITORING_INGEST_RATE       monitoring data posts per second per    (429)
+    MONITORING_INGEST_BURST      user, with bursts of up to this many
+
+A session holds its slot until it is stopped, its camera stops producing
+frames, or nobody has watched or polled it for MONITORING_SESSION_IDLE_SECONDS
+(a closed tab that never sent stop), whichever comes first.
+
+MONITORING_MAX_IN_FLIGHT caps how many worker threads monitoring requests can
+occupy, so booking, browsing and dashboards always have threads left however
+busy monitoring gets; those paths are never refused. Refusals are counted in
+metrics as admission_rejected_total. Limits are per worker process. Streams
+served by streaming_server are not limited here; it handles thousands of
+viewers on one thread.
+"""
+
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import g, jsonify, request
+
+from metrics import metrics
+
+MONITORING_PREFIX = '/api/monitor/'
+IDLE_BUCKET_SECONDS = 300  # rate limiter state of clients quiet this long is dropped
+SESSION_IDLE_SECONDS = 120  # camera sessions nobody watches or polls this long are ended
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, message, status=503, retry_after=1):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Slots:
+    """A fixed number of slots taken without waiting."""
+
+    def __init__(self, name, limit, retry_after):
+        self.name = name
+        self.limit = limit
+        self.retry_after = retry_after
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, message):
+        """Take a slot, or raise AdmissionRejected if all are in use."""
+        with self._lock:
+            if self.in_use >= self.limit:
+                raise AdmissionRejected(self.name, message, 503, self.retry_after)
+            self.in_use += 1
+
+    def release(self):
+        with self._lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def held(self, message):
+        """Context manager holding a slot for the duration of a block."""
+        return _Held(self, message)
+
+
+class _Held:
+    def __init__(self, slots, message):
+        self.slots = slots
+        self.message = message
+
+    def __enter__(self):
+        self.slots.acquire(self.message)
+
+    def __exit__(self, *exc):
+        self.slots.release()
+
+
+class RateLimiter:
+    """Token bucket per client: rate tokens a second, holding at most burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # client -> (tokens, last refill)
+        self._lock = threading.Lock()
+        self._pruned_at = time.monotonic()
+
+    def take(self, client):
+        """Spend a token; return 0 if there was one, else the seconds until there will be."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[client] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[client] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            if now - self._pruned_at > IDLE_BUCKET_SECONDS:
+                self._buckets = {key: value for key, value in self._buckets.items()
+                                 if now - value[1] <= IDLE_BUCKET_SECONDS}
+                self._pruned_at = now
+        return wait
+
+
+class ReleasingStream:
+    """Streaming response body that gives its slot back when the server closes it."""
+
+    def __init__(self, iterable, slots):
+        self._iterable = iterable
+        self._slots = slots
+        self._released = False
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._slots.release()
+        close = getattr(self._iterable, 'close', None)
+        if close:
+            close()
+
+
+class AdmissionControl:
+    def __init__(self):
+        self.configure()
+
+    def configure(self, max_sessions=50, max_calibrations=2, max_streams=100, max_in_flight=16,
+                  ingest_rate=5.0, ingest_burst=10, session_idle_seconds=SESSION_IDLE_SECONDS):
+        self.session_idle_seconds = session_idle_seconds
+        self.sessions = Slots('sessions', max_sessions, retry_after=30)
+        self.calibrations = Slots('calibrations', max_calibrations, retry_after=5)
+        self.streams = Slots('streams', max_streams, retry_after=10)
+        self.in_flight = Slots('in_flight', max_in_flight, retry_after=1)
+        self.ingest = RateLimiter(ingest_rate, ingest_burst)
+
+    def check_ingest(self, client):
+        """Raise AdmissionRejected (429) if client is posting monitoring data faster than allowed."""
+        wait = self.ingest.take(client)
+        if wait:
+            raise AdmissionRejected('ingest_rate', 'Monitoring data is being sent too fast', 429,
+                                    max(1, math.ceil(wait)))
+
+    def stream(self, iterable):
+        """Take a stream slot for a streaming response body; it is released when the response closes."""
+        self.streams.acquire('Too many video feeds are open, please try again shortly')
+        return ReleasingStream(iterable, self.streams)
+
+
+def rate_limited(client):
+    """Decorator applying the ingest rate limit to a view; client() names the caller."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            admission_control.check_ingest(client())
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _enter_monitoring():
+    if request.path.startswith(MONITORING_PREFIX):
+        admission_control.in_flight.acquire('The monitoring service is busy, please try again shortly')
+        g.admission_in_flight = True
+
+
+def _leave_monitoring(exc):
+    if g.pop('admission_in_flight', False):
+        admission_control.in_flight.release()
+
+
+def _rejected(error):
+    metrics.observe_rejected(request.endpoint or 'unmatched', error.reason)
+    response = jsonify({"error": error.message})
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('MONITORING_MAX_SESSIONS', 50)
+    app.config.setdefault('MONITORING_MAX_CALIBRATIONS', 2)
+    app.config.setdefault('MONITORING_MAX_STREAMS', 100)
+    app.config.setdefault('MONITORING_MAX_IN_FLIGHT', 16)
+    app.config.setdefault('MONITORING_INGEST_RATE', 5.0)
+    app.config.setdefault('MONITORING_INGEST_BURST', 10)
+    app.config.setdefault('MONITORING_SESSION_IDLE_SECONDS', SESSION_IDLE_SECONDS)
+    admission_control.configure(
+        max_sessions=app.config['MONITORING_MAX_SESSIONS'],
+        max_calibrations=app.config['MONITORING_MAX_CALIBRATIONS'],
+        max_streams=app.config['MONITORING_MAX_STREAMS'],
+        max_in_flight=app.config['MONITORING_MAX_IN_FLIGHT'],
+        ingest_rate=app.config['MONITORING_INGEST_RATE'],
+        ingest_burst=app.config['MONITORING_INGEST_BURST'],
+        session_idle_seconds=app.config['MONITORING_SESSION_IDLE_SECONDS'],
+    )
+    app.before_request(_enter_monitoring)
+    app.teardown_request(_leave_monitoring)
+    app.register_error_handler(AdmissionRejected, _rejected)
+
+
+# Global admission control instance
+admission_control = AdmissionControl()
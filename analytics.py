@@ -0,0 +1,243 @@
+"""
+Revenue and utilization over time for the dashboard charts.
+
+All rentals, hot and archived, are extracted once into NumPy columns (car,
+company, status, start and end day, amounts) and kept in memory; every
+series is then a boolean mask plus np.bincount over period indexes, so a
+multi-year series for a large company costs a few milliseconds instead of a
+GROUP BY over its whole history. Finished series are cached per (scope,
+principal, granularity, range) until the next extract.
+
+The extract is reloaded on a background thread once it is older than
+`refresh_seconds` (ANALYTICS_REFRESH_SECONDS); requests keep answering from
+the previous extract meanwhile, so charts lag the database by about that long.
+
+Revenue is counted on the day a completed rental ends, like the rollups in
+revenue.py: owner income is total_amount less commission and handling fee,
+company revenue is commission plus handling fee. Utilization is the share of
+the scope's cars that were out on a rental (active or completed) each day,
+averaged over the period, against today's fleet.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from itertools import chain
+from datetime import date, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import Integer, case, cast, func, select
+
+from models import db, Car, RentalHistory
+
+GRANULARITIES = ('day', 'week', 'month')
+MAX_PERIODS = {'day': 1100, 'week': 530, 'month': 240}
+DEFAULT_SPAN_DAYS = {'day': 30, 'week': 7 * 12, 'month': 365}
+EXTRACT_CHUNK = 100000
+
+COMPLETED, ACTIVE = 1, 2  # status codes in the extract; anything else is 0
+EPOCH = date(1970, 1, 1)
+
+Extract = namedtuple('Extract', [
+    'car_id', 'company_id', 'status', 'start_day', 'end_day', 'total_amount', 'commission', 'handling_fee',
+    'car_exists', 'car_owner', 'car_company', 'loaded_at',
+])
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+def day_number(column):
+    """Days since 1970-01-01 of a DateTime column, computed by the database."""
+    if db.engine.url.get_backend_name() == 'sqlite':
+        return cast(func.julianday(column) - 2440587.5, Integer)
+    return cast(func.floor(func.extract('epoch', column) / 86400), Integer)
+
+
+def fetch_columns(connection, query, count):
+    """Run query and return its result as count float64 arrays, filled EXTRACT_CHUNK rows at a time."""
+    # fromiter over the flattened rows is far faster than np.asarray on Row objects
+    parts = [np.fromiter(chain.from_iterable(rows), dtype=np.float64, count=len(rows) * count).reshape(-1, count)
+             for rows in connection.execution_options(yield_per=EXTRACT_CHUNK).execute(query).partitions()]
+    table = np.concatenate(parts) if parts else np.empty((0, count))
+    return [table[:, i] for i in range(count)]
+
+
+def load_extract():
+    """Read every rental and car into an Extract."""
+    rental = RentalHistory
+    status = case((rental.status == 'completed', COMPLETED), (rental.status == 'active', ACTIVE), else_=0)
+    rentals = select(
+        rental.car_id, rental.rental_company_id, status, day_number(rental.start_date), day_number(rental.end_date),
+        rental.total_amount, rental.commission, rental.handling_fee,
+    )
+    cars = select(Car.id, Car.owner_id, func.coalesce(Car.rental_company_id, 0))
+
+    # Rentals first, so every car they mention is already in the car table
+    with db.engine.connect() as connection:
+        columns = fetch_columns(connection, rentals, 8)
+        car_id, owner_id, company_id = fetch_columns(connection, cars, 3)
+
+    rental_car, rental_company, status, start_day, end_day = (column.astype(np.int64) for column in columns[:5])
+    car_id = car_id.astype(np.int64)
+    # Per-car lookups indexed by car id; slot 0 and deleted ids are no car
+    size = int(max(car_id.max(initial=0), rental_car.max(initial=0))) + 1
+    car_exists = np.zeros(size, dtype=bool)
+    car_owner = np.zeros(size, dtype=np.int64)
+    car_company = np.zeros(size, dtype=np.int64)
+    car_exists[car_id] = True
+    car_owner[car_id] = owner_id
+    car_company[car_id] = company_id
+
+    return Extract(rental_car, rental_company, status.astype(np.int8), start_day, end_day, *columns[5:],
+                   car_exists, car_owner, car_company, time.monotonic())
+
+
+def _day(value):
+    return (value - EPOCH).days
+
+
+def period_bounds(granularity, start, end):
+    """Day numbers where each period of [start, end] begins, plus the day after end."""
+    if granularity == 'day':
+        return np.arange(_day(start), _day(end) + 2)
+    if granularity == 'week':
+        first = start - timedelta(days=start.weekday())  # Mondays
+        return np.append(np.arange(_day(first), _day(end) + 1, 7), _day(end) + 1)
+    months = np.arange(np.datetime64(start, 'M'), np.datetime64(end, 'M') + 1)
+    return np.append(months.astype('datetime64[D]').astype(np.int64), _day(end) + 1)
+
+
+def period_labels(granularity, bounds):
+    days = bounds[:-1].astype('datetime64[D]')
+    if granularity == 'month':
+        return [str(month) for month in days.astype('datetime64[M]')]
+    return [str(day) for day in days]
+
+
+def series(extract, granularity, start, end, owner_id=None, company_id=None):
+    """Revenue, completed rentals and utilization per period for one owner, one company, or everyone."""
+    if granularity not in GRANULARITIES:
+        raise AnalyticsError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if end < start:
+        raise AnalyticsError('end is before start')
+    bounds = period_bounds(granularity, start, end)
+    periods = len(bounds) - 1
+    if periods > MAX_PERIODS[granularity]:
+        raise AnalyticsError(f'at most {MAX_PERIODS[granularity]} {granularity}s per request')
+    first_day, stop_day = max(int(bounds[0]), _day(start)), int(bounds[-1])
+
+    if owner_id is not None:
+        in_scope = extract.car_owner[extract.car_id] == owner_id
+        fleet_cars = extract.car_owner == owner_id
+        amount = extract.total_amount - extract.commission - extract.handling_fee
+    elif company_id is not None:
+        in_scope = extract.company_id == company_id
+        fleet_cars = extract.car_company == company_id
+        amount = extract.commission + extract.handling_fee
+    else:
+        in_scope = np.ones(len(extract.car_id), dtype=bool)
+        fleet_cars = extract.car_exists
+        amount = extract.commission + extract.handling_fee
+
+    # Revenue: completed rentals by the period their end day falls in
+    done = in_scope & (extract.status == COMPLETED) & (extract.end_day >= first_day) & (extract.end_day < stop_day)
+    period = np.searchsorted(bounds, extract.end_day[done], side='right') - 1
+    revenue = np.bincount(period, weights=amount[done], minlength=periods)
+    completed = np.bincount(period, minlength=periods)
+
+    # Utilization: +1 on the first busy day, -1 on the day after, then a running sum
+    driven = fleet_cars[extract.car_id] & (extract.status != 0) \
+        & (extract.start_day < stop_day) & (extract.end_day > first_day)
+    span = stop_day - first_day
+    starts = np.clip(extract.start_day[driven] - first_day, 0, span)
+    ends = np.clip(extract.end_day[driven] - first_day, 0, span)
+    busy = np.cumsum(np.bincount(starts, minlength=span + 1) - np.bincount(ends, minlength=span + 1))[:span]
+    day_period = np.searchsorted(bounds, np.arange(first_day, stop_day), side='right') - 1
+    busy_days = np.bincount(day_period, weights=busy, minlength=periods)
+    fleet = int(fleet_cars.sum())
+    capacity = np.bincount(day_period, minlength=periods) * fleet
+    utilization = np.divide(busy_days, capacity, out=np.zeros(periods), where=capacity > 0)
+
+    return {
+        'granularity': granularity,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'periods': period_labels(granularity, bounds),
+        'revenue': np.round(revenue, 2).tolist(),
+        'completed_rentals': completed.tolist(),
+        'utilization': np.round(utilization, 4).tolist(),
+        'fleet_size': fleet,
+    }
+
+
+def default_range(granularity, today=None):
+    end = today or date.today()
+    return end - timedelta(days=DEFAULT_SPAN_DAYS.get(granularity, 30) - 1), end
+
+
+class RevenueAnalytics:
+    def __init__(self, refresh_seconds=300, maxsize=1024):
+        self.refresh_seconds = refresh_seconds
+        self.maxsize = maxsize
+        self._extract = None
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def extract(self):
+        """The current extract; the first call loads it, later ones reload it in the background when stale."""
+        current = self._extract
+        if current is not None and time.monotonic() - current.loaded_at <= self.refresh_seconds:
+            return current
+        if current is None:
+            with self._reload_lock:
+                if self._extract is None:
+                    self._reload()
+            return self._extract
+        # One background reload at a time; requests keep answering from the current extract
+        if self._reload_lock.acquire(blocking=False):
+            app = current_app._get_current_object()
+            threading.Thread(target=self._reload_in_background, args=(app,), name='analytics-extract',
+                             daemon=True).start()
+        return current
+
+    def _reload(self):
+        self._extract = load_extract()
+        with self._lock:
+            self._results.clear()
+
+    def _reload_in_background(self, app):
+        try:
+            with app.app_context():
+                self._reload()
+        except Exception:
+            app.logger.exception('Reloading the analytics extract failed')
+        finally:
+            self._reload_lock.release()
+
+    def series(self, granularity, start, end, owner_id=None, company_id=None):
+        extract = self.extract()
+        key = (owner_id, company_id, granularity, start, end, extract.loaded_at)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                return result
+        result = series(extract, granularity, start, end, owner_id, company_id)
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._extract = None
+            self._results.clear()
+
+
+# Global analytics instance
+revenue_analytics = RevenueAnalytics()
@@ -1,8 +1,7 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import os
 import cv2
 import numpy as np
@@ -12,92 +11,51 @@ import threading
 import time
 import json
 from functools import wraps
+from sqlalchemy.orm import joinedload, contains_eager
+from models import db, User, Car, RentalCompany, Rental, RentalHistory, DriverMonitoring, RevenueTotal, SafetyMonthly, create_schema
+import database
+import analytics
+import export
+import admission
+import archive
+import revenue
+import safety
+import sql_profiler
+import metrics
+import car_search
+import availability
+import booking
+import lifecycle
+from query_budget import query_budget
+from admission import rate_limited
+from analytics import revenue_analytics
+from identity_cache import load_identity
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///car_rental.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
+app.config['SQL_PROFILING'] = os.environ.get('SQL_PROFILING', '').lower() in ('1', 'true', 'yes')
+app.config['SQL_PROFILE_SAMPLE_RATE'] = float(os.environ.get('SQL_PROFILE_SAMPLE_RATE', 0.05))
+app.config['LIFECYCLE_INTERVAL'] = float(os.environ.get('LIFECYCLE_INTERVAL', 60))  # seconds; 0 = run lifecycle.py separately
+app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+# Monitoring admission limits (admission.py); bookings are never limited
+app.config['MONITORING_MAX_SESSIONS'] = int(os.environ.get('MONITORING_MAX_SESSIONS', 50))
+app.config['MONITORING_MAX_CALIBRATIONS'] = int(os.environ.get('MONITORING_MAX_CALIBRATIONS', 2))
+app.config['MONITORING_INGEST_RATE'] = float(os.environ.get('MONITORING_INGEST_RATE', 5))  # posts per second per user
+app.config['MONITORING_SESSION_IDLE_SECONDS'] = int(os.environ.get('MONITORING_SESSION_IDLE_SECONDS', 120))
+# Refuse bookings from customers whose risk score (risk.py) reaches this; unset = never
+app.config['BOOKING_MAX_RISK_SCORE'] = float(os.environ['BOOKING_MAX_RISK_SCORE']) if os.environ.get('BOOKING_MAX_RISK_SCORE') else None
+
+database.init_app(app)  # DATABASE_URL and engine profile from the environment / .env
+archive.init_app(app)
+sql_profiler.init_app(app)
+metrics.init_app(app)
+admission.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# Database Models
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
-    role = db.Column(db.String(20), nullable=False)  # 'admin', 'car_owner', 'rental_company', 'customer'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    cars = db.relationship('Car', backref='owner', lazy=True)
-    rentals = db.relationship('Rental', backref='customer', lazy=True)
-    company = db.relationship('RentalCompany', backref='user', uselist=False)
-
-class Car(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    make = db.Column(db.String(50), nullable=False)
-    model = db.Column(db.String(50), nullable=False)
-    year = db.Column(db.Integer, nullable=False)
-    license_plate = db.Column(db.String(20), unique=True, nullable=False)
-    color = db.Column(db.String(20), nullable=False)
-    daily_rate = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='available')  # 'available', 'rented', 'maintenance'
-    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    rental_company_id = db.Column(db.Integer, db.ForeignKey('rental_company.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    rentals = db.relationship('Rental', backref='car', lazy=True)
-    monitoring_data = db.relationship('DriverMonitoring', backref='car', lazy=True)
-
-class RentalCompany(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    address = db.Column(db.Text, nullable=False)
-    phone = db.Column(db.String(20), nullable=False)
-    commission_rate = db.Column(db.Float, default=0.15)  # 15% commission
-    handling_fee = db.Column(db.Float, default=50.0)  # $50 handling fee
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    cars = db.relationship('Car', backref='rental_company', lazy=True)
-    rentals = db.relationship('Rental', backref='rental_company', lazy=True)
-
-class Rental(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
-    customer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    rental_company_id = db.Column(db.Integer, db.ForeignKey('rental_company.id'), nullable=False)
-    start_date = db.Column(db.DateTime, nullable=False)
-    end_date = db.Column(db.DateTime, nullable=False)
-    daily_rate = db.Column(db.Float, nullable=False)
-    total_amount = db.Column(db.Float, nullable=False)
-    commission = db.Column(db.Float, nullable=False)
-    handling_fee = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='active')  # 'active', 'completed', 'cancelled'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    monitoring_sessions = db.relationship('DriverMonitoring', backref='rental', lazy=True)
-
-class DriverMonitoring(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    rental_id = db.Column(db.Integer, db.ForeignKey('rental.id'), nullable=False)
-    car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
-    driver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    session_start = db.Column(db.DateTime, nullable=False)
-    session_end = db.Column(db.DateTime)
-    total_blinks = db.Column(db.Integer, default=0)
-    drowsiness_alerts = db.Column(db.Integer, default=0)
-    avg_ear = db.Column(db.Float)  # Average Eye Aspect Ratio
-    status = db.Column(db.String(20), default='active')  # 'active', 'completed'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
 # Fatigue Detection System Integration
 class FatigueDetector:
     def __init__(self):
@@ -244,7 +202,7 @@ fatigue_detector = FatigueDetector()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_identity(int(user_id))
 
 # Role-based access control decorator
 def role_required(roles):
@@ -333,32 +291,51 @@ def dashboard():
 @app.route('/admin')
 @login_required
 @role_required(['admin'])
+@query_budget(8)
 def admin_dashboard():
     stats = {
         'total_users': User.query.count(),
         'total_cars': Car.query.count(),
-        'total_rentals': Rental.query.count(),
+        'total_rentals': archive.rental_count(),
         'active_rentals': Rental.query.filter_by(status='active').count(),
         'total_companies': RentalCompany.query.count()
     }
     
-    recent_rentals = Rental.query.order_by(Rental.created_at.desc()).limit(10).all()
-    recent_monitoring = DriverMonitoring.query.order_by(DriverMonitoring.created_at.desc()).limit(10).all()
+    recent_rentals = Rental.query.options(joinedload(Rental.customer), joinedload(Rental.car)) \
+        .order_by(Rental.created_at.desc()).limit(10).all()
+    recent_monitoring = DriverMonitoring.query.options(joinedload(DriverMonitoring.car)) \
+        .order_by(DriverMonitoring.created_at.desc()).limit(10).all()
     
     return render_template('admin_dashboard.html', stats=stats, recent_rentals=recent_rentals, recent_monitoring=recent_monitoring)
 
+@app.route('/admin/sql_profile')
+@login_required
+@role_required(['admin'])
+def sql_profile_report():
+    return jsonify({
+        "enabled": app.config['SQL_PROFILING'],
+        "sample_rate": app.config['SQL_PROFILE_SAMPLE_RATE'],
+        "endpoints": sql_profiler.profiler.report()
+    })
+
+@app.route('/admin/sql_profile/reset', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def reset_sql_profile():
+    sql_profiler.profiler.reset()
+    return jsonify({"status": "reset"})
+
 # Car Owner Dashboard
 @app.route('/car_owner')
 @login_required
 @role_required(['car_owner'])
+@query_budget(4)
 def car_owner_dashboard():
     cars = Car.query.filter_by(owner_id=current_user.id).all()
-    active_rentals = Rental.query.join(Car).filter(Car.owner_id == current_user.id, Rental.status == 'active').all()
+    active_rentals = Rental.query.join(Car).options(contains_eager(Rental.car), joinedload(Rental.customer)) \
+        .filter(Car.owner_id == current_user.id, Rental.status == 'active').all()
     
-    # Calculate total income
-    total_income = 0
-    for rental in Rental.query.join(Car).filter(Car.owner_id == current_user.id, Rental.status == 'completed'):
-        total_income += rental.total_amount - rental.commission - rental.handling_fee
+    total_income = revenue.owner_income(current_user.id)
     
     return render_template('car_owner_dashboard.html', cars=cars, active_rentals=active_rentals, total_income=total_income)
 
@@ -366,42 +343,130 @@ def car_owner_dashboard():
 @app.route('/rental_company')
 @login_required
 @role_required(['rental_company'])
+@query_budget(5)
 def rental_company_dashboard():
-    company = RentalCompany.query.filter_by(user_id=current_user.id).first()
+    company = RentalCompany.query.get(current_user.company_id) if current_user.company_id else None
     if not company:
         flash('Please complete your company profile first', 'error')
         return redirect(url_for('setup_company'))
     
-    cars = Car.query.filter_by(rental_company_id=company.id).all()
-    active_rentals = Rental.query.filter_by(rental_company_id=company.id, status='active').all()
+    cars = Car.query.options(joinedload(Car.owner)).filter_by(rental_company_id=company.id).all()
+    active_rentals = Rental.query.options(joinedload(Rental.customer), joinedload(Rental.car)) \
+        .filter_by(rental_company_id=company.id, status='active').all()
     
-    # Calculate total revenue
-    total_revenue = 0
-    for rental in Rental.query.filter_by(rental_company_id=company.id, status='completed'):
-        total_revenue += rental.commission + rental.handling_fee
+    total_revenue = revenue.company_revenue(company.id)
     
     return render_template('rental_company_dashboard.html', company=company, cars=cars, active_rentals=active_rentals, total_revenue=total_revenue)
 
+# Revenue and utilization over time for the dashboard charts
+@app.route('/api/analytics/revenue')
+@login_required
+def revenue_over_time():
+    if current_user.role == 'car_owner':
+        scope = {'owner_id': current_user.id}
+    elif current_user.role == 'rental_company':
+        if not current_user.company_id:
+            return jsonify({"error": "Company profile not set up"}), 400
+        scope = {'company_id': current_user.company_id}
+    elif current_user.role == 'admin':
+        scope = {name: request.args.get(name, type=int) for name in ('owner_id', 'company_id')}
+    else:
+        return jsonify({"error": "Access denied"}), 403
+    
+    granularity = request.args.get('granularity', 'month')
+    try:
+        start, end = analytics.default_range(granularity)
+        if request.args.get('start'):
+            start = date.fromisoformat(request.args['start'])
+        if request.args.get('end'):
+            end = date.fromisoformat(request.args['end'])
+        series = revenue_analytics.series(granularity, start, end, **scope)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify(dict(series, measure='owner_income' if scope.get('owner_id') else 'company_revenue'))
+
+# Cars or drivers ranked by drowsiness alerts per monitored hour
+@app.route('/api/safety/ranking')
+@login_required
+def safety_ranking():
+    if current_user.role == 'car_owner':
+        scope = {'owner_id': current_user.id}
+    elif current_user.role == 'rental_company':
+        if not current_user.company_id:
+            return jsonify({"error": "Company profile not set up"}), 400
+        scope = {'company_id': current_user.company_id}
+    elif current_user.role == 'admin':
+        scope = {name: request.args.get(name, type=int) for name in ('owner_id', 'company_id')}
+    else:
+        return jsonify({"error": "Access denied"}), 403
+    
+    by = request.args.get('by', 'driver')
+    try:
+        start, end = safety.default_range()
+        if request.args.get('start'):
+            start = date.fromisoformat(request.args['start'])
+        if request.args.get('end'):
+            end = date.fromisoformat(request.args['end'])
+        ranked = safety.ranking(by, start, end, limit=request.args.get('limit', 20, type=int),
+                                min_hours=request.args.get('min_hours', 1.0, type=float), **scope)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({'by': by, 'start': start.isoformat(), 'end': end.isoformat(), 'ranking': ranked})
+
+# History export, streamed so large histories don't sit in memory
+@app.route('/export/<dataset>')
+@login_required
+@role_required(['admin', 'car_owner', 'rental_company'])
+def export_history(dataset):
+    if dataset not in export.DATASETS:
+        return jsonify({"error": f"Unknown export {dataset!r}"}), 404
+    scope = {}
+    if current_user.role == 'car_owner':
+        scope['owner_id'] = current_user.id
+    elif current_user.role == 'rental_company':
+        if not current_user.company_id:
+            flash('Please setup your company profile first', 'error')
+            return redirect(url_for('setup_company'))
+        scope['company_id'] = current_user.company_id
+    
+    fmt = request.args.get('format', 'csv')
+    try:
+        pieces = export.stream(db.engine, export.DATASETS[dataset](**scope), fmt)
+    except export.ExportError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return Response(pieces, mimetype=export.FORMATS[fmt][0], headers={
+        'Content-Disposition': f'attachment; filename={export.filename(dataset, fmt)}'
+    })
+
 # Customer Dashboard
 @app.route('/customer')
 @login_required
 @role_required(['customer'])
+@query_budget(3)
 def customer_dashboard():
-    active_rentals = Rental.query.filter_by(customer_id=current_user.id, status='active').all()
-    rental_history = Rental.query.filter_by(customer_id=current_user.id).order_by(Rental.created_at.desc()).limit(10).all()
+    active_rentals = Rental.query.options(joinedload(Rental.car)) \
+        .filter_by(customer_id=current_user.id, status='active').all()
+    rental_history = RentalHistory.query.options(joinedload(RentalHistory.car)) \
+        .filter_by(customer_id=current_user.id).order_by(RentalHistory.created_at.desc()).limit(10).all()
     
     return render_template('customer_dashboard.html', active_rentals=active_rentals, rental_history=rental_history)
 
 # Driver Monitoring Routes
 @app.route('/monitor/<int:rental_id>')
 @login_required
+@query_budget(2)
 def monitor_driver(rental_id):
-    rental = Rental.query.get_or_404(rental_id)
+    rental = Rental.query.options(
+        joinedload(Rental.car), joinedload(Rental.customer), joinedload(Rental.rental_company)
+    ).get_or_404(rental_id)
     
     # Check if user has permission to monitor this rental
     if (current_user.role == 'customer' and rental.customer_id != current_user.id) or \
        (current_user.role == 'car_owner' and rental.car.owner_id != current_user.id) or \
-       (current_user.role == 'rental_company' and rental.rental_company_id != current_user.company.id):
+       (current_user.role == 'rental_company' and rental.rental_company.user_id != current_user.id):
         flash('Access denied', 'error')
         return redirect(url_for('dashboard'))
     
@@ -438,6 +503,7 @@ def stop_monitoring(session_id):
 
 @app.route('/api/monitor/process', methods=['POST'])
 @login_required
+@rate_limited(lambda: current_user.id)
 def process_monitoring_data():
     data = request.get_json()
     session_id = data.get('session_id')
@@ -512,45 +578,28 @@ def book_car(car_id):
         start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d')
         end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d')
         
-        # Calculate rental duration and cost
-        duration = (end_date - start_date).days
-        total_amount = car.daily_rate * duration
-        
-        # Find available rental company
-        rental_company = RentalCompany.query.first()  # Simplified - in real app, you'd have logic to assign companies
+        if end_date <= start_date:
+            flash('End date must be after start date', 'error')
+            return render_template('book_car.html', car=car)
         
-        if rental_company:
-            commission = total_amount * rental_company.commission_rate
-            handling_fee = rental_company.handling_fee
-            
-            rental = Rental(
-                car_id=car_id,
-                customer_id=current_user.id,
-                rental_company_id=rental_company.id,
-                start_date=start_date,
-                end_date=end_date,
-                daily_rate=car.daily_rate,
-                total_amount=total_amount,
-                commission=commission,
-                handling_fee=handling_fee
-            )
-            
-            # Update car status
-            car.status = 'rented'
-            
-            db.session.add(rental)
-            db.session.commit()
-            
+        try:
+            booking.book_car(car.id, current_user.id, start_date, end_date,
+                             max_risk_score=app.config['BOOKING_MAX_RISK_SCORE'])
+        except booking.BookingError as e:
+            flash(str(e), 'error')
+        else:
             flash('Car booked successfully!', 'success')
             return redirect(url_for('customer_dashboard'))
-        else:
-            flash('No rental company available', 'error')
     
     return render_template('book_car.html', car=car)
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        create_schema()
+        if not RevenueTotal.query.first():
+            revenue.rebuild_rollups()
+        if not SafetyMonthly.query.first():
+            safety.rebuild_rollups()
         
         # Create admin user if it doesn't exist
         if not User.query.filter_by(username='admin').first():
@@ -563,4 +612,8 @@ if __name__ == '__main__':
             db.session.add(admin)
             db.session.commit()
     
+    # Only in the reloader's serving process, not its watcher
+    if app.config['LIFECYCLE_INTERVAL'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        lifecycle.LifecycleScheduler(app, app.config['LIFECYCLE_INTERVAL']).start()
+    
     app.run(debug=True)
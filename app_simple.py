@@ -1,19 +1,65 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import os
 import json
 from functools import wraps
+from sqlalchemy.orm import joinedload, contains_eager
+from models import db, User, Car, RentalCompany, Rental, RentalHistory, DriverMonitoring, RevenueTotal, SafetyMonthly, create_schema
+import database
+import analytics
+import export
+import admission
+import archive
+import revenue
+import safety
+import sql_profiler
+import metrics
+import car_browse
+import car_search
+import availability
+import booking
+import lifecycle
+import quoting
+from query_budget import query_budget
+from admission import rate_limited
+from analytics import revenue_analytics
+from identity_cache import identity_cache, load_identity
+from stats_cache import stats_cache, stats_key
 from monitoring_routes import monitoring_bp
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///car_rental.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
+app.config['STATS_CACHE_TTL'] = 30  # seconds
+app.config['IDENTITY_CACHE_TTL'] = 60  # seconds
+app.config['ANALYTICS_REFRESH_SECONDS'] = 300  # how stale the revenue charts may get
+app.config['SQL_PROFILING'] = os.environ.get('SQL_PROFILING', '').lower() in ('1', 'true', 'yes')
+app.config['SQL_PROFILE_SAMPLE_RATE'] = float(os.environ.get('SQL_PROFILE_SAMPLE_RATE', 0.05))
+# Camera streams served by streaming_server instead of Flask worker threads
+app.config['STREAMING_PORT'] = int(os.environ.get('STREAMING_PORT', 0)) or None
+app.config['STREAMING_URL'] = os.environ.get('STREAMING_URL', '')  # e.g. http://localhost:5001; '' = same origin
+app.config['STREAMING_ALLOW_ORIGIN'] = os.environ.get('STREAMING_ALLOW_ORIGIN') or None
+app.config['LIFECYCLE_INTERVAL'] = float(os.environ.get('LIFECYCLE_INTERVAL', 60))  # seconds; 0 = run lifecycle.py separately
+app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+# Monitoring admission limits (admission.py); bookings are never limited
+app.config['MONITORING_MAX_SESSIONS'] = int(os.environ.get('MONITORING_MAX_SESSIONS', 50))
+app.config['MONITORING_MAX_CALIBRATIONS'] = int(os.environ.get('MONITORING_MAX_CALIBRATIONS', 2))
+app.config['MONITORING_INGEST_RATE'] = float(os.environ.get('MONITORING_INGEST_RATE', 5))  # posts per second per user
+app.config['MONITORING_SESSION_IDLE_SECONDS'] = int(os.environ.get('MONITORING_SESSION_IDLE_SECONDS', 120))
+# Refuse bookings from customers whose risk score (risk.py) reaches this; unset = never
+app.config['BOOKING_MAX_RISK_SCORE'] = float(os.environ['BOOKING_MAX_RISK_SCORE']) if os.environ.get('BOOKING_MAX_RISK_SCORE') else None
+
+database.init_app(app)  # DATABASE_URL and engine profile from the environment / .env
+stats_cache.ttl = app.config['STATS_CACHE_TTL']
+identity_cache.ttl = app.config['IDENTITY_CACHE_TTL']
+revenue_analytics.refresh_seconds = app.config['ANALYTICS_REFRESH_SECONDS']
+archive.init_app(app)
+sql_profiler.init_app(app)
+metrics.init_app(app)
+admission.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -21,81 +67,6 @@ login_manager.login_view = 'login'
 # Register monitoring blueprint
 app.register_blueprint(monitoring_bp)
 
-# Database Models
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
-    role = db.Column(db.String(20), nullable=False)  # 'admin', 'car_owner', 'rental_company', 'customer'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    cars = db.relationship('Car', backref='owner', lazy=True)
-    rentals = db.relationship('Rental', backref='customer', lazy=True)
-    company = db.relationship('RentalCompany', backref='user', uselist=False)
-
-class Car(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    make = db.Column(db.String(50), nullable=False)
-    model = db.Column(db.String(50), nullable=False)
-    year = db.Column(db.Integer, nullable=False)
-    license_plate = db.Column(db.String(20), unique=True, nullable=False)
-    color = db.Column(db.String(20), nullable=False)
-    daily_rate = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='available')  # 'available', 'rented', 'maintenance'
-    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    rental_company_id = db.Column(db.Integer, db.ForeignKey('rental_company.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    rentals = db.relationship('Rental', backref='car', lazy=True)
-    monitoring_data = db.relationship('DriverMonitoring', backref='car', lazy=True)
-
-class RentalCompany(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    address = db.Column(db.Text, nullable=False)
-    phone = db.Column(db.String(20), nullable=False)
-    commission_rate = db.Column(db.Float, default=0.15)  # 15% commission
-    handling_fee = db.Column(db.Float, default=50.0)  # $50 handling fee
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    cars = db.relationship('Car', backref='rental_company', lazy=True)
-    rentals = db.relationship('Rental', backref='rental_company', lazy=True)
-
-class Rental(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
-    customer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    rental_company_id = db.Column(db.Integer, db.ForeignKey('rental_company.id'), nullable=False)
-    start_date = db.Column(db.DateTime, nullable=False)
-    end_date = db.Column(db.DateTime, nullable=False)
-    daily_rate = db.Column(db.Float, nullable=False)
-    total_amount = db.Column(db.Float, nullable=False)
-    commission = db.Column(db.Float, nullable=False)
-    handling_fee = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='active')  # 'active', 'completed', 'cancelled'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    # Relationships
-    monitoring_sessions = db.relationship('DriverMonitoring', backref='rental', lazy=True)
-
-class DriverMonitoring(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    rental_id = db.Column(db.Integer, db.ForeignKey('rental.id'), nullable=False)
-    car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
-    driver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    session_start = db.Column(db.DateTime, nullable=False)
-    session_end = db.Column(db.DateTime)
-    total_blinks = db.Column(db.Integer, default=0)
-    drowsiness_alerts = db.Column(db.Integer, default=0)
-    avg_ear = db.Column(db.Float)  # Average Eye Aspect Ratio
-    status = db.Column(db.String(20), default='active')  # 'active', 'completed'
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
 # Simplified Fatigue Detection (Mock for demo)
 class MockFatigueDetector:
     def __init__(self):
@@ -129,7 +100,7 @@ fatigue_detector = MockFatigueDetector()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_identity(int(user_id))
 
 # Role-based access control decorator
 def role_required(roles):
@@ -190,6 +161,7 @@ def register():
         
         db.session.add(user)
         db.session.commit()
+        stats_cache.invalidate(stats_key('admin'))
         
         flash('Registration successful! Please login.', 'success')
         return redirect(url_for('login'))
@@ -218,32 +190,51 @@ def dashboard():
 @app.route('/admin')
 @login_required
 @role_required(['admin'])
+@query_budget(8)
 def admin_dashboard():
     stats = {
         'total_users': User.query.count(),
         'total_cars': Car.query.count(),
-        'total_rentals': Rental.query.count(),
+        'total_rentals': archive.rental_count(),
         'active_rentals': Rental.query.filter_by(status='active').count(),
         'total_companies': RentalCompany.query.count()
     }
     
-    recent_rentals = Rental.query.order_by(Rental.created_at.desc()).limit(10).all()
-    recent_monitoring = DriverMonitoring.query.order_by(DriverMonitoring.created_at.desc()).limit(10).all()
+    recent_rentals = Rental.query.options(joinedload(Rental.customer), joinedload(Rental.car)) \
+        .order_by(Rental.created_at.desc()).limit(10).all()
+    recent_monitoring = DriverMonitoring.query.options(joinedload(DriverMonitoring.car)) \
+        .order_by(DriverMonitoring.created_at.desc()).limit(10).all()
     
     return render_template('admin_dashboard.html', stats=stats, recent_rentals=recent_rentals, recent_monitoring=recent_monitoring)
 
+@app.route('/admin/sql_profile')
+@login_required
+@role_required(['admin'])
+def sql_profile_report():
+    return jsonify({
+        "enabled": app.config['SQL_PROFILING'],
+        "sample_rate": app.config['SQL_PROFILE_SAMPLE_RATE'],
+        "endpoints": sql_profiler.profiler.report()
+    })
+
+@app.route('/admin/sql_profile/reset', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def reset_sql_profile():
+    sql_profiler.profiler.reset()
+    return jsonify({"status": "reset"})
+
 # Car Owner Dashboard
 @app.route('/car_owner')
 @login_required
 @role_required(['car_owner'])
+@query_budget(4)
 def car_owner_dashboard():
     cars = Car.query.filter_by(owner_id=current_user.id).all()
-    active_rentals = Rental.query.join(Car).filter(Car.owner_id == current_user.id, Rental.status == 'active').all()
+    active_rentals = Rental.query.join(Car).options(contains_eager(Rental.car), joinedload(Rental.customer)) \
+        .filter(Car.owner_id == current_user.id, Rental.status == 'active').all()
     
-    # Calculate total income
-    total_income = 0
-    for rental in Rental.query.join(Car).filter(Car.owner_id == current_user.id, Rental.status == 'completed'):
-        total_income += rental.total_amount - rental.commission - rental.handling_fee
+    total_income = revenue.owner_income(current_user.id)
     
     return render_template('car_owner_dashboard.html', cars=cars, active_rentals=active_rentals, total_income=total_income)
 
@@ -251,19 +242,18 @@ def car_owner_dashboard():
 @app.route('/rental_company')
 @login_required
 @role_required(['rental_company'])
+@query_budget(5)
 def rental_company_dashboard():
-    company = RentalCompany.query.filter_by(user_id=current_user.id).first()
+    company = RentalCompany.query.get(current_user.company_id) if current_user.company_id else None
     if not company:
         flash('Please complete your company profile first', 'error')
         return redirect(url_for('setup_company'))
     
-    cars = Car.query.filter_by(rental_company_id=company.id).all()
-    active_rentals = Rental.query.filter_by(rental_company_id=company.id, status='active').all()
+    cars = Car.query.options(joinedload(Car.owner)).filter_by(rental_company_id=company.id).all()
+    active_rentals = Rental.query.options(joinedload(Rental.customer), joinedload(Rental.car)) \
+        .filter_by(rental_company_id=company.id, status='active').all()
     
-    # Calculate total revenue
-    total_revenue = 0
-    for rental in Rental.query.filter_by(rental_company_id=company.id, status='completed'):
-        total_revenue += rental.commission + rental.handling_fee
+    total_revenue = revenue.company_revenue(company.id)
     
     return render_template('rental_company_dashboard.html', company=company, cars=cars, active_rentals=active_rentals, total_revenue=total_revenue)
 
@@ -271,26 +261,32 @@ def rental_company_dashboard():
 @app.route('/customer')
 @login_required
 @role_required(['customer'])
+@query_budget(3)
 def customer_dashboard():
-    active_rentals = Rental.query.filter_by(customer_id=current_user.id, status='active').all()
-    rental_history = Rental.query.filter_by(customer_id=current_user.id).order_by(Rental.created_at.desc()).limit(10).all()
+    active_rentals = Rental.query.options(joinedload(Rental.car)) \
+        .filter_by(customer_id=current_user.id, status='active').all()
+    rental_history = RentalHistory.query.options(joinedload(RentalHistory.car)) \
+        .filter_by(customer_id=current_user.id).order_by(RentalHistory.created_at.desc()).limit(10).all()
     
     return render_template('customer_dashboard.html', active_rentals=active_rentals, rental_history=rental_history)
 
 # Driver Monitoring Routes
 @app.route('/monitor/<int:rental_id>')
 @login_required
+@query_budget(2)
 def monitor_driver(rental_id):
-    rental = Rental.query.get_or_404(rental_id)
+    rental = Rental.query.options(
+        joinedload(Rental.car), joinedload(Rental.customer), joinedload(Rental.rental_company)
+    ).get_or_404(rental_id)
     
     # Check if user has permission to monitor this rental
     if (current_user.role == 'customer' and rental.customer_id != current_user.id) or \
        (current_user.role == 'car_owner' and rental.car.owner_id != current_user.id) or \
-       (current_user.role == 'rental_company' and rental.rental_company_id != current_user.company.id):
+       (current_user.role == 'rental_company' and rental.rental_company.user_id != current_user.id):
         flash('Access denied', 'error')
         return redirect(url_for('dashboard'))
     
-    return render_template('real_driver_monitoring.html', rental=rental)
+    return render_template('real_driver_monitoring.html', rental=rental, streaming_url=app.config['STREAMING_URL'])
 
 @app.route('/api/monitor/start/<int:rental_id>', methods=['POST'])
 @login_required
@@ -323,6 +319,7 @@ def stop_monitoring(session_id):
 
 @app.route('/api/monitor/process', methods=['POST'])
 @login_required
+@rate_limited(lambda: current_user.id)
 def process_monitoring_data():
     data = request.get_json()
     session_id = data.get('session_id')
@@ -361,6 +358,7 @@ def add_car():
         
         db.session.add(car)
         db.session.commit()
+        stats_cache.invalidate(stats_key('admin'), stats_key('car_owner', current_user.id))
         
         flash('Car added successfully!', 'success')
         return redirect(url_for('car_owner_dashboard'))
@@ -384,6 +382,7 @@ def setup_company():
         
         db.session.add(company)
         db.session.commit()
+        stats_cache.invalidate(stats_key('admin'), stats_key('rental_company', current_user.id))
         
         flash('Company profile created successfully!', 'success')
         return redirect(url_for('rental_company_dashboard'))
@@ -393,9 +392,68 @@ def setup_company():
 # Browse Cars Route
 @app.route('/cars')
 @login_required
+@query_budget(5)
 def browse_cars():
-    cars = Car.query.filter_by(status='available').all()
-    return render_template('browse_cars.html', cars=cars)
+    try:
+        filters = car_browse.parse_filters(request.args)
+        cars, next_cursor = car_browse.browse_page(filters, request.args.get('cursor'))
+    except car_browse.InvalidBrowseRequest as e:
+        flash(str(e), 'error')
+        filters = {'sort': 'newest'}
+        cars, next_cursor = car_browse.browse_page(filters)
+    
+    companies = RentalCompany.query.order_by(RentalCompany.name).all()
+    return render_template('browse_cars.html', cars=cars, filters=filters, next_cursor=next_cursor, companies=companies)
+
+@app.route('/api/cars')
+@login_required
+def api_browse_cars():
+    try:
+        filters = car_browse.parse_filters(request.args)
+        limit = request.args.get('limit', car_browse.PAGE_SIZE, type=int)
+        cars, next_cursor = car_browse.browse_page(filters, request.args.get('cursor'), limit)
+    except car_browse.InvalidBrowseRequest as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({
+        "cars": [car_browse.car_to_dict(car) for car in cars],
+        "next_cursor": next_cursor
+    })
+
+@app.route('/api/cars/<int:car_id>/availability')
+@login_required
+def car_availability(car_id):
+    car = Car.query.get_or_404(car_id)
+    try:
+        filters = car_browse.parse_filters(request.args)
+    except car_browse.InvalidBrowseRequest as e:
+        return jsonify({"error": str(e)}), 400
+    
+    period = car_browse.rental_period(filters)
+    if period is None:
+        return jsonify({"error": "start_date and end_date are required"}), 400
+    
+    return jsonify({
+        "car_id": car.id,
+        "available": car.status != 'maintenance' and availability.is_car_free(car.id, *period),
+        "booked": [[start.isoformat(), end.isoformat()]
+                   for start, end in availability.availability_index.busy_periods(car.id)]
+    })
+
+@app.route('/api/quotes', methods=['POST'])
+@login_required
+def bulk_quotes():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    try:
+        car_ids = [int(car_id) for car_id in data.get('car_ids', [])]
+        periods = quoting.parse_periods(data.get('periods', []))
+        quotes = quoting.quote_batch(car_ids, periods, check_availability=data.get('check_availability', True))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({"quotes": quotes})
 
 # Add Car to Company Fleet
 @app.route('/cars/add_to_fleet/<int:car_id>', methods=['POST'])
@@ -403,17 +461,17 @@ def browse_cars():
 @role_required(['rental_company'])
 def add_car_to_fleet(car_id):
     car = Car.query.get_or_404(car_id)
-    company = RentalCompany.query.filter_by(user_id=current_user.id).first()
     
-    if not company:
+    if not current_user.company_id:
         flash('Please setup your company profile first', 'error')
         return redirect(url_for('setup_company'))
     
     if car.rental_company_id:
         flash('This car is already assigned to a rental company', 'error')
     else:
-        car.rental_company_id = company.id
+        car.rental_company_id = current_user.company_id
         db.session.commit()
+        stats_cache.invalidate(stats_key('rental_company', current_user.id))
         flash(f'{car.make} {car.model} added to your fleet successfully!', 'success')
     
     return redirect(url_for('browse_cars'))
@@ -424,11 +482,11 @@ def add_car_to_fleet(car_id):
 @role_required(['rental_company'])
 def remove_car_from_fleet(car_id):
     car = Car.query.get_or_404(car_id)
-    company = RentalCompany.query.filter_by(user_id=current_user.id).first()
     
-    if car.rental_company_id == company.id:
+    if current_user.company_id and car.rental_company_id == current_user.company_id:
         car.rental_company_id = None
         db.session.commit()
+        stats_cache.invalidate(stats_key('rental_company', current_user.id))
         flash(f'{car.make} {car.model} removed from your fleet', 'success')
     else:
         flash('You can only remove cars from your own fleet', 'error')
@@ -446,94 +504,167 @@ def book_car(car_id):
         start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d')
         end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d')
         
-        # Calculate rental duration and cost
-        duration = (end_date - start_date).days
-        total_amount = car.daily_rate * duration
-        
-        # Find available rental company
-        rental_company = RentalCompany.query.first()  # Simplified - in real app, you'd have logic to assign companies
+        if end_date <= start_date:
+            flash('End date must be after start date', 'error')
+            return render_template('book_car.html', car=car)
         
-        if rental_company:
-            commission = total_amount * rental_company.commission_rate
-            handling_fee = rental_company.handling_fee
-            
-            rental = Rental(
-                car_id=car_id,
-                customer_id=current_user.id,
-                rental_company_id=rental_company.id,
-                start_date=start_date,
-                end_date=end_date,
-                daily_rate=car.daily_rate,
-                total_amount=total_amount,
-                commission=commission,
-                handling_fee=handling_fee
+        try:
+            rental = booking.book_car(car.id, current_user.id, start_date, end_date,
+                                      max_risk_score=app.config['BOOKING_MAX_RISK_SCORE'])
+        except booking.BookingError as e:
+            flash(str(e), 'error')
+        else:
+            stats_cache.invalidate(
+                stats_key('admin'),
+                stats_key('customer', current_user.id),
+                stats_key('car_owner', car.owner_id),
+                stats_key('rental_company', rental.rental_company.user_id)
             )
-            
-            # Update car status
-            car.status = 'rented'
-            
-            db.session.add(rental)
-            db.session.commit()
-            
             flash('Car booked successfully!', 'success')
             return redirect(url_for('customer_dashboard'))
-        else:
-            flash('No rental company available', 'error')
     
     return render_template('book_car.html', car=car)
 
 # API Endpoints
-@app.route('/api/dashboard/stats')
-@login_required
-def dashboard_stats():
+def compute_dashboard_stats():
     if current_user.role == 'admin':
         stats = {
             'total_users': User.query.count(),
             'total_cars': Car.query.count(),
-            'total_rentals': Rental.query.count(),
+            'total_rentals': archive.rental_count(),
             'active_rentals': Rental.query.filter_by(status='active').count(),
             'total_companies': RentalCompany.query.count()
         }
     elif current_user.role == 'car_owner':
-        cars = Car.query.filter_by(owner_id=current_user.id).all()
-        active_rentals = Rental.query.join(Car).filter(Car.owner_id == current_user.id, Rental.status == 'active').all()
-        total_income = sum(rental.total_amount - rental.commission - rental.handling_fee 
-                          for rental in Rental.query.join(Car).filter(Car.owner_id == current_user.id, Rental.status == 'completed'))
-        
         stats = {
-            'total_cars': len(cars),
-            'active_rentals': len(active_rentals),
-            'total_income': total_income
+            'total_cars': Car.query.filter_by(owner_id=current_user.id).count(),
+            'active_rentals': Rental.query.join(Car).filter(Car.owner_id == current_user.id, Rental.status == 'active').count(),
+            'total_income': revenue.owner_income(current_user.id)
         }
     elif current_user.role == 'rental_company':
-        company = RentalCompany.query.filter_by(user_id=current_user.id).first()
-        if company:
-            cars = Car.query.filter_by(rental_company_id=company.id).all()
-            active_rentals = Rental.query.filter_by(rental_company_id=company.id, status='active').all()
-            total_revenue = sum(rental.commission + rental.handling_fee 
-                              for rental in Rental.query.filter_by(rental_company_id=company.id, status='completed'))
-            
+        company_id = current_user.company_id
+        if company_id:
             stats = {
-                'fleet_size': len(cars),
-                'active_rentals': len(active_rentals),
-                'total_revenue': total_revenue
+                'fleet_size': Car.query.filter_by(rental_company_id=company_id).count(),
+                'active_rentals': Rental.query.filter_by(rental_company_id=company_id, status='active').count(),
+                'total_revenue': revenue.company_revenue(company_id)
             }
         else:
             stats = {'fleet_size': 0, 'active_rentals': 0, 'total_revenue': 0}
     else:  # customer
-        active_rentals = Rental.query.filter_by(customer_id=current_user.id, status='active').all()
-        rental_history = Rental.query.filter_by(customer_id=current_user.id).count()
-        
         stats = {
-            'active_rentals': len(active_rentals),
-            'total_rentals': rental_history
+            'active_rentals': Rental.query.filter_by(customer_id=current_user.id, status='active').count(),
+            'total_rentals': RentalHistory.query.filter_by(customer_id=current_user.id).count()
         }
     
-    return jsonify(stats)
+    return stats
+
+# Revenue and utilization over time for the dashboard charts
+@app.route('/api/analytics/revenue')
+@login_required
+def revenue_over_time():
+    if current_user.role == 'car_owner':
+        scope = {'owner_id': current_user.id}
+    elif current_user.role == 'rental_company':
+        if not current_user.company_id:
+            return jsonify({"error": "Company profile not set up"}), 400
+        scope = {'company_id': current_user.company_id}
+    elif current_user.role == 'admin':
+        scope = {name: request.args.get(name, type=int) for name in ('owner_id', 'company_id')}
+    else:
+        return jsonify({"error": "Access denied"}), 403
+    
+    granularity = request.args.get('granularity', 'month')
+    try:
+        start, end = analytics.default_range(granularity)
+        if request.args.get('start'):
+            start = date.fromisoformat(request.args['start'])
+        if request.args.get('end'):
+            end = date.fromisoformat(request.args['end'])
+        series = revenue_analytics.series(granularity, start, end, **scope)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify(dict(series, measure='owner_income' if scope.get('owner_id') else 'company_revenue'))
+
+# Cars or drivers ranked by drowsiness alerts per monitored hour
+@app.route('/api/safety/ranking')
+@login_required
+def safety_ranking():
+    if current_user.role == 'car_owner':
+        scope = {'owner_id': current_user.id}
+    elif current_user.role == 'rental_company':
+        if not current_user.company_id:
+            return jsonify({"error": "Company profile not set up"}), 400
+        scope = {'company_id': current_user.company_id}
+    elif current_user.role == 'admin':
+        scope = {name: request.args.get(name, type=int) for name in ('owner_id', 'company_id')}
+    else:
+        return jsonify({"error": "Access denied"}), 403
+    
+    by = request.args.get('by', 'driver')
+    try:
+        start, end = safety.default_range()
+        if request.args.get('start'):
+            start = date.fromisoformat(request.args['start'])
+        if request.args.get('end'):
+            end = date.fromisoformat(request.args['end'])
+        ranked = safety.ranking(by, start, end, limit=request.args.get('limit', 20, type=int),
+                                min_hours=request.args.get('min_hours', 1.0, type=float), **scope)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return jsonify({'by': by, 'start': start.isoformat(), 'end': end.isoformat(), 'ranking': ranked})
+
+# History export, streamed so large histories don't sit in memory
+@app.route('/export/<dataset>')
+@login_required
+@role_required(['admin', 'car_owner', 'rental_company'])
+def export_history(dataset):
+    if dataset not in export.DATASETS:
+        return jsonify({"error": f"Unknown export {dataset!r}"}), 404
+    scope = {}
+    if current_user.role == 'car_owner':
+        scope['owner_id'] = current_user.id
+    elif current_user.role == 'rental_company':
+        if not current_user.company_id:
+            flash('Please setup your company profile first', 'error')
+            return redirect(url_for('setup_company'))
+        scope['company_id'] = current_user.company_id
+    
+    fmt = request.args.get('format', 'csv')
+    try:
+        pieces = export.stream(db.engine, export.DATASETS[dataset](**scope), fmt)
+    except export.ExportError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    return Response(pieces, mimetype=export.FORMATS[fmt][0], headers={
+        'Content-Disposition': f'attachment; filename={export.filename(dataset, fmt)}'
+    })
+
+@app.route('/api/dashboard/stats')
+@login_required
+def dashboard_stats():
+    key = stats_key(current_user.role, current_user.id)
+    entry = stats_cache.get(key)
+    if entry is None:
+        entry = stats_cache.set(key, compute_dashboard_stats())
+    
+    if entry.etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(entry.stats)
+    response.set_etag(entry.etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        create_schema()
+        if not RevenueTotal.query.first():
+            revenue.rebuild_rollups()
+        if not SafetyMonthly.query.first():
+            safety.rebuild_rollups()
         
         # Create admin user if it doesn't exist
         if not User.query.filter_by(username='admin').first():
@@ -547,6 +678,15 @@ if __name__ == '__main__':
             db.session.commit()
             print("✓ Admin user created: admin/admin123")
     
+    # The debug reloader runs this block in a watcher process too; only serve streams from the real one
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        if app.config['STREAMING_PORT']:
+            import streaming_server
+            streaming_server.start('0.0.0.0', app.config['STREAMING_PORT'], app.config['STREAMING_ALLOW_ORIGIN'])
+            print(f"🎥 Streams: port {app.config['STREAMING_PORT']}")
+        if app.config['LIFECYCLE_INTERVAL']:
+            lifecycle.LifecycleScheduler(app, app.config['LIFECYCLE_INTERVAL']).start()
+    
     print("🚗 Car Rental System Starting...")
     print("📱 Open: http://localhost:5000")
     print("👤 Login: admin/admin123")
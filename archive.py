@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Hot/cold archival of finished rentals and their monitoring sessions.
+
+Completed and cancelled rentals whose end_date is more than ARCHIVE_AFTER_DAYS
+old are moved, together with their monitoring sessions, out of the main
+database into one SQLite file per year of end_date under ARCHIVE_DIR
+(rentals_2023.db, ...). The hot rental and driver_monitoring tables then hold
+only current and recent rows, so dashboards, counts and "recent" lists stay
+fast however much history accumulates.
+
+Every connection to the main database ATTACHes the archive files and gets two
+temporary views, rental_history and monitoring_history, that UNION ALL the
+hot table with its archived copies. models.RentalHistory and
+models.MonitoringHistory are mapped onto them, so history pages and
+revenue.rebuild_rollups() read hot and archived rows alike. Connections pick
+up new archive files the next time they are checked out of the pool.
+
+Archival is a plain delete from the hot tables, so the revenue rollups keep
+counting archived rentals. Rows are copied and deleted in the same
+transaction; a copy already in the archive from an interrupted run is
+skipped, and any other row with the same id fails the run instead of being
+dropped. The newest rental and the newest monitoring session always stay hot,
+since SQLite hands out max(id) + 1 as the next id and would otherwise reuse
+an archived id.
+
+SQLite attaches at most ten databases per connection, so the archive keeps
+at most MAX_ARCHIVE_FILES files: when a new year would go past that, the
+oldest files are merged into the oldest one kept, which then also holds
+every year before its own. Server databases get plain views over the hot
+tables and no archival.
+
+    python archive.py                      # older than ARCHIVE_AFTER_DAYS
+    python archive.py --older-than-days 180
+"""
+
+import argparse
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, create_engine, event, exists, func, insert, select
+from sqlalchemy.engine import make_url
+
+from models import db, DriverMonitoring, MonitoringHistory, Rental, RentalHistory
+
+ARCHIVED_STATUSES = ('completed', 'cancelled')
+BATCH_SIZE = 1000
+MAX_ARCHIVE_FILES = 8  # SQLite attaches at most 10 databases; two are left spare
+FILE_PATTERN = re.compile(r'^rentals_(\d{4})\.db$')
+
+HOT_TABLES = (
+    # (hot table, history view)
+    (Rental.__table__, RentalHistory.__table__),
+    (DriverMonitoring.__table__, MonitoringHistory.__table__),
+)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _archive_metadata(schema=None):
+    """The archive file's tables: hot columns, no foreign keys, indexes for history reads."""
+    metadata = MetaData(schema=schema)
+    copies = {}
+    for hot, _ in HOT_TABLES:
+        copies[hot.name] = db.Table(hot.name, metadata, *(
+            db.Column(column.name, column.type, primary_key=column.primary_key) for column in hot.columns
+        ))
+    rental, monitoring = copies['rental'], copies['driver_monitoring']
+    db.Index('ix_archive_rental_customer', rental.c.customer_id, rental.c.created_at)
+    db.Index('ix_archive_rental_car', rental.c.car_id)
+    db.Index('ix_archive_rental_company', rental.c.rental_company_id, rental.c.end_date)
+    db.Index('ix_archive_monitoring_rental', monitoring.c.rental_id)
+    db.Index('ix_archive_monitoring_driver', monitoring.c.driver_id, monitoring.c.created_at)
+    return metadata
+
+
+class ArchiveStore:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._listing = (None, ())  # (directory mtime, periods)
+        self._counts = {}  # (period, file mtime) -> {table name: rows}
+
+    def path(self, period):
+        return os.path.join(self.directory, f'rentals_{period}.db')
+
+    def periods(self):
+        """Years with an archive file, oldest first."""
+        if not self.directory:
+            return ()
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return ()
+        # Listing the directory once per change is enough; checkouts call this a lot
+        if self._listing[0] != mtime:
+            periods = tuple(sorted(int(match.group(1)) for match in map(FILE_PATTERN.match, os.listdir(self.directory))
+                                   if match))
+            self._listing = (mtime, periods)
+        return self._listing[1]
+
+    def create(self, period):
+        """Create the archive file for period, or add columns the hot tables gained since."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            engine = create_engine(f'sqlite:///{self.path(period)}')
+            try:
+                metadata = _archive_metadata()
+                metadata.create_all(engine)
+                with engine.begin() as connection:
+                    for table in metadata.sorted_tables:
+                        existing = {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{table.name}")')}
+                        for column in table.columns:
+                            if column.name not in existing:
+                                connection.exec_driver_sql(
+                                    f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" '
+                                    f'{column.type.compile(engine.dialect)}')
+            finally:
+                engine.dispose()
+
+    def fit(self, years):
+        """Make room for years within MAX_ARCHIVE_FILES files; return {year: period whose file takes it}.
+
+        Creates the files needed, merging the oldest existing ones into the
+        oldest period kept when there would be too many.
+        """
+        periods = sorted(set(self.periods()) | set(years))
+        oldest_kept = periods[max(len(periods) - MAX_ARCHIVE_FILES, 0)] if periods else None
+        targets = {year: max(year, oldest_kept) for year in years}
+        for period in set(targets.values()) | ({oldest_kept} if oldest_kept is not None else set()):
+            self.create(period)
+        for period in self.periods():
+            if period < oldest_kept:
+                self.merge(period, oldest_kept)
+        return targets
+
+    def merge(self, period, into):
+        """Move every row of period's file into into's file, then delete period's file."""
+        with self._lock:
+            engine = create_engine(f'sqlite:///{self.path(into)}')
+            try:
+                with engine.connect() as connection:
+                    connection.exec_driver_sql('ATTACH DATABASE ? AS merging', (self.path(period),))
+                    for hot, _ in HOT_TABLES:
+                        columns = ', '.join(f'"{column.name}"' for column in hot.columns)
+                        connection.exec_driver_sql(
+                            f'INSERT INTO main."{hot.name}" ({columns}) SELECT {columns} FROM merging."{hot.name}"')
+                        connection.exec_driver_sql(f'DELETE FROM merging."{hot.name}"')
+                    connection.commit()
+                    connection.exec_driver_sql('DETACH DATABASE merging')
+            finally:
+                engine.dispose()
+            os.remove(self.path(period))
+
+    def sync(self, dbapi_connection, attached):
+        """Attach archive files this connection lacks and rebuild its history views.
+
+        attached is the tuple of periods the connection has; returns the new one.
+        """
+        periods = self.periods()
+        if periods == attached:
+            return attached
+        cursor = dbapi_connection.cursor()
+        try:
+            for period in set(attached or ()) - set(periods):
+                cursor.execute(f'DETACH DATABASE archive_{period}')
+            for period in set(periods) - set(attached or ()):
+                cursor.execute(f'ATTACH DATABASE ? AS archive_{period}', (self.path(period),))
+            for hot, view in HOT_TABLES:
+                columns = ', '.join(f'"{column.name}"' for column in hot.columns)
+                sources = [f'SELECT {columns} FROM main."{hot.name}"']
+                sources += [f'SELECT {columns} FROM archive_{period}."{hot.name}"' for period in periods]
+                cursor.execute(f'DROP VIEW IF EXISTS temp."{view.name}"')
+                cursor.execute(f'CREATE TEMP VIEW "{view.name}" AS ' + ' UNION ALL '.join(sources))
+        finally:
+            cursor.close()
+        return periods
+
+    def row_counts(self):
+        """Archived rows per table, summed over all archive files."""
+        counts = defaultdict(int)
+        for period in self.periods():
+            key = (period, os.stat(self.path(period)).st_mtime_ns)
+            cached = self._counts.get(key)
+            if cached is None:
+                engine = create_engine(f'sqlite:///{self.path(period)}')
+                try:
+                    with engine.connect() as connection:
+                        cached = {hot.name: connection.exec_driver_sql(f'SELECT COUNT(*) FROM "{hot.name}"').scalar()
+                                  for hot, _ in HOT_TABLES}
+                finally:
+                    engine.dispose()
+                self._counts = {k: v for k, v in self._counts.items() if k[0] != period}
+                self._counts[key] = cached
+            for name, count in cached.items():
+                counts[name] += count
+        return counts
+
+
+def rental_count():
+    """All rentals, hot and archived, without scanning the archive on every call."""
+    return Rental.query.count() + archive_store.row_counts()['rental']
+
+
+def archive_rentals(older_than_days, batch_size=BATCH_SIZE, now=None, progress=None):
+    """Move finished rentals that ended more than older_than_days ago into the archive.
+
+    progress, if given, is called after every batch with a dict of
+    archived/batches. Returns the number of rentals archived.
+    """
+    if make_url(str(db.engine.url)).get_backend_name() != 'sqlite':
+        raise ArchiveError('Archival needs a SQLite main database')
+    if not archive_store.directory:
+        raise ArchiveError('ARCHIVE_DIR is not configured')
+
+    cutoff = (now or datetime.utcnow()) - timedelta(days=older_than_days)
+    rental = Rental.__table__
+    monitoring = DriverMonitoring.__table__
+    newest_session = select(func.max(monitoring.c.id)).scalar_subquery()
+    due = (rental.c.status.in_(ARCHIVED_STATUSES), rental.c.end_date < cutoff,
+           # SQLite hands out max(id) + 1 as the next id, so the newest rental
+           # and the newest session stay hot and archived ids are never reused
+           rental.c.id < select(func.max(rental.c.id)).scalar_subquery(),
+           rental.c.id.notin_(select(monitoring.c.rental_id).where(monitoring.c.id == newest_session)))
+
+    # Create the files first; connections attach them when next checked out
+    years = db.session.execute(select(func.strftime('%Y', rental.c.end_date)).where(*due).distinct()).scalars()
+    targets = archive_store.fit([int(year) for year in years])
+    db.session.commit()
+
+    archived = batches = 0
+    while True:
+        rows = db.session.execute(
+            select(rental.c.id, rental.c.end_date).where(*due).order_by(rental.c.end_date, rental.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        by_period = defaultdict(list)
+        for rental_id, end_date in rows:
+            by_period[targets[end_date.year]].append(rental_id)
+
+        for period, ids in by_period.items():
+            _move(period, ids, due)
+        db.session.commit()
+
+        archived += len(rows)
+        batches += 1
+        if progress:
+            progress({'archived': archived, 'batches': batches})
+
+    db.session.expire_all()
+    return archived
+
+
+def _move(period, ids, due):
+    """Copy the due rentals among ids and their sessions into period's file, then delete them."""
+    archive_tables = _archive_metadata(schema=f'archive_{period}').tables
+    rental = Rental.__table__
+    monitoring = DriverMonitoring.__table__
+    batch = (rental.c.id.in_(ids), *due)
+    moving = select(rental.c.id).where(*batch)
+
+    for hot, where in ((rental, batch), (monitoring, (monitoring.c.rental_id.in_(moving),))):
+        target = archive_tables[f'archive_{period}.{hot.name}']
+        # Skip exact copies left by an interrupted run; a different row with
+        # the same id makes the insert fail rather than lose either row
+        archived = target.alias('archived')  # unaliased, its name would shadow the hot table's
+        copied = exists().where(*(archived.c[column.name].is_not_distinct_from(column) for column in hot.columns))
+        db.session.execute(
+            insert(target).from_select([column.name for column in hot.columns],
+                                       select(*hot.columns).where(*where, ~copied))
+        )
+    db.session.execute(monitoring.delete().where(monitoring.c.rental_id.in_(moving)))
+    db.session.execute(rental.delete().where(*batch))
+
+
+def _server_views(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for hot, view in HOT_TABLES:
+            cursor.execute(f'CREATE OR REPLACE VIEW {view.name} AS SELECT * FROM {hot.name}')
+        dbapi_connection.commit()
+    finally:
+        cursor.close()
+
+
+def _sync_connection(dbapi_connection, connection_record, connection_proxy):
+    info = connection_record.info
+    info['archive_periods'] = archive_store.sync(dbapi_connection, info.get('archive_periods'))
+
+
+def init_app(app):
+    app.config.setdefault('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+    app.config.setdefault('ARCHIVE_AFTER_DAYS', 365)
+    archive_store.directory = app.config['ARCHIVE_DIR']
+    with app.app_context():
+        if db.engine.url.get_backend_name() == 'sqlite':
+            event.listen(db.engine, 'checkout', _sync_connection)
+        else:
+            event.listen(db.engine, 'first_connect', _server_views)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move old finished rentals into the archive files.')
+    parser.add_argument('--older-than-days', type=int, help='default: ARCHIVE_AFTER_DAYS')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    from app_simple import app
+    # Run as a script this module is __main__, not the archive module the app initialised
+    archive_store.directory = app.config['ARCHIVE_DIR']
+
+    def report(state):
+        print(f"\r  {state['archived']} rentals archived ({state['batches']} batches)", end='')
+
+    with app.app_context():
+        older_than_days = args.older_than_days or app.config['ARCHIVE_AFTER_DAYS']
+        print(f"🗄️  Archiving rentals that ended more than {older_than_days} days ago into {archive_store.directory}")
+        started = time.perf_counter()
+        count = archive_rentals(older_than_days, args.batch_size, progress=report)
+        print(f"\n✓ Archived {count} rentals ({time.perf_counter() - started:.1f}s)")
+
+
+# Global archive instance
+archive_store = ArchiveStore()
+
+
+if __name__ == "__main__":
+    main()
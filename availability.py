@@ -0,0 +1,195 @@
+"""
+Date-range availability for cars.
+
+AvailabilityIndex keeps, per car, the union of the periods covered by its
+active rentals as two sorted lists (starts and ends), so "is car X free
+between D1 and D2" is a single bisect. Only rentals that have not ended yet
+are held in memory.
+
+The index is updated from Rental mapper events once the surrounding
+transaction commits. Rentals written by other processes are picked up by
+polling for new rental ids every POLL_SECONDS, and a full reload every
+FULL_RELOAD_SECONDS catches cancellations made elsewhere. Booking must still
+guard against overlaps in the database; this index only serves reads.
+"""
+
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import Rental
+
+POLL_SECONDS = 5
+FULL_RELOAD_SECONDS = 600
+
+BLOCKING_STATUSES = ('active',)
+
+
+class AvailabilityIndex:
+    def __init__(self):
+        self._bookings = {}  # car_id -> {rental_id: (start, end)}
+        self._starts = {}  # car_id -> sorted starts of merged busy periods
+        self._ends = {}  # car_id -> matching ends
+        self._lock = threading.Lock()
+        self.max_rental_id = 0
+        self.loaded_at = None
+        self.polled_at = None
+
+    def replace(self, rows):
+        """Swap in a freshly loaded index built from (rental_id, car_id, start, end) rows."""
+        fresh = AvailabilityIndex()
+        for rental_id, car_id, start, end in rows:
+            fresh.add(car_id, rental_id, start, end)
+        with self._lock:
+            self._bookings, self._starts, self._ends = fresh._bookings, fresh._starts, fresh._ends
+            self.max_rental_id = fresh.max_rental_id
+
+    def add(self, car_id, rental_id, start, end):
+        with self._lock:
+            self.max_rental_id = max(self.max_rental_id, rental_id)
+            bookings = self._bookings.setdefault(car_id, {})
+            if rental_id in bookings:
+                bookings[rental_id] = (start, end)
+                self._rebuild(car_id)
+                return
+            bookings[rental_id] = (start, end)
+            starts = self._starts.setdefault(car_id, [])
+            ends = self._ends.setdefault(car_id, [])
+            # Merge with every busy period that overlaps or touches [start, end)
+            lo = bisect_left(ends, start)
+            hi = bisect_right(starts, end)
+            if lo < hi:
+                start = min(start, starts[lo])
+                end = max(end, ends[hi - 1])
+            starts[lo:hi] = [start]
+            ends[lo:hi] = [end]
+
+    def remove(self, car_id, rental_id):
+        with self._lock:
+            bookings = self._bookings.get(car_id)
+            if bookings and bookings.pop(rental_id, None) is not None:
+                self._rebuild(car_id)
+
+    def _rebuild(self, car_id):
+        starts, ends = [], []
+        for start, end in sorted(self._bookings[car_id].values()):
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self._starts[car_id] = starts
+        self._ends[car_id] = ends
+
+    def is_free(self, car_id, start, end):
+        """True if no active rental of the car overlaps [start, end)."""
+        with self._lock:
+            starts = self._starts.get(car_id)
+            if not starts:
+                return True
+            i = bisect_left(starts, end) - 1
+            return i < 0 or self._ends[car_id][i] <= start
+
+    def free_car_ids(self, car_ids, start, end):
+        return [car_id for car_id in car_ids if self.is_free(car_id, start, end)]
+
+    def busy_periods(self, car_id):
+        with self._lock:
+            return list(zip(self._starts.get(car_id, []), self._ends.get(car_id, [])))
+
+
+def _blocks(status, end_date, now=None):
+    return status in BLOCKING_STATUSES and end_date > (now or datetime.utcnow())
+
+
+def _blocking_rows(query):
+    return query.filter(Rental.status.in_(BLOCKING_STATUSES), Rental.end_date > datetime.utcnow()) \
+        .with_entities(Rental.id, Rental.car_id, Rental.start_date, Rental.end_date).all()
+
+
+_refresh_lock = threading.Lock()
+
+
+def refresh(force=False):
+    """Bring the index up to date with the database if it is due."""
+    index = availability_index
+    now = time.monotonic()
+    full = force or index.loaded_at is None or now - index.loaded_at > FULL_RELOAD_SECONDS
+    if not full and now - index.polled_at <= POLL_SECONDS:
+        return
+    # One thread refreshes; the others keep answering from the current index
+    if not _refresh_lock.acquire(blocking=force or index.loaded_at is None):
+        return
+    try:
+        if full:
+            index.replace(_blocking_rows(Rental.query))
+            index.loaded_at = now
+        else:
+            for rental_id, car_id, start, end in _blocking_rows(Rental.query.filter(Rental.id > index.max_rental_id)):
+                index.add(car_id, rental_id, start, end)
+        index.polled_at = now
+    finally:
+        _refresh_lock.release()
+
+
+def is_car_free(car_id, start, end):
+    refresh()
+    return availability_index.is_free(car_id, start, end)
+
+
+def free_car_ids(car_ids, start, end):
+    refresh()
+    return availability_index.free_car_ids(car_ids, start, end)
+
+
+# Keep the index current for rentals written through this process's sessions.
+# Changes are captured during flush and applied only after commit.
+def _record(target, deleted=False):
+    session = object_session(target)
+    if session is None:
+        return
+    history = inspect(target).attrs.car_id.history
+    previous_car_ids = set(history.deleted) | {target.car_id}
+    blocks = not deleted and _blocks(target.status, target.end_date)
+    session.info.setdefault('availability_changes', []).append(
+        (target.id, previous_car_ids, blocks, target.car_id, target.start_date, target.end_date)
+    )
+
+
+@event.listens_for(Rental, 'after_insert')
+def _rental_inserted(mapper, connection, target):
+    _record(target)
+
+
+@event.listens_for(Rental, 'after_update')
+def _rental_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('status', 'car_id', 'start_date', 'end_date')):
+        _record(target)
+
+
+@event.listens_for(Rental, 'after_delete')
+def _rental_deleted(mapper, connection, target):
+    _record(target, deleted=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    for rental_id, previous_car_ids, blocks, car_id, start, end in session.info.pop('availability_changes', []):
+        for previous_car_id in previous_car_ids:
+            availability_index.remove(previous_car_id, rental_id)
+        if blocks:
+            availability_index.add(car_id, rental_id, start, end)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('availability_changes', None)
+
+
+# Global index instance
+availability_index = AvailabilityIndex()
@@ -0,0 +1,120 @@
+"""
+Concurrency benchmark for booking.book_car().
+
+Many threads book random cars for random periods at the same time, then the
+database is checked for overlapping active rentals of the same car.
+
+    python -m benchmarks.booking --threads 64 --attempts 5000
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func
+from sqlalchemy.orm import aliased
+
+from models import db, Rental
+import booking
+from benchmarks.common import make_app, seed_fleet
+
+
+def count_overlaps():
+    other = aliased(Rental)
+    return db.session.query(func.count()).select_from(Rental).join(other, and_(
+        other.car_id == Rental.car_id,
+        other.id > Rental.id,
+        other.status == 'active',
+        Rental.status == 'active',
+        other.start_date < Rental.end_date,
+        other.end_date > Rental.start_date
+    )).scalar()
+
+
+def run(threads, attempts, cars, customers, horizon_days, database_uri=None, seed=1):
+    app = make_app(database_uri)
+    with app.app_context():
+        car_ids, customer_ids = seed_fleet(cars=cars, customers=customers)
+
+    counts = {'booked': 0, 'conflicts': 0, 'contention': 0, 'errors': 0}
+    counts_lock = threading.Lock()
+    remaining = [attempts]
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def worker(worker_id):
+        rng = random.Random(seed * 1000 + worker_id)
+        with app.app_context():
+            while True:
+                with counts_lock:
+                    if remaining[0] == 0:
+                        return
+                    remaining[0] -= 1
+                start = today + timedelta(days=rng.randrange(1, horizon_days))
+                end = start + timedelta(days=rng.randint(1, 7))
+                try:
+                    booking.book_car(rng.choice(car_ids), rng.choice(customer_ids), start, end)
+                    outcome = 'booked'
+                except booking.CarUnavailable:
+                    outcome = 'conflicts'
+                except booking.BookingContention:
+                    outcome = 'contention'
+                except Exception:
+                    db.session.rollback()
+                    outcome = 'errors'
+                with counts_lock:
+                    counts[outcome] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        overlaps = count_overlaps()
+        stored = Rental.query.count()
+
+    return {
+        'threads': threads,
+        'attempts': attempts,
+        'cars': cars,
+        'elapsed_seconds': round(elapsed, 3),
+        'bookings_per_second': round(counts['booked'] / elapsed, 1),
+        'attempts_per_second': round(attempts / elapsed, 1),
+        'conflict_rate': round(counts['conflicts'] / attempts, 4),
+        **counts,
+        'rentals_stored': stored,
+        'overlapping_rentals': overlaps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--attempts', type=int, default=2000)
+    parser.add_argument('--cars', type=int, default=50)
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--horizon-days', type=int, default=90, help='bookings start within this many days')
+    parser.add_argument('--database-uri', help='defaults to a temporary SQLite file')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    args = parser.parse_args()
+
+    result = run(args.threads, args.attempts, args.cars, args.customers, args.horizon_days,
+                 args.database_uri, args.seed)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        print(f'{key:>22}: {value}')
+    if result['overlapping_rentals']:
+        print('✗ Double bookings detected!')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks run against a throwaway database through a bare Flask app that
+only initialises the models, so they don't need the camera/dlib stack that
+the full applications import.
+"""
+
+import os
+import tempfile
+
+from flask import Flask
+from werkzeug.security import generate_password_hash
+
+import archive
+import database
+from models import db, User, Car, RentalCompany, create_schema
+
+
+def make_app(database_uri=None, profile=None):
+    """Flask app bound to database_uri (a fresh temporary SQLite file by default).
+
+    profile overrides DATABASE_PROFILE; other engine settings come from the
+    environment as they do for the real app.
+    """
+    if database_uri is None:
+        handle, path = tempfile.mkstemp(prefix='car_rental_bench_', suffix='.db')
+        os.close(handle)
+        database_uri = f'sqlite:///{path}'
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    env = dict(os.environ, DATABASE_PROFILE=profile) if profile else os.environ
+    database.init_app(app, env)
+    archive.init_app(app)
+    with app.app_context():
+        create_schema()
+    return app
+
+
+def seed_fleet(cars=50, customers=200, owners=10):
+    """Create one rental company plus owners, cars and customers; return (car_ids, customer_ids)."""
+    password_hash = generate_password_hash('password123')
+    company_user = User(username='bench_company', email='bench_company@example.com',
+                        password_hash=password_hash, role='rental_company')
+    owner_users = [User(username=f'bench_owner{i}', email=f'bench_owner{i}@example.com',
+                        password_hash=password_hash, role='car_owner') for i in range(owners)]
+    customer_users = [User(username=f'bench_customer{i}', email=f'bench_customer{i}@example.com',
+                           password_hash=password_hash, role='customer') for i in range(customers)]
+    db.session.add_all([company_user, *owner_users, *customer_users])
+    db.session.flush()
+
+    company = RentalCompany(name='Bench Rentals', address='1 Bench Road', phone='+1-555-0100',
+                            commission_rate=0.15, handling_fee=50.0, user_id=company_user.id)
+    db.session.add(company)
+    db.session.flush()
+
+    fleet = [Car(make='Toyota', model='Camry', year=2022, license_plate=f'BENCH{i:05d}', color='Silver',
+                 daily_rate=40.0 + i % 20, owner_id=owner_users[i % owners].id,
+                 rental_company_id=company.id) for i in range(cars)]
+    db.session.add_all(fleet)
+    db.session.commit()
+    return [car.id for car in fleet], [user.id for user in customer_users]
+
+
+def percentile(samples, fraction):
+    """The fraction-th percentile of samples (seconds) in milliseconds, or None if empty."""
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000, 2)
@@ -0,0 +1,155 @@
+"""
+Read/write throughput of the database engine profiles.
+
+For each profile a fresh database is seeded with active rentals and their
+monitoring sessions. Writer threads then post monitoring updates (one small
+UPDATE + commit each, like /api/monitor/process) while reader threads run the
+car owner dashboard queries, for a fixed amount of time.
+
+    python -m benchmarks.database --seconds 10 --readers 8 --writers 4
+    DATABASE_URL=postgresql://... python -m benchmarks.database --database-uri "$DATABASE_URL"
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import OperationalError
+
+from models import db, Car, Rental, DriverMonitoring
+import database
+import revenue
+from benchmarks.common import make_app, percentile, seed_fleet
+
+
+def seed_monitoring(car_ids, customer_ids):
+    """One active rental and monitoring session per car; return the session ids."""
+    company_id = Car.query.get(car_ids[0]).rental_company_id
+    start = datetime.utcnow() - timedelta(days=1)
+    rentals = [Rental(car_id=car_id, customer_id=customer_ids[i % len(customer_ids)], rental_company_id=company_id,
+                      start_date=start, end_date=start + timedelta(days=3), daily_rate=50.0,
+                      total_amount=150.0, commission=22.5, handling_fee=50.0)
+               for i, car_id in enumerate(car_ids)]
+    db.session.add_all(rentals)
+    db.session.flush()
+    sessions = [DriverMonitoring(rental_id=rental.id, car_id=rental.car_id, driver_id=rental.customer_id,
+                                 session_start=start) for rental in rentals]
+    db.session.add_all(sessions)
+    db.session.commit()
+    return [session.id for session in sessions]
+
+
+def run(profile, seconds, readers, writers, cars, database_uri=None, seed=1):
+    app = make_app(database_uri, profile)
+    with app.app_context():
+        car_ids, customer_ids = seed_fleet(cars=cars, customers=max(10, cars // 2))
+        session_ids = seed_monitoring(car_ids, customer_ids)
+        owner_ids = sorted({owner_id for (owner_id,) in Car.query.with_entities(Car.owner_id)})
+
+    latencies = {'read': [], 'write': []}
+    counts = {'read': 0, 'write': 0, 'locked': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = [None]
+
+    def read(rng):
+        owner_id = rng.choice(owner_ids)
+        Car.query.filter_by(owner_id=owner_id).all()
+        Rental.query.join(Car).filter(Car.owner_id == owner_id, Rental.status == 'active').all()
+        revenue.owner_income(owner_id)
+
+    def write(rng):
+        monitoring = DriverMonitoring.query.get(rng.choice(session_ids))
+        monitoring.total_blinks = (monitoring.total_blinks or 0) + 1
+        monitoring.avg_ear = rng.uniform(0.2, 0.35)
+        db.session.commit()
+
+    def worker(kind, worker_id):
+        rng = random.Random(seed * 1000 + worker_id)
+        operation = read if kind == 'read' else write
+        samples = []
+        done = locked = errors = 0
+        with app.app_context():
+            while time.perf_counter() < deadline[0]:
+                started = time.perf_counter()
+                try:
+                    operation(rng)
+                except OperationalError:
+                    db.session.rollback()
+                    locked += 1
+                    continue
+                except Exception:
+                    db.session.rollback()
+                    errors += 1
+                    continue
+                finally:
+                    db.session.remove()  # end of request
+                samples.append(time.perf_counter() - started)
+                done += 1
+        with lock:
+            latencies[kind].extend(samples)
+            counts[kind] += done
+            counts['locked'] += locked
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=worker, args=('read', i)) for i in range(readers)] + \
+              [threading.Thread(target=worker, args=('write', readers + i)) for i in range(writers)]
+    deadline[0] = time.perf_counter() + seconds
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        backend = db.engine.url.get_backend_name()
+        db.engine.dispose()
+
+    return {
+        'profile': profile if backend == 'sqlite' else backend,
+        'seconds': seconds,
+        'readers': readers,
+        'writers': writers,
+        'reads_per_second': round(counts['read'] / seconds, 1),
+        'writes_per_second': round(counts['write'] / seconds, 1),
+        'read_p50_ms': percentile(latencies['read'], 0.5),
+        'read_p95_ms': percentile(latencies['read'], 0.95),
+        'write_p50_ms': percentile(latencies['write'], 0.5),
+        'write_p95_ms': percentile(latencies['write'], 0.95),
+        'locked': counts['locked'],
+        'errors': counts['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profile', action='append', dest='profiles', choices=sorted(database.SQLITE_PROFILES),
+                        help='SQLite profile to run (repeatable, default: all)')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--cars', type=int, default=200)
+    parser.add_argument('--database-uri', help='an empty database to seed; runs the first profile only '
+                                               '(defaults to a temporary SQLite file per profile)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    profiles = args.profiles or sorted(database.SQLITE_PROFILES)
+    if args.database_uri:
+        profiles = profiles[:1]
+    results = [run(profile, args.seconds, args.readers, args.writers, args.cars, args.database_uri, args.seed)
+               for profile in profiles]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    columns = list(results[0])
+    print(' '.join(f'{column:>17}' for column in columns))
+    for result in results:
+        print(' '.join(f'{str(result[column]):>17}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+Synthetic dataset generator for testing at production scale.
+
+Builds companies, owners, customers, cars, rentals and monitoring sessions
+with skewed, realistic distributions: a few owners and customers account for
+most of the activity, popular cars are rented far more often than others, and
+every car's rentals are laid out back to back without overlaps, as booking
+guarantees. The same seed always produces the same data.
+
+Rows are generated with NumPy and written through Core executemany inserts
+on one connection and committed together, so the ORM events are bypassed;
+the revenue and safety rollups and the car search index are rebuilt once at
+the end instead.
+Every user's password is 'password123', hashed once.
+
+    python -m benchmarks.dataset --cars 100000 --rentals 5000000 --sessions 1000000
+    python -m benchmarks.dataset --database-uri sqlite:////tmp/big.db --cars 10000 --rentals 200000
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Car, RentalCompany, Rental, DriverMonitoring
+import car_search
+import revenue
+import safety
+from benchmarks.common import make_app
+
+INSERT_CHUNK = 20000
+FUTURE_DAYS = 60
+PASSWORD = 'password123'
+
+# make, models, base daily rate, market share
+CATALOGUE = [
+    ('Toyota', ('Camry', 'Corolla', 'RAV4', 'Prius'), 45.0, 16),
+    ('Honda', ('Civic', 'Accord', 'CR-V'), 42.0, 12),
+    ('Ford', ('Focus', 'Fusion', 'Escape', 'F-150'), 44.0, 11),
+    ('Chevrolet', ('Malibu', 'Equinox', 'Tahoe'), 46.0, 9),
+    ('Nissan', ('Altima', 'Sentra', 'Rogue'), 41.0, 8),
+    ('Hyundai', ('Elantra', 'Sonata', 'Tucson'), 38.0, 8),
+    ('Kia', ('Optima', 'Sportage', 'Soul'), 37.0, 6),
+    ('Mazda', ('Mazda3', 'CX-5'), 43.0, 5),
+    ('Volkswagen', ('Golf', 'Jetta', 'Tiguan'), 47.0, 5),
+    ('Subaru', ('Outback', 'Impreza', 'Forester'), 48.0, 4),
+    ('BMW', ('3 Series', '5 Series', 'X3'), 85.0, 4),
+    ('Mercedes-Benz', ('C-Class', 'E-Class', 'GLC'), 90.0, 4),
+    ('Audi', ('A4', 'Q5'), 82.0, 3),
+    ('Tesla', ('Model 3', 'Model Y'), 95.0, 3),
+    ('Jeep', ('Wrangler', 'Grand Cherokee'), 60.0, 2),
+]
+COLORS = ['White', 'Black', 'Gray', 'Silver', 'Blue', 'Red', 'Brown', 'Green', 'Beige', 'Orange']
+COLOR_SHARES = [25, 22, 18, 12, 9, 8, 2, 2, 1, 1]
+MIN_DAYS_PER_RENTAL = 6  # horizon days each rental needs on average, gaps included
+
+
+class DatasetError(ValueError):
+    pass
+
+
+def _shares(weights):
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def _next_id(connection, model):
+    return (connection.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _insert(connection, model, columns, count):
+    """Insert count rows given as parallel lists, INSERT_CHUNK rows per executemany."""
+    names = list(columns)
+    for offset in range(0, count, INSERT_CHUNK):
+        chunk = [values[offset:offset + INSERT_CHUNK] for values in columns.values()]
+        connection.execute(model.__table__.insert(), [dict(zip(names, row)) for row in zip(*chunk)])
+
+
+def _cumsum_within(groups_start, values):
+    """Running sum of values restarting at every group start (values sorted by group)."""
+    totals = np.cumsum(values)
+    offsets = np.repeat(totals[groups_start] - values[groups_start], np.diff(np.append(groups_start, len(values))))
+    return totals - offsets
+
+
+def generate(cars=10000, rentals=200000, sessions=50000, owners=None, customers=None, companies=None,
+             history_days=730, seed=1, progress=print):
+    """Add a synthetic dataset to the bound database and return the row counts."""
+    horizon = history_days + FUTURE_DAYS
+    max_rentals = cars * (horizon // MIN_DAYS_PER_RENTAL)
+    if rentals > max_rentals:
+        raise DatasetError(f'{rentals:,} rentals do not fit on {cars:,} cars over {horizon} days; '
+                           f'use at most {max_rentals:,} rentals, or more cars or history days')
+    rng = np.random.default_rng(seed)
+    owners = owners or max(1, cars // 8)
+    customers = customers or max(1, cars * 2)
+    companies = companies or max(1, cars // 2000)
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    now = datetime.utcnow()
+    origin = today - timedelta(days=history_days)
+    days = [origin + timedelta(days=offset) for offset in range(-60, horizon + 1)]  # day offset + 60
+    password_hash = generate_password_hash(PASSWORD)
+    started = time.perf_counter()
+
+    def report(label, count):
+        progress(f'  {label:<20} {count:>10,}  ({time.perf_counter() - started:.1f}s)')
+
+    connection = db.session.connection()
+
+    # Users: company accounts, then owners, then customers
+    first_user = _next_id(connection, User)
+    n_users = companies + owners + customers
+    user_ids = np.arange(first_user, first_user + n_users)
+    roles = ['rental_company'] * companies + ['car_owner'] * owners + ['customer'] * customers
+    prefixes = {'rental_company': 'company', 'car_owner': 'owner', 'customer': 'customer'}
+    usernames = [f'{prefixes[role]}{user_id}' for role, user_id in zip(roles, user_ids.tolist())]
+    signup_days = rng.integers(0, history_days, n_users).tolist()
+    _insert(connection, User, {
+        'id': user_ids.tolist(),
+        'username': usernames,
+        'email': [f'{username}@example.com' for username in usernames],
+        'password_hash': [password_hash] * n_users,
+        'role': roles,
+        'created_at': [days[day + 60] for day in signup_days],
+    }, n_users)
+    company_user_ids = user_ids[:companies]
+    owner_ids = user_ids[companies:companies + owners]
+    customer_ids = user_ids[companies + owners:]
+    report('users', n_users)
+
+    first_company = _next_id(connection, RentalCompany)
+    company_ids = np.arange(first_company, first_company + companies)
+    commission_rates = np.round(rng.uniform(0.08, 0.2, companies), 3)
+    handling_fees = np.round(rng.choice([25.0, 35.0, 50.0, 75.0], companies), 2)
+    _insert(connection, RentalCompany, {
+        'id': company_ids.tolist(),
+        'name': [f'Rentals {company_id}' for company_id in company_ids.tolist()],
+        'address': [f'{company_id} Fleet Street' for company_id in company_ids.tolist()],
+        'phone': [f'+1-555-{company_id % 10000:04d}' for company_id in company_ids.tolist()],
+        'commission_rate': commission_rates.tolist(),
+        'handling_fee': handling_fees.tolist(),
+        'user_id': company_user_ids.tolist(),
+    }, companies)
+    report('companies', companies)
+
+    # Cars: make by market share, newer years more common, a long tail of
+    # owners with big fleets, most cars placed with a (Zipf-sized) company
+    first_car = _next_id(connection, Car)
+    car_ids = np.arange(first_car, first_car + cars)
+    makes = rng.choice(len(CATALOGUE), cars, p=_shares([entry[3] for entry in CATALOGUE]))
+    model_picks = rng.random(cars)
+    years = np.clip(today.year - rng.geometric(0.25, cars) + 1, 2005, today.year)
+    rates = np.array([CATALOGUE[make][2] for make in makes.tolist()]) * (1 - 0.03 * (today.year - years))
+    rates = np.round(np.maximum(rates * rng.lognormal(0, 0.15, cars), 15.0), 2)
+    car_owner = owner_ids[rng.choice(owners, cars, p=_shares(rng.pareto(1.5, owners) + 1))]
+    car_company = company_ids[rng.choice(companies, cars, p=_shares(1 / np.arange(1, companies + 1)))]
+    has_company = rng.random(cars) < 0.85
+    car_models = [CATALOGUE[make][1][int(pick * len(CATALOGUE[make][1]))]
+                  for make, pick in zip(makes.tolist(), model_picks.tolist())]
+
+    # Rentals: per-car counts skewed by popularity, durations of mostly a few
+    # days, laid out in order with random gaps across the booking horizon
+    max_per_car = horizon // MIN_DAYS_PER_RENTAL
+    popularity = rng.lognormal(0, 0.8, cars)
+    per_car = rng.multinomial(rentals, _shares(popularity))
+    while (per_car > max_per_car).any():
+        excess = int(np.maximum(per_car - max_per_car, 0).sum())
+        per_car = np.minimum(per_car, max_per_car)
+        per_car += rng.multinomial(excess, _shares(per_car < max_per_car))
+    rental_car = np.repeat(np.arange(cars), per_car)
+    durations = np.minimum(rng.geometric(0.3, rentals), 21)
+    group_starts = np.flatnonzero(np.diff(np.append(-1, rental_car)))
+    busy_days = np.add.reduceat(durations, group_starts) if rentals else np.array([], dtype=np.int64)
+    spare = np.maximum(horizon - busy_days, 0)
+    weights = rng.exponential(1.0, rentals)
+    # one extra weight per car leaves a random gap after its last rental too
+    weight_totals = (np.add.reduceat(weights, group_starts) if rentals else weights) \
+        + rng.exponential(1.0, len(group_starts))
+    per_group = np.repeat(np.arange(len(group_starts)), np.diff(np.append(group_starts, rentals)))
+    gaps = np.floor(weights / weight_totals[per_group] * spare[per_group]).astype(np.int64)
+    ends = _cumsum_within(group_starts, gaps + durations)
+    starts = ends - durations
+    if rentals and ends.max() > horizon:  # the busiest cars can run past the horizon
+        days.extend(origin + timedelta(days=offset) for offset in range(horizon + 1, int(ends.max()) + 1))
+
+    today_offset = history_days
+    completed = ends <= today_offset
+    cancelled = rng.random(rentals) < 0.05
+    statuses = np.where(cancelled, 'cancelled', np.where(completed, 'completed', 'active'))
+    rental_company = np.where(has_company[rental_car], car_company[rental_car],
+                              company_ids[rng.integers(0, companies, rentals)])
+    company_index = rental_company - first_company
+    totals = rates[rental_car] * durations
+    commissions = np.round(totals * commission_rates[company_index], 2)
+    customer_pick = rng.choice(customers, rentals, p=_shares(rng.lognormal(0, 1.0, customers)))
+    lead_days = np.minimum(rng.geometric(0.1, rentals), 60)
+
+    in_progress = (statuses == 'active') & (starts <= today_offset) & (ends > today_offset)
+    car_statuses = np.where(rng.random(cars) < 0.03, 'maintenance', 'available')
+    car_statuses[rental_car[in_progress]] = 'rented'
+
+    _insert(connection, Car, {
+        'id': car_ids.tolist(),
+        'make': [CATALOGUE[make][0] for make in makes.tolist()],
+        'model': car_models,
+        'year': years.tolist(),
+        'license_plate': [f'SYN{car_id:07d}' for car_id in car_ids.tolist()],
+        'color': rng.choice(COLORS, cars, p=_shares(COLOR_SHARES)).tolist(),
+        'daily_rate': rates.tolist(),
+        'status': car_statuses.tolist(),
+        'owner_id': car_owner.tolist(),
+        'rental_company_id': [company if placed else None
+                              for company, placed in zip(car_company.tolist(), has_company.tolist())],
+        'created_at': [days[day + 60] for day in rng.integers(-60, history_days // 2, cars).tolist()],
+    }, cars)
+    report('cars', cars)
+
+    first_rental = _next_id(connection, Rental)
+    rental_ids = np.arange(first_rental, first_rental + rentals)
+    _insert(connection, Rental, {
+        'id': rental_ids.tolist(),
+        'car_id': car_ids[rental_car].tolist(),
+        'customer_id': customer_ids[customer_pick].tolist(),
+        'rental_company_id': rental_company.tolist(),
+        'start_date': [days[day + 60] for day in starts.tolist()],
+        'end_date': [days[day + 60] for day in ends.tolist()],
+        'daily_rate': rates[rental_car].tolist(),
+        'total_amount': totals.tolist(),
+        'commission': commissions.tolist(),
+        'handling_fee': handling_fees[company_index].tolist(),
+        'status': statuses.tolist(),
+        'created_at': [days[day + 60] for day in np.maximum(starts - lead_days, -60).tolist()],
+    }, rentals)
+    report('rentals', rentals)
+
+    # Monitoring sessions on rentals that have started; a few drowsy drivers
+    # produce most of the alerts
+    driven = np.flatnonzero((statuses != 'cancelled') & (starts <= today_offset))
+    n_sessions = sessions if len(driven) else 0
+    picked = driven[rng.integers(0, len(driven), n_sessions)] if n_sessions else driven[:0]
+    driven_days = np.minimum(ends[picked], today_offset) - starts[picked]
+    offsets = (rng.random(n_sessions) * np.maximum(driven_days, 1) * 86400).astype(np.int64)
+    minutes = np.clip(rng.lognormal(3.6, 0.7, n_sessions), 5, 600)
+    drowsiness = rng.gamma(0.5, 1.0, customers)[customer_pick[picked]]
+    session_starts = [days[day + 60] + timedelta(seconds=offset)
+                      for day, offset in zip(starts[picked].tolist(), offsets.tolist())]
+    session_ends = [start + timedelta(minutes=length) for start, length in zip(session_starts, minutes.tolist())]
+    live = np.array([end > now for end in session_ends], dtype=bool)
+
+    first_session = _next_id(connection, DriverMonitoring)
+    _insert(connection, DriverMonitoring, {
+        'id': list(range(first_session, first_session + n_sessions)),
+        'rental_id': rental_ids[picked].tolist(),
+        'car_id': car_ids[rental_car[picked]].tolist(),
+        'driver_id': customer_ids[customer_pick[picked]].tolist(),
+        'session_start': session_starts,
+        'session_end': [None if is_live else end for end, is_live in zip(session_ends, live.tolist())],
+        'total_blinks': rng.poisson(15 * minutes).tolist(),
+        'drowsiness_alerts': rng.poisson(minutes / 60 * drowsiness).tolist(),
+        'avg_ear': np.round(np.clip(rng.normal(0.29 - 0.02 * drowsiness, 0.025), 0.12, 0.4), 4).tolist(),
+        'status': np.where(live, 'active', 'completed').tolist(),
+        'created_at': session_starts,
+    }, n_sessions)
+    report('monitoring sessions', n_sessions)
+
+    if car_search._uses_fts(connection):
+        car_search.rebuild_search_index(connection)
+        report('search index', cars)
+    db.session.commit()
+    revenue.rebuild_rollups()
+    report('revenue rollups', int((statuses == 'completed').sum()))
+    safety.rebuild_rollups()
+    report('safety rollups', int((~live).sum()))
+
+    return {'users': n_users, 'companies': companies, 'cars': cars, 'rentals': rentals,
+            'monitoring_sessions': n_sessions, 'seconds': round(time.perf_counter() - started, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-uri', help='defaults to a new temporary SQLite file')
+    parser.add_argument('--cars', type=int, default=10000)
+    parser.add_argument('--rentals', type=int, default=200000)
+    parser.add_argument('--sessions', type=int, default=50000, help='driver monitoring sessions')
+    parser.add_argument('--owners', type=int, help='default: cars / 8')
+    parser.add_argument('--customers', type=int, help='default: cars * 2')
+    parser.add_argument('--companies', type=int, help='default: cars / 2000')
+    parser.add_argument('--history-days', type=int, default=730, help='rentals start up to this many days ago')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    app = make_app(args.database_uri)
+    with app.app_context():
+        print(f'🚗 Generating synthetic data in {db.engine.url}')
+        try:
+            counts = generate(args.cars, args.rentals, args.sessions, args.owners, args.customers, args.companies,
+                              args.history_days, args.seed)
+        except DatasetError as e:
+            parser.error(str(e))
+    print(f"✓ Done in {counts['seconds']}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+"""
+HTTP load and latency benchmark for app_simple.
+
+Virtual users log in with their own session and loop through a script for
+their role until time runs out:
+
+    customer  browses and searches cars, checks availability, asks for quotes,
+              opens the dashboard, polls stats and now and then books a car
+    owner     opens the car owner dashboard and polls stats
+    company   opens the company dashboard, polls stats and browses cars
+    driver    starts a monitoring session on a rental in progress and streams
+              telemetry updates to it
+
+Requests run in-process through Flask's test client by default, which also
+records the SQL statements each request issues; with --url they go over HTTP
+to a running server instead. The database is sampled for users, cars and
+rentals, so point --database-uri at a dataset built by benchmarks.dataset
+(a small one is generated when it is omitted). With --url it must be the
+database the server is running on, or the virtual users would log in as
+users and ask for cars the server does not have. The in-process mode
+imports the full app and needs the complete requirements.
+
+Results are written as JSON; --compare checks them against an earlier run
+and exits non-zero when an endpoint got slower or issues more queries.
+
+    python -m benchmarks.dataset --database-uri sqlite:////tmp/big.db --cars 20000 --rentals 1000000
+    python -m benchmarks.load --database-uri sqlite:////tmp/big.db --users 32 --seconds 30 --output load.json
+    python -m benchmarks.load --database-uri sqlite:////tmp/big.db --compare load.json
+    python -m benchmarks.load --database-uri sqlite:////tmp/big.db --url http://127.0.0.1:5000
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+
+from benchmarks.common import make_app, percentile
+
+PASSWORD = 'password123'
+DEFAULT_MIX = {'customer': 50, 'owner': 15, 'company': 10, 'driver': 25}
+SAMPLE_SIZE = 500
+SEARCH_TERMS = ['toyota', 'honda civic', 'bmw', 'black', 'tesla model', 'ford f', 'silver camry']
+MAKES = ['Toyota', 'Honda', 'Ford', 'Chevrolet', 'Nissan', 'BMW', 'Tesla']
+SORTS = ['newest', 'price', 'price_desc', 'year']
+
+
+class InProcessClient:
+    """Requests through the Flask test client; counts SQL statements per request."""
+
+    def __init__(self, app):
+        from query_budget import count_queries
+        self._count_queries = count_queries
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None, json_body=None):
+        with self._count_queries() as counter:
+            response = self._client.open(path, method=method, data=data, json=json_body)
+            body = response.get_data()
+            response.close()
+        return response.status_code, body, counter.count
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Requests over HTTP with a cookie jar per virtual user; redirects are not followed."""
+
+    def __init__(self, base_url):
+        self._base_url = base_url.rstrip('/')
+        self._opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+    def request(self, method, path, data=None, json_body=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+        request = urllib.request.Request(self._base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self._opener.open(request) as response:
+                return response.status, response.read(), None
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), None
+
+
+def sample_targets(app, seed):
+    """Users per role, cars and rentals in progress to aim the virtual users at."""
+    from sqlalchemy import func
+    from models import db, User, Car, Rental, RentalCompany
+
+    now = datetime.utcnow()
+    rng = random.Random(seed)
+    with app.app_context():
+        def usernames(query):
+            return [username for (username,) in query.with_entities(User.username)
+                    .order_by(func.random()).limit(SAMPLE_SIZE)]
+
+        in_progress = Rental.query.join(User, User.id == Rental.customer_id) \
+            .filter(Rental.status == 'active', Rental.start_date <= now, Rental.end_date > now) \
+            .with_entities(Rental.id, User.username).order_by(func.random()).limit(SAMPLE_SIZE).all()
+        targets = {
+            'customer': usernames(User.query.filter_by(role='customer')),
+            'owner': usernames(User.query.filter_by(role='car_owner')),
+            'company': usernames(User.query.join(RentalCompany, RentalCompany.user_id == User.id)),
+            'driver': [tuple(row) for row in in_progress],
+            'car_ids': [car_id for (car_id,) in Car.query.filter(Car.status != 'maintenance')
+                        .with_entities(Car.id).order_by(func.random()).limit(SAMPLE_SIZE * 4)],
+        }
+        db.session.remove()
+    rng.shuffle(targets['car_ids'])
+    return targets
+
+
+def _period(rng, max_start_days=120):
+    start = datetime.utcnow().date() + timedelta(days=rng.randint(1, max_start_days))
+    return start.isoformat(), (start + timedelta(days=rng.randint(1, 7))).isoformat()
+
+
+def _browse_args(rng):
+    args = {'sort': rng.choice(SORTS)}
+    if rng.random() < 0.4:
+        args['make'] = rng.choice(MAKES)
+    if rng.random() < 0.3:
+        args['min_price'] = rng.choice([20, 40, 60])
+        args['max_price'] = args['min_price'] + rng.choice([20, 50, 100])
+    if rng.random() < 0.2:
+        args['start_date'], args['end_date'] = _period(rng)
+    return urllib.parse.urlencode(args)
+
+
+def customer_actions(rng, targets, state):
+    car_id = rng.choice(targets['car_ids'])
+    start, end = _period(rng)
+    return [
+        (30, 'GET /cars', lambda: ('GET', f'/cars?{_browse_args(rng)}', None, None)),
+        (20, 'GET /api/cars', lambda: ('GET', f'/api/cars?{_browse_args(rng)}', None, None)),
+        (10, 'GET /cars?q=', lambda: ('GET', '/cars?' + urllib.parse.urlencode({'q': rng.choice(SEARCH_TERMS)}),
+                                      None, None)),
+        (10, 'GET /api/cars/<id>/availability',
+         lambda: ('GET', f'/api/cars/{car_id}/availability?start_date={start}&end_date={end}', None, None)),
+        (5, 'POST /api/quotes', lambda: ('POST', '/api/quotes', None, {
+            'car_ids': rng.sample(targets['car_ids'], min(20, len(targets['car_ids']))),
+            'periods': [dict(zip(('start_date', 'end_date'), _period(rng))) for _ in range(3)]})),
+        (10, 'GET /customer', lambda: ('GET', '/customer', None, None)),
+        (10, 'GET /api/dashboard/stats', lambda: ('GET', '/api/dashboard/stats', None, None)),
+        (5, 'POST /rentals/book/<id>', lambda: ('POST', f'/rentals/book/{car_id}',
+                                                {'start_date': start, 'end_date': end}, None)),
+    ]
+
+
+def owner_actions(rng, targets, state):
+    return [
+        (30, 'GET /car_owner', lambda: ('GET', '/car_owner', None, None)),
+        (70, 'GET /api/dashboard/stats', lambda: ('GET', '/api/dashboard/stats', None, None)),
+    ]
+
+
+def company_actions(rng, targets, state):
+    return [
+        (30, 'GET /rental_company', lambda: ('GET', '/rental_company', None, None)),
+        (60, 'GET /api/dashboard/stats', lambda: ('GET', '/api/dashboard/stats', None, None)),
+        (10, 'GET /cars', lambda: ('GET', f'/cars?{_browse_args(rng)}', None, None)),
+    ]
+
+
+def driver_actions(rng, targets, state):
+    if state.get('session_id') is None:
+        return [(1, 'POST /api/monitor/start/<id>', lambda: ('POST', f"/api/monitor/start/{state['rental_id']}",
+                                                             None, None))]
+    state['blinks'] = state.get('blinks', 0) + rng.randint(0, 4)
+    return [
+        (95, 'POST /api/monitor/process', lambda: ('POST', '/api/monitor/process', None, {
+            'session_id': state['session_id'], 'blink_count': state['blinks'],
+            'drowsiness_alerts': state['blinks'] // 200, 'avg_ear': round(rng.uniform(0.22, 0.32), 3)})),
+        (5, 'GET /monitor/<id>', lambda: ('GET', f"/monitor/{state['rental_id']}", None, None)),
+    ]
+
+
+SCRIPTS = {'customer': customer_actions, 'owner': owner_actions, 'company': company_actions,
+           'driver': driver_actions}
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, label, elapsed, status, queries):
+        with self._lock:
+            self.samples[label].append(elapsed)
+            self.statuses[label][status] += 1
+            if queries is not None:
+                self.queries[label].append(queries)
+
+    def summary(self, seconds):
+        endpoints = {}
+        for label in sorted(self.samples):
+            samples, queries = self.samples[label], self.queries[label]
+            statuses = dict(sorted(self.statuses[label].items()))
+            endpoints[label] = {
+                'requests': len(samples),
+                'requests_per_second': round(len(samples) / seconds, 1),
+                'errors': sum(count for status, count in statuses.items() if status >= 500),
+                'statuses': {str(status): count for status, count in statuses.items()},
+                'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+                'p50_ms': percentile(samples, 0.5),
+                'p95_ms': percentile(samples, 0.95),
+                'p99_ms': percentile(samples, 0.99),
+                'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+                'queries_max': max(queries) if queries else None,
+            }
+        total = sum(endpoint['requests'] for endpoint in endpoints.values())
+        every_sample = [sample for samples in self.samples.values() for sample in samples]
+        return endpoints, {
+            'requests': total,
+            'requests_per_second': round(total / seconds, 1),
+            'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+            'p50_ms': percentile(every_sample, 0.5),
+            'p95_ms': percentile(every_sample, 0.95),
+            'p99_ms': percentile(every_sample, 0.99),
+        }
+
+
+def virtual_user(role, username, extra, make_client, targets, recorder, warmup_until, deadline, think, seed):
+    rng = random.Random(seed)
+    client = make_client()
+    status, _, _ = client.request('POST', '/login', {'username': username, 'password': PASSWORD})
+    if status != 302:
+        recorder.record('POST /login (failed)', 0.0, status, None)
+        return
+    state = {'rental_id': extra}
+    while time.perf_counter() < deadline:
+        actions = SCRIPTS[role](rng, targets, state)
+        _, label, build = rng.choices(actions, weights=[action[0] for action in actions])[0]
+        method, path, data, json_body = build()
+        started = time.perf_counter()
+        status, body, queries = client.request(method, path, data, json_body)
+        finished = time.perf_counter()
+        if label == 'POST /api/monitor/start/<id>' and status == 200:
+            state['session_id'] = json.loads(body)['session_id']
+        if started >= warmup_until:
+            recorder.record(label, finished - started, status, queries)
+        if think:
+            time.sleep(rng.expovariate(1 / think))
+    if state.get('session_id'):
+        client.request('POST', f"/api/monitor/stop/{state['session_id']}")
+
+
+def assign_roles(users, mix, rng):
+    """users roles split in proportion to mix (largest remainder), in random order."""
+    total = sum(mix.values())
+    shares = {role: users * weight / total for role, weight in mix.items()}
+    counts = {role: int(share) for role, share in shares.items()}
+    for role in sorted(shares, key=lambda role: shares[role] - counts[role], reverse=True)[:users - sum(counts.values())]:
+        counts[role] += 1
+    roles = [role for role, count in counts.items() for _ in range(count)]
+    rng.shuffle(roles)
+    return roles
+
+
+def run(users, seconds, warmup, mix, database_uri=None, url=None, think=0.0, seed=1):
+    if url and database_uri is None:
+        raise ValueError("a server's database_uri is needed to sample users and cars for it")
+    if database_uri is None:
+        handle, path = tempfile.mkstemp(prefix='car_rental_load_', suffix='.db')
+        os.close(handle)
+        database_uri = f'sqlite:///{path}'
+        from benchmarks import dataset
+        app = make_app(database_uri)
+        with app.app_context():
+            dataset.generate(cars=2000, rentals=50000, sessions=5000, seed=seed, progress=lambda line: None)
+
+    if url:
+        app = make_app(database_uri)
+        make_client = lambda: HttpClient(url)  # noqa: E731
+    else:
+        os.environ['DATABASE_URL'] = database_uri  # read by app_simple on import
+        from app_simple import app
+        make_client = lambda: InProcessClient(app)  # noqa: E731
+
+    targets = sample_targets(app, seed)
+    roles = assign_roles(users, mix, random.Random(seed))
+    workers = []
+    for i, role in enumerate(roles):
+        if role == 'driver':
+            if not targets['driver']:
+                role = 'customer'
+            else:
+                extra, username = targets['driver'][i % len(targets['driver'])]
+        if role != 'driver':
+            pool = targets[role] or targets['customer']
+            username, extra = pool[i % len(pool)], None
+        workers.append((role, username, extra))
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    warmup_until = started + warmup
+    deadline = warmup_until + seconds
+    threads = [threading.Thread(target=virtual_user, args=(role, username, extra, make_client, targets, recorder,
+                                                           warmup_until, deadline, think, seed * 1000 + i))
+               for i, (role, username, extra) in enumerate(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    endpoints, total = recorder.summary(seconds)
+    return {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'mode': 'http' if url else 'in-process',
+            'database': database_uri,
+            'users': users,
+            'roles': {role: roles.count(role) for role in mix},
+            'seconds': seconds,
+            'warmup_seconds': warmup,
+            'think_seconds': think,
+            'seed': seed,
+        },
+        'total': total,
+        'endpoints': endpoints,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline, tolerance):
+    """Lines describing endpoints that regressed against baseline by more than tolerance."""
+    regressions = []
+    for label, current in result['endpoints'].items():
+        previous = baseline['endpoints'].get(label)
+        if not previous:
+            continue
+        for metric in ('p95_ms', 'queries_mean'):
+            before, after = previous.get(metric), current.get(metric)
+            if before and after and after > before * (1 + tolerance):
+                regressions.append(f'{label}: {metric} {before} -> {after}')
+    return regressions
+
+
+def print_report(result):
+    columns = ('requests', 'requests_per_second', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_mean')
+    headers = ('requests', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'queries')
+    width = max(len(label) for label in result['endpoints']) if result['endpoints'] else 10
+    print(f"{'endpoint':<{width}} " + ' '.join(f'{header:>9}' for header in headers))
+    for label, endpoint in result['endpoints'].items():
+        print(f'{label:<{width}} ' + ' '.join(f'{str(endpoint[column]):>9}' for column in columns))
+    total = result['total']
+    print(f"\nTotal: {total['requests']} requests, {total['requests_per_second']} req/s, "
+          f"p50 {total['p50_ms']} ms, p95 {total['p95_ms']} ms, p99 {total['p99_ms']} ms, {total['errors']} errors")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        role, _, weight = part.partition('=')
+        if role not in SCRIPTS:
+            raise argparse.ArgumentTypeError(f"unknown role {role!r}, expected {', '.join(SCRIPTS)}")
+        mix[role] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-uri', help='dataset to sample users and cars from; with --url, the '
+                                               "server's database (default: a small generated one)")
+    parser.add_argument('--url', help='base URL of a running server; default runs the app in-process. '
+                                      'Needs --database-uri')
+    parser.add_argument('--users', type=int, default=32, help='concurrent virtual users')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of load before measuring')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='role weights, e.g. customer=50,owner=15,company=10,driver=25')
+    parser.add_argument('--think', type=float, default=0.0, help='mean pause between requests, seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative increase in p95 latency or queries per request')
+    args = parser.parse_args()
+    if args.url and not args.database_uri:
+        parser.error("--url needs --database-uri pointing at the server's database, "
+                     'so the benchmark logs in as users and books cars that exist there')
+
+    result = run(args.users, args.seconds, args.warmup, args.mix, args.database_uri, args.url, args.think, args.seed)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'✓ Results written to {args.output}')
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'✗ {line}')
+        if regressions:
+            raise SystemExit(1)
+        print(f'✓ No regressions against {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Atomic car booking.
+
+A booking inserts the rental and then, inside the same transaction, checks
+that no other active rental of the car overlaps it; if one does, the
+transaction is rolled back and the booking is refused. Writers to the same
+car are serialised by the database (SQLite's write lock, or the car row lock
+taken with SELECT ... FOR UPDATE on server databases), so two customers can
+never both book the same car for overlapping dates.
+
+Lock timeouts, deadlocks and serialisation failures are retried with
+jittered backoff instead of surfacing as server errors; any other database
+error is raised as it is. Customers whose nightly risk score (risk.py) has
+reached max_risk_score are refused before any lock is taken.
+"""
+
+import random
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from models import db, Car, Rental, RentalCompany
+import availability
+import quoting
+import risk
+
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 0.05
+
+# Errors that mean another transaction held the lock, so trying again can succeed
+SQLITE_LOCK_MESSAGES = ('database is locked', 'database table is locked')
+LOCK_SQLSTATES = ('40001', '40P01', '55P03')  # serialization failure, deadlock, lock not available
+MYSQL_LOCK_ERRORS = (1205, 1213)  # lock wait timeout, deadlock
+
+
+class BookingError(Exception):
+    pass
+
+
+class CarUnavailable(BookingError):
+    pass
+
+
+class NoRentalCompany(BookingError):
+    pass
+
+
+class BookingContention(BookingError):
+    pass
+
+
+class DriverRiskTooHigh(BookingError):
+    pass
+
+
+def is_lock_contention(error):
+    """Whether an OperationalError is a lock timeout or serialisation failure rather than a real fault."""
+    orig = getattr(error, 'orig', None)
+    if orig is None:
+        return False
+    if (getattr(orig, 'sqlstate', None) or getattr(orig, 'pgcode', None)) in LOCK_SQLSTATES:
+        return True
+    if orig.args and orig.args[0] in MYSQL_LOCK_ERRORS:
+        return True
+    message = str(orig).lower()
+    return any(text in message for text in SQLITE_LOCK_MESSAGES)
+
+
+def overlapping_rentals(car_id, start_date, end_date):
+    """Active rentals of the car that overlap [start_date, end_date)."""
+    return Rental.query.filter(
+        Rental.car_id == car_id,
+        Rental.status.in_(availability.BLOCKING_STATUSES),
+        Rental.start_date < end_date,
+        Rental.end_date > start_date
+    )
+
+
+def book_car(car_id, customer_id, start_date, end_date, max_attempts=MAX_ATTEMPTS, max_risk_score=None):
+    """Book a car for [start_date, end_date) and return the committed Rental.
+
+    Raises CarUnavailable if the car is in maintenance or already booked for
+    part of the period, NoRentalCompany if no company can handle the rental,
+    BookingContention if the database stayed locked for every attempt, and
+    DriverRiskTooHigh if max_risk_score is given and the customer's risk
+    score has reached it.
+    """
+    if max_risk_score is not None:
+        score = risk.score_of(customer_id)
+        if score is not None and score >= max_risk_score:
+            raise DriverRiskTooHigh('Bookings are on hold for this account after repeated drowsiness alerts; '
+                                    'please contact support')
+    for attempt in range(max_attempts):
+        try:
+            return _try_book(car_id, customer_id, start_date, end_date)
+        except OperationalError as e:
+            db.session.rollback()
+            if not is_lock_contention(e):
+                raise
+            if attempt == max_attempts - 1:
+                raise BookingContention('The booking system is busy, please try again')
+            time.sleep(BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def _try_book(car_id, customer_id, start_date, end_date):
+    car = Car.query.filter_by(id=car_id).with_for_update().one()
+    if car.status == 'maintenance':
+        db.session.rollback()
+        raise CarUnavailable('This car is currently unavailable')
+    # Cheap in-memory rejection before taking the write lock
+    if not availability.is_car_free(car_id, start_date, end_date):
+        db.session.rollback()
+        raise CarUnavailable('This car is already booked for some of those dates')
+
+    rental_company = RentalCompany.query.first()  # Simplified - in real app, you'd have logic to assign companies
+    if not rental_company:
+        db.session.rollback()
+        raise NoRentalCompany('No rental company available')
+
+    total_amount, commission, handling_fee = quoting.price(
+        car.daily_rate, (end_date - start_date).days, rental_company.commission_rate, rental_company.handling_fee
+    )
+    rental = Rental(
+        car_id=car_id,
+        customer_id=customer_id,
+        rental_company_id=rental_company.id,
+        start_date=start_date,
+        end_date=end_date,
+        daily_rate=car.daily_rate,
+        total_amount=total_amount,
+        commission=commission,
+        handling_fee=handling_fee
+    )
+    db.session.add(rental)
+    db.session.flush()
+
+    # The write lock is held from the flush until commit, so any booking
+    # that committed first is visible here.
+    if overlapping_rentals(car_id, start_date, end_date).filter(Rental.id != rental.id).first():
+        db.session.rollback()
+        raise CarUnavailable('This car is already booked for some of those dates')
+
+    # Only a rental that has already started takes the car off the lot;
+    # future bookings are tracked by the availability index
+    if start_date <= datetime.utcnow():
+        car.status = 'rented'
+    db.session.commit()
+    return rental
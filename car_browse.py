@@ -0,0 +1,209 @@
+"""
+Server-side filtering and keyset pagination for car browsing.
+
+Pages are addressed by an opaque cursor holding the sort key of the last car
+on the previous page, so fetching page N costs the same as fetching page 1
+(no OFFSET scan). Both the /cars page and the /api/cars endpoint use this.
+A free-text `q` switches to a single page of relevance-ranked results from
+the full-text index (see car_search.py), still narrowed by the filters.
+With start_date/end_date, only cars free for the whole period are returned
+(see availability.py) instead of cars whose status is currently 'available'.
+Booked cars are skipped in batches of SCAN_BATCH, and one request looks at
+no more than MAX_SCANNED cars; on a mostly booked fleet the page can come
+back short, with a cursor to carry on from the last car looked at.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+
+from models import Car
+import availability
+import car_search
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+SCAN_BATCH = 200  # candidate cars fetched per query when filtering by rental period
+MAX_SCANNED = 600  # most candidate cars one request looks at
+
+# sort name -> (sort column, ascending)
+SORTS = {
+    'newest': (None, False),
+    'price': (Car.daily_rate, True),
+    'price_desc': (Car.daily_rate, False),
+    'year': (Car.year, False),
+}
+
+class InvalidBrowseRequest(ValueError):
+    pass
+
+
+def _number(args, name, kind):
+    value = args.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        raise InvalidBrowseRequest(f'{name} must be a number')
+
+
+def parse_filters(args):
+    """Normalise browse filters from a request's query string."""
+    filters = {}
+    for name in ('q', 'make', 'model', 'color'):
+        value = args.get(name, '').strip()
+        if value:
+            filters[name] = value
+    for name, kind in (('min_price', float), ('max_price', float),
+                       ('min_year', int), ('max_year', int), ('company', int)):
+        value = _number(args, name, kind)
+        if value is not None:
+            filters[name] = value
+    for name in ('start_date', 'end_date'):
+        value = args.get(name, '').strip()
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise InvalidBrowseRequest(f'{name} must be a date (YYYY-MM-DD)')
+            filters[name] = value
+    if ('start_date' in filters) != ('end_date' in filters):
+        raise InvalidBrowseRequest('start_date and end_date must be given together')
+    if 'start_date' in filters and filters['end_date'] <= filters['start_date']:
+        raise InvalidBrowseRequest('end_date must be after start_date')
+    sort = args.get('sort', 'newest')
+    if sort not in SORTS:
+        raise InvalidBrowseRequest(f'sort must be one of: {", ".join(SORTS)}')
+    filters['sort'] = sort
+    return filters
+
+
+def encode_cursor(sort_value, car_id):
+    payload = json.dumps([sort_value, car_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, car_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return sort_value, int(car_id)
+    except (ValueError, TypeError):
+        raise InvalidBrowseRequest('invalid cursor')
+
+
+def rental_period(filters):
+    """(start, end) datetimes of the requested rental period, or None."""
+    if 'start_date' not in filters:
+        return None
+    return (datetime.strptime(filters['start_date'], '%Y-%m-%d'),
+            datetime.strptime(filters['end_date'], '%Y-%m-%d'))
+
+
+def filtered_query(filters):
+    """Listable cars matching the filters, without ordering or paging."""
+    if rental_period(filters):
+        # Availability for the period is checked against the rentals instead
+        query = Car.query.filter(Car.status != 'maintenance')
+    else:
+        query = Car.query.filter(Car.status == 'available')
+    if 'make' in filters:
+        query = query.filter(Car.make == filters['make'])
+    if 'model' in filters:
+        query = query.filter(Car.model == filters['model'])
+    if 'color' in filters:
+        query = query.filter(Car.color == filters['color'])
+    if 'min_price' in filters:
+        query = query.filter(Car.daily_rate >= filters['min_price'])
+    if 'max_price' in filters:
+        query = query.filter(Car.daily_rate <= filters['max_price'])
+    if 'min_year' in filters:
+        query = query.filter(Car.year >= filters['min_year'])
+    if 'max_year' in filters:
+        query = query.filter(Car.year <= filters['max_year'])
+    if 'company' in filters:
+        query = query.filter(Car.rental_company_id == filters['company'])
+    return query
+
+
+def _after_cursor(column, ascending, cursor):
+    sort_value, car_id = cursor
+    if column is None:
+        return Car.id > car_id if ascending else Car.id < car_id
+    if ascending:
+        return or_(column > sort_value, and_(column == sort_value, Car.id > car_id))
+    return or_(column < sort_value, and_(column == sort_value, Car.id < car_id))
+
+
+def browse_page(filters, cursor=None, limit=PAGE_SIZE):
+    """Return (cars, next_cursor) for one page; next_cursor is None on the last page.
+
+    With a rental period the page may hold fewer than limit cars and still
+    have a next_cursor, when the scan stopped at MAX_SCANNED.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    period = rental_period(filters)
+    if 'q' in filters:
+        query = filtered_query(filters).options(joinedload(Car.owner))
+        cars = car_search.search_cars(filters['q'], query, limit)
+        if period:
+            free = set(availability.free_car_ids([car.id for car in cars], *period))
+            cars = [car for car in cars if car.id in free]
+        return cars, None
+
+    column, ascending = SORTS[filters.get('sort', 'newest')]
+    order = [] if column is None else [column.asc() if ascending else column.desc()]
+    order.append(Car.id.asc() if ascending else Car.id.desc())
+    query = filtered_query(filters).options(joinedload(Car.owner)).order_by(*order)
+
+    def sort_key(car):
+        return None if column is None else getattr(car, column.key), car.id
+
+    # Without a period every row qualifies and one query fills the page. With
+    # one, cars booked for the period are skipped and scanning continues in
+    # key order until the page is full, the candidates run out or MAX_SCANNED
+    # cars have been looked at.
+    batch_size = max(limit + 1, SCAN_BATCH) if period else limit + 1
+    cars = []
+    scanned = 0
+    position = decode_cursor(cursor) if cursor else None
+    while True:
+        batch_query = query if position is None else query.filter(_after_cursor(column, ascending, position))
+        batch = batch_query.limit(batch_size).all()
+        scanned += len(batch)
+        if period:
+            free = set(availability.free_car_ids([car.id for car in batch], *period))
+            cars.extend(car for car in batch if car.id in free)
+        else:
+            cars.extend(batch)
+        if len(cars) > limit or len(batch) < batch_size:
+            break
+        position = sort_key(batch[-1])
+        if scanned >= MAX_SCANNED:
+            # A short page; the client carries on from the last car looked at
+            return cars, encode_cursor(*position)
+
+    next_cursor = None
+    if len(cars) > limit:
+        cars = cars[:limit]
+        next_cursor = encode_cursor(*sort_key(cars[-1]))
+    return cars, next_cursor
+
+
+def car_to_dict(car):
+    return {
+        'id': car.id,
+        'make': car.make,
+        'model': car.model,
+        'year': car.year,
+        'color': car.color,
+        'license_plate': car.license_plate,
+        'daily_rate': car.daily_rate,
+        'status': car.status,
+        'owner': car.owner.username,
+        'rental_company_id': car.rental_company_id
+    }
@@ -0,0 +1,137 @@
+"""
+Full-text car search backed by an SQLite FTS5 index.
+
+The car_search virtual table holds one row per car (rowid = Car.id) with the
+make, model, color, year, owner username and rental company name. It is
+created by create_schema() and kept in sync by mapper events whenever a car,
+or the owner/company name it shows, changes. Searches are prefix-aware
+("toy 202" matches "Toyota 2021") and ranked with bm25.
+
+On databases other than SQLite the index is not created and search falls
+back to unranked LIKE matching.
+"""
+
+import re
+
+from sqlalchemy import Float, Integer, and_, event, inspect, or_, select, text
+
+from models import db, Car, User, RentalCompany
+
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 100
+
+INDEXED_CAR_COLUMNS = ('make', 'model', 'color', 'year', 'owner_id', 'rental_company_id')
+
+_CREATE_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS car_search USING fts5(
+    make, model, color, year, owner, company,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+_REINDEX_CARS = """
+INSERT INTO car_search (rowid, make, model, color, year, owner, company)
+SELECT car.id, car.make, car.model, car.color, CAST(car.year AS TEXT), user.username, rental_company.name
+FROM car
+JOIN user ON user.id = car.owner_id
+LEFT JOIN rental_company ON rental_company.id = car.rental_company_id
+"""
+
+
+def _uses_fts(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def search_terms(query_text):
+    return re.findall(r'\w+', query_text.lower())
+
+
+def match_expression(terms):
+    """FTS5 MATCH expression requiring every term, each as a prefix."""
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+def rebuild_search_index(connection):
+    connection.execute(text('DELETE FROM car_search'))
+    connection.execute(text(_REINDEX_CARS))
+
+
+def reindex_cars(connection, where_sql, params):
+    connection.execute(text(f'DELETE FROM car_search WHERE rowid IN (SELECT id FROM car WHERE {where_sql})'), params)
+    connection.execute(text(f'{_REINDEX_CARS} WHERE {where_sql}'), params)
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_index(target, connection, **kw):
+    if not _uses_fts(connection):
+        return
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'car_search'")
+    ).first()
+    if not exists:
+        connection.execute(text(_CREATE_INDEX))
+        rebuild_search_index(connection)
+
+
+@event.listens_for(Car, 'after_insert')
+def _car_inserted(mapper, connection, target):
+    if _uses_fts(connection):
+        reindex_cars(connection, 'car.id = :car_id', {'car_id': target.id})
+
+
+@event.listens_for(Car, 'after_update')
+def _car_updated(mapper, connection, target):
+    state = inspect(target)
+    if _uses_fts(connection) and any(state.attrs[name].history.has_changes() for name in INDEXED_CAR_COLUMNS):
+        reindex_cars(connection, 'car.id = :car_id', {'car_id': target.id})
+
+
+@event.listens_for(Car, 'after_delete')
+def _car_deleted(mapper, connection, target):
+    if _uses_fts(connection):
+        connection.execute(text('DELETE FROM car_search WHERE rowid = :car_id'), {'car_id': target.id})
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    if _uses_fts(connection) and inspect(target).attrs.username.history.has_changes():
+        reindex_cars(connection, 'car.owner_id = :owner_id', {'owner_id': target.id})
+
+
+@event.listens_for(RentalCompany, 'after_update')
+def _company_updated(mapper, connection, target):
+    if _uses_fts(connection) and inspect(target).attrs.name.history.has_changes():
+        reindex_cars(connection, 'car.rental_company_id = :company_id', {'company_id': target.id})
+
+
+def search_cars(query_text, base_query=None, limit=SEARCH_LIMIT):
+    """Cars matching query_text, best match first.
+
+    base_query narrows the candidates (e.g. car_browse.filtered_query()) and
+    defaults to every car.
+    """
+    terms = search_terms(query_text)
+    if not terms:
+        return []
+    if base_query is None:
+        base_query = Car.query
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+
+    if not _uses_fts(db.session.connection()):
+        return _like_search(base_query, terms).order_by(Car.id.desc()).limit(limit).all()
+
+    matches = text('SELECT rowid AS car_id, rank FROM car_search WHERE car_search MATCH :match') \
+        .bindparams(match=match_expression(terms)) \
+        .columns(car_id=Integer, rank=Float) \
+        .subquery('matches')
+    return base_query.join(matches, matches.c.car_id == Car.id) \
+        .order_by(matches.c.rank, Car.id).limit(limit).all()
+
+
+def _like_search(base_query, terms):
+    owner_name = select(User.username).where(User.id == Car.owner_id).scalar_subquery()
+    company_name = select(RentalCompany.name).where(RentalCompany.id == Car.rental_company_id).scalar_subquery()
+    fields = (Car.make, Car.model, Car.color, db.cast(Car.year, db.String), owner_name, company_name)
+    return base_query.filter(and_(*(
+        or_(*(field.ilike(f'{term}%') for field in fields)) for term in terms
+    )))
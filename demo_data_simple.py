@@ -5,6 +5,7 @@ This script populates the database with sample data for testing.
 """
 
 from app_simple import app, db, User, Car, RentalCompany, Rental
+from models import create_schema
 from werkzeug.security import generate_password_hash
 from datetime import datetime, timedelta
 import random
@@ -189,7 +190,7 @@ def main():
         print("=" * 50)
         
         # Create database tables
-        db.create_all()
+        create_schema()
         print("✓ Database tables created")
         
         # Create demo data
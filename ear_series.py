@@ -0,0 +1,131 @@
+"""
+Whole-trip eye aspect ratio series for the monitoring charts.
+
+The detector keeps only its last few EAR readings for blink and drowsiness
+decisions; EarSeries keeps every reading of the trip in growable NumPy arrays
+(about 12 bytes a reading), numbered with a sequence that keeps counting
+across reset_counters(), so a chart can ask for just the readings after the
+last one it has. min, max and mean are maintained as readings arrive, so
+statistics() costs the same however long the trip.
+
+downsample() reduces a window to a point budget by keeping the lowest and
+highest reading of each bucket, so blinks and long closures (the dips that
+matter) survive however far the series is reduced.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+MAX_READINGS = 2000000  # about 18 hours at 30 fps; the oldest half is dropped beyond this
+TREND_READINGS = 10
+
+
+class EarSeries:
+    def __init__(self, max_readings=MAX_READINGS):
+        self.max_readings = max_readings
+        self._lock = threading.Lock()
+        self._next_seq = 1
+        self.clear()
+
+    def clear(self):
+        """Forget every reading; sequence numbers carry on from where they were."""
+        with self._lock:
+            self._t = np.empty(1024, dtype=np.float64)
+            self._ear = np.empty(1024, dtype=np.float32)
+            self._size = 0
+            self._first_seq = self._next_seq
+            self.started_at = None
+            self._count = 0
+            self._sum = 0.0
+            self._min = float('inf')
+            self._max = float('-inf')
+
+    def append(self, ear, at=None):
+        """Record one reading and return its sequence number."""
+        at = time.time() if at is None else at
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = at
+            if self._size == len(self._t):
+                self._grow()
+            self._t[self._size] = at - self.started_at
+            self._ear[self._size] = ear
+            self._size += 1
+            self._count += 1
+            self._sum += ear
+            self._min = min(self._min, ear)
+            self._max = max(self._max, ear)
+            seq = self._next_seq
+            self._next_seq += 1
+            return seq
+
+    def _grow(self):
+        if self._size >= self.max_readings:
+            keep = self._size // 2
+            self._t[:keep] = self._t[self._size - keep:self._size]
+            self._ear[:keep] = self._ear[self._size - keep:self._size]
+            self._first_seq += self._size - keep
+            self._size = keep
+            return
+        capacity = min(len(self._t) * 2, self.max_readings)
+        self._t = np.resize(self._t, capacity)
+        self._ear = np.resize(self._ear, capacity)
+
+    @property
+    def last_seq(self):
+        """Sequence number of the newest reading, 0 before the first one."""
+        return self._next_seq - 1
+
+    def window(self, since=None, start=None, end=None):
+        """(first sequence number, times, values) of the readings after since and between start and end seconds."""
+        with self._lock:
+            t = self._t[:self._size]
+            first = 0
+            if since is not None:
+                first = min(max(since + 1 - self._first_seq, 0), self._size)
+            if start is not None:
+                first = max(first, int(np.searchsorted(t, start, side='left')))
+            stop = self._size if end is None else int(np.searchsorted(t, end, side='right'))
+            stop = max(stop, first)
+            return self._first_seq + first, t[first:stop].copy(), self._ear[first:stop].copy()
+
+    def statistics(self):
+        """min, max and mean over the trip, the newest reading, and whether the EAR is rising or falling."""
+        with self._lock:
+            if not self._count:
+                return {'min': 0.0, 'max': 0.0, 'avg': 0.0, 'current': 0.0, 'trend': 'stable'}
+            recent = self._ear[max(self._size - 2 * TREND_READINGS, 0):self._size]
+            trend = 'stable'
+            if len(recent) == 2 * TREND_READINGS:
+                recent_avg = float(recent[TREND_READINGS:].mean())
+                previous_avg = float(recent[:TREND_READINGS].mean())
+                if recent_avg > previous_avg * 1.05:
+                    trend = 'increasing'
+                elif recent_avg < previous_avg * 0.95:
+                    trend = 'decreasing'
+            return {
+                'min': self._min,
+                'max': self._max,
+                'avg': self._sum / self._count,
+                'current': float(self._ear[self._size - 1]),
+                'trend': trend,
+            }
+
+
+def downsample(values, max_points):
+    """Indexes of at most max_points values keeping each bucket's minimum and maximum, in order."""
+    count = len(values)
+    if count <= max_points:
+        return np.arange(count)
+    buckets = max(max_points // 2, 1)
+    size = -(-count // buckets)  # ceil
+    buckets = -(-count // size)
+    # Pad the last bucket with its final value so every bucket has the same size
+    padded = np.concatenate([values, np.full(buckets * size - count, values[-1], dtype=values.dtype)])
+    grid = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    lows = np.minimum(offsets + grid.argmin(axis=1), count - 1)
+    highs = np.minimum(offsets + grid.argmax(axis=1), count - 1)
+    return np.unique(np.concatenate([lows, highs]))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Streaming export of rental and monitoring history.
+
+Rows are read through a server-side cursor CHUNK_ROWS at a time and encoded
+chunk by chunk as CSV, gzipped CSV or zstd-compressed Parquet (one row group
+per chunk), so memory stays flat however many rows are exported and the first
+bytes go out before the query has finished. Exports read hot and archived
+rows alike (models.RentalHistory / MonitoringHistory).
+
+Each export runs on its own connection rather than the request's session, so
+the response can keep streaming after the view has returned; on SQLite in WAL
+mode it reads a snapshot and does not hold up writers.
+
+Parquet needs pyarrow (pip install pyarrow); CSV has no extra dependencies.
+
+    python export.py rentals --owner-id 3 --format parquet --output rentals.parquet
+    python export.py monitoring --company-id 1 --format csv.gz --output sessions.csv.gz
+"""
+
+import argparse
+import csv
+import io
+import sys
+import zlib
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, select
+
+from models import db, Car, MonitoringHistory, RentalHistory
+
+CHUNK_ROWS = 5000
+FORMATS = {
+    # format -> (mimetype, file extension)
+    'csv': ('text/csv', 'csv'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def rentals_query(owner_id=None, company_id=None):
+    rental = RentalHistory
+    query = select(
+        rental.id, rental.car_id, Car.license_plate, Car.make, Car.model, rental.customer_id,
+        rental.rental_company_id, rental.start_date, rental.end_date, rental.daily_rate, rental.total_amount,
+        rental.commission, rental.handling_fee, rental.status, rental.created_at,
+    ).join(Car, Car.id == rental.car_id)
+    if owner_id is not None:
+        query = query.where(Car.owner_id == owner_id)
+    if company_id is not None:
+        query = query.where(rental.rental_company_id == company_id)
+    return query.order_by(rental.id)
+
+
+def monitoring_query(owner_id=None, company_id=None):
+    session = MonitoringHistory
+    query = select(
+        session.id, session.rental_id, session.car_id, Car.license_plate, session.driver_id,
+        session.session_start, session.session_end, session.total_blinks, session.drowsiness_alerts,
+        session.avg_ear, session.status,
+    ).join(Car, Car.id == session.car_id)
+    if owner_id is not None:
+        query = query.where(Car.owner_id == owner_id)
+    if company_id is not None:
+        query = query.where(session.rental_id.in_(
+            select(RentalHistory.id).where(RentalHistory.rental_company_id == company_id)))
+    return query.order_by(session.id)
+
+
+DATASETS = {
+    'rentals': rentals_query,
+    'monitoring': monitoring_query,
+}
+
+
+def _chunks(engine, query, chunk_rows):
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_rows).execute(query)
+        for rows in result.partitions():
+            yield rows
+
+
+def stream(engine, query, fmt='csv', chunk_rows=CHUNK_ROWS):
+    """Yield the query's result encoded as fmt, in pieces of about chunk_rows rows."""
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if fmt == 'parquet':
+        return _parquet(engine, query, chunk_rows)
+    encoded = _csv(engine, query, chunk_rows)
+    return _gzip(encoded) if fmt == 'csv.gz' else encoded
+
+
+def _csv(engine, query, chunk_rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in query.selected_columns])
+    for rows in _chunks(engine, query, chunk_rows):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _gzip(pieces):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain()."""
+
+    def __init__(self):
+        self._pieces = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._pieces.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._pieces)
+        self._pieces.clear()
+        return data
+
+
+def _arrow_type(pa, column_type):
+    if isinstance(column_type, Boolean):
+        return pa.bool_()
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, Float):
+        return pa.float64()
+    if isinstance(column_type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column_type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def _parquet(engine, query, chunk_rows):
+    # Imported here so a missing pyarrow only affects Parquet, and fails before streaming starts
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError('Parquet export needs pyarrow (pip install pyarrow)')
+    return _parquet_pieces(pa, pq, engine, query, chunk_rows)
+
+
+def _parquet_pieces(pa, pq, engine, query, chunk_rows):
+    schema = pa.schema([(column.name, _arrow_type(pa, column.type)) for column in query.selected_columns])
+    sink = _Sink()
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for rows in _chunks(engine, query, chunk_rows):
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def filename(dataset, fmt):
+    return f'{dataset}.{FORMATS[fmt][1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export rental or monitoring history.')
+    parser.add_argument('dataset', choices=sorted(DATASETS))
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument('--owner-id', type=int, help="only this car owner's cars")
+    scope.add_argument('--company-id', type=int, help="only this rental company's rentals")
+    parser.add_argument('--output', help='file to write (default: stdout)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    from app_simple import app
+
+    with app.app_context():
+        query = DATASETS[args.dataset](owner_id=args.owner_id, company_id=args.company_id)
+        pieces = stream(db.engine, query, args.format, args.chunk_rows)
+        output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            for piece in pieces:
+                output.write(piece)
+        finally:
+            if args.output:
+                output.close()
+
+
+if __name__ == "__main__":
+    main()
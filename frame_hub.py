@@ -0,0 +1,144 @@
+"""
+Latest-frame broadcast for camera monitoring sessions.
+
+One producer thread per session runs the fatigue detector and publishes each
+processed frame as JPEG bytes together with the status that came with it.
+Viewers never process frames themselves: they wait for a frame newer than the
+last one they sent, so any number of viewers costs one camera read per frame
+and a slow viewer skips frames instead of queueing them.
+
+A hub stops when its session is stopped, when the producer reports the session
+is over, or when nobody has watched or polled it for idle_timeout seconds (a
+browser that went away without stopping the session). on_stop runs exactly
+once, whichever of these comes first.
+
+Waiting works from plain threads (the Flask routes) and from asyncio tasks
+(streaming_server).
+"""
+
+import asyncio
+import threading
+import time
+
+FRAME_INTERVAL = 0.033  # ~30 FPS
+WAIT_TIMEOUT = 5.0
+
+
+class FrameHub:
+    def __init__(self, session_id, produce, on_stop=None, idle_timeout=None):
+        """produce() returns (jpeg bytes or None, status dict), or None when the session is over."""
+        self.session_id = session_id
+        self.seq = 0
+        self.frame = None
+        self.status = {}
+        self.active = True
+        self.idle_timeout = idle_timeout
+        self.last_active = time.monotonic()
+        self._produce = produce
+        self._on_stop = on_stop
+        self._condition = threading.Condition()
+        self._async_events = {}  # event loop -> asyncio.Event shared by that loop's waiters
+        self._thread = threading.Thread(target=self._run, name=f'frames-{session_id}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            on_stop, self._on_stop = self._on_stop, None
+            self.active = False
+        self._notify()
+        if on_stop is not None:
+            on_stop()
+
+    def touch(self):
+        """Record that someone is still watching or polling the session."""
+        self.last_active = time.monotonic()
+
+    def idle(self):
+        return self.idle_timeout is not None and time.monotonic() - self.last_active > self.idle_timeout
+
+    def _run(self):
+        while self.active and not self.idle():
+            try:
+                produced = self._produce()
+            except Exception as e:
+                print(f"Error in frame generation: {e}")
+                produced = None
+            if produced is None:
+                break
+            frame, status = produced
+            with self._condition:
+                if frame is not None:
+                    self.frame = frame
+                self.status = status
+                self.seq += 1
+            self._notify()
+            time.sleep(FRAME_INTERVAL)
+        if _hubs.get(self.session_id) is self:
+            _hubs.pop(self.session_id, None)
+        self.stop()
+
+    def _notify(self):
+        with self._condition:
+            self._condition.notify_all()
+            events = list(self._async_events.items())
+        for loop, event in events:
+            loop.call_soon_threadsafe(event.set)
+
+    def wait(self, seq, timeout=WAIT_TIMEOUT):
+        """Block until a frame newer than seq is published or the hub stops; return the current seq."""
+        self.touch()
+        with self._condition:
+            self._condition.wait_for(lambda: not self.active or self.seq > seq, timeout)
+            return self.seq
+
+    async def wait_async(self, seq, timeout=WAIT_TIMEOUT):
+        """wait() for asyncio tasks, without tying up a thread."""
+        self.touch()
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            event = self._async_events.get(loop)
+            if event is None or event.is_set():
+                event = self._async_events[loop] = asyncio.Event()
+        if self.active and self.seq <= seq:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.seq
+
+    def frames(self):
+        """Yield each newly published JPEG frame until the hub stops."""
+        seq = 0
+        while self.active:
+            latest = self.wait(seq)
+            if latest != seq and self.frame is not None:
+                seq = latest
+                yield self.frame
+
+
+_hubs = {}
+
+
+def start(session_id, produce, on_stop=None, idle_timeout=None):
+    stop(session_id)
+    hub = _hubs[session_id] = FrameHub(session_id, produce, on_stop, idle_timeout)
+    hub.start()
+    return hub
+
+
+def stop(session_id):
+    hub = _hubs.pop(session_id, None)
+    if hub is not None:
+        hub.stop()
+
+
+def touch(session_id):
+    hub = _hubs.get(session_id)
+    if hub is not None:
+        hub.touch()
+
+
+def get(session_id):
+    return _hubs.get(session_id)
@@ -0,0 +1,127 @@
+"""
+In-process cache of logged-in identities.
+
+Flask-Login calls load_user() on every authenticated request. Instead of a
+User row it now gets an Identity: a read-only snapshot of the user's id,
+username, email and role plus the id of their rental company, loaded together
+in one query and kept in a small LRU for `ttl` seconds. Requests served from
+the cache authenticate without touching the database.
+
+Changes to a user or their company written through the ORM drop the entry
+once the transaction commits. Other processes do not share the cache, so the
+TTL bounds how long they keep serving a changed role or a deleted account.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import db, User, RentalCompany
+
+
+class Identity(UserMixin):
+    """What the request needs to know about the logged-in user."""
+
+    def __init__(self, id, username, email, role, company_id):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.role = role
+        self.company_id = company_id
+
+    def __repr__(self):
+        return f'<Identity {self.id} {self.role}>'
+
+
+class IdentityCache:
+    def __init__(self, ttl=60, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the live identity for user_id, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            identity, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return identity
+
+    def set(self, identity):
+        if self.ttl <= 0:
+            return identity
+        with self._lock:
+            self._entries[identity.id] = (identity, time.monotonic() + self.ttl)
+            self._entries.move_to_end(identity.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def load_identity(user_id):
+    """Identity for user_id from the cache or one user+company query; None if there is no such user."""
+    identity = identity_cache.get(user_id)
+    if identity is not None:
+        return identity
+    row = db.session.query(User.id, User.username, User.email, User.role, RentalCompany.id) \
+        .outerjoin(RentalCompany, RentalCompany.user_id == User.id) \
+        .filter(User.id == user_id).order_by(RentalCompany.id).first()
+    if row is None:
+        return None
+    return identity_cache.set(Identity(*row))
+
+
+# Drop identities touched by this process's sessions once the change commits.
+def _record(target, user_id_attr):
+    session = object_session(target)
+    if session is None:
+        return
+    history = inspect(target).attrs[user_id_attr].history
+    user_ids = set(history.deleted) | {getattr(target, user_id_attr)}
+    session.info.setdefault('identity_changes', set()).update(user_ids)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    _record(target, 'id')
+
+
+@event.listens_for(RentalCompany, 'after_insert')
+@event.listens_for(RentalCompany, 'after_update')
+@event.listens_for(RentalCompany, 'after_delete')
+def _company_changed(mapper, connection, target):
+    _record(target, 'user_id')
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    identity_cache.invalidate(*session.info.pop('identity_changes', ()))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_changes(session, previous_transaction):
+    session.info.pop('identity_changes', None)
+
+
+# Global cache instance
+identity_cache = IdentityCache()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Rental lifecycle transitions driven by the clock.
+
+Each run does two things:
+
+- Rentals still 'active' whose end_date has passed become 'completed', in
+  batches of batch_size walked in (end_date, id) order over the
+  ix_rental_status_end index. In the same transaction as each batch, the
+  batch's open monitoring sessions are closed, the revenue and safety rollups
+  gain the batch's completed amounts and ended sessions, and cars with no
+  other rental in progress go back to 'available'.
+- Cars that are 'available' while one of their rentals is in progress (a
+  booking made ahead of time that has now started) become 'rented'.
+
+Each batch first claims its rentals under the write lock (BEGIN IMMEDIATE
+on SQLite, row locks elsewhere) with an UPDATE that re-checks status =
+'active', and only the rows that UPDATE changed are counted into the
+rollups, so a run that overlaps another run, or repeats one, changes
+nothing twice. A run touches only due rentals and rentals in progress,
+however much history there is.
+
+The apps run it every LIFECYCLE_INTERVAL seconds on a background thread; with
+several worker processes, or to drive it from cron instead, run
+
+    python lifecycle.py            # one pass
+    python lifecycle.py --loop 60  # every 60 seconds
+"""
+
+import argparse
+import threading
+import time
+from datetime import date, datetime
+
+from sqlalchemy import exists, func, select
+
+from models import db, Car, DriverMonitoring, Rental, RentalCompany
+import revenue
+import safety
+from stats_cache import stats_cache, stats_key
+
+BATCH_SIZE = 1000
+
+
+def complete_due_rentals(now=None, batch_size=BATCH_SIZE):
+    """Complete active rentals that ended by now; return how many were completed."""
+    now = now or datetime.utcnow()
+    rental = Rental.__table__
+    completed = 0
+    while True:
+        _begin_write()
+        ids = [rental_id for (rental_id,) in db.session.execute(
+            select(rental.c.id)
+            .where(rental.c.status == 'active', rental.c.end_date <= now)
+            .order_by(rental.c.end_date, rental.c.id)
+            .limit(batch_size)
+            .with_for_update()
+        )]
+        if not ids:
+            db.session.commit()  # gives up the write lock
+            break
+        ids = _claim(ids)
+        batch = rental.c.id.in_(ids)
+        car_ids = [car_id for (car_id,) in db.session.execute(select(rental.c.car_id).where(batch).distinct())]
+
+        stale_keys = _stats_keys(ids)
+        _add_to_rollups(ids)
+        safety.add_ending_sessions(ids, now)
+        db.session.execute(
+            DriverMonitoring.__table__.update()
+            .where(DriverMonitoring.__table__.c.rental_id.in_(ids), DriverMonitoring.__table__.c.status == 'active')
+            .values(status='completed', session_end=now)
+        )
+        _release_cars(car_ids, now)
+        db.session.commit()
+        stats_cache.invalidate(*stale_keys)
+        completed += len(ids)
+
+    # Rows already loaded in the session still show the old statuses
+    db.session.expire_all()
+    return completed
+
+
+def start_due_rentals(now=None):
+    """Mark cars as rented when one of their rentals is in progress; return how many changed."""
+    now = now or datetime.utcnow()
+    car = Car.__table__
+    # Once complete_due_rentals() has run, active rentals that have not ended
+    # are current and future bookings only, found by range on ix_rental_status_end
+    in_progress = select(Rental.car_id).where(
+        Rental.status == 'active', Rental.start_date <= now, Rental.end_date > now
+    )
+    result = db.session.execute(
+        car.update().where(car.c.status == 'available', car.c.id.in_(in_progress)).values(status='rented')
+    )
+    db.session.commit()
+    if result.rowcount:
+        stats_cache.clear()
+    return result.rowcount
+
+
+def run_once(now=None, batch_size=BATCH_SIZE):
+    now = now or datetime.utcnow()
+    return {
+        'completed': complete_due_rentals(now, batch_size),
+        'started': start_due_rentals(now),
+    }
+
+
+def _begin_write():
+    """Start the batch's transaction holding the write lock.
+
+    SQLite otherwise runs the batch's reads outside any lock, and an
+    overlapping run could read the same batch before this one commits.
+    Server databases lock the batch's rows with SELECT ... FOR UPDATE.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def _claim(ids):
+    """Mark the rentals among ids that are still active as completed; return the ids this changed."""
+    rental = Rental.__table__
+    claim = rental.update().where(rental.c.id.in_(ids), rental.c.status == 'active').values(status='completed')
+    if db.engine.dialect.update_returning:
+        return [rental_id for (rental_id,) in db.session.execute(claim.returning(rental.c.id))]
+    # The rows are locked, so every one of them is still active
+    db.session.execute(claim)
+    return ids
+
+
+def _add_to_rollups(ids):
+    """Apply the revenue of the rentals just claimed as completed."""
+    day = func.date(Rental.end_date)
+    measures = (func.count(Rental.id), func.sum(Rental.total_amount),
+                func.sum(Rental.commission), func.sum(Rental.handling_fee))
+    due = Rental.query.filter(Rental.id.in_(ids))
+
+    by_owner = due.join(Car, Car.id == Rental.car_id) \
+        .with_entities(Car.owner_id, day, *measures).group_by(Car.owner_id, day).all()
+    by_company = due.with_entities(Rental.rental_company_id, day, *measures) \
+        .group_by(Rental.rental_company_id, day).all()
+
+    connection = db.session.connection()
+    for scope, rows in (('owner', by_owner), ('company', by_company)):
+        for principal_id, rental_day, *delta in rows:
+            revenue.apply_revenue_delta(connection, scope, principal_id, _as_date(rental_day), tuple(delta))
+
+
+def _as_date(value):
+    # SQLite returns date() as text
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _release_cars(car_ids, now):
+    """Make rented cars available again unless another rental of theirs is in progress."""
+    car = Car.__table__
+    busy = exists().where(
+        Rental.car_id == car.c.id, Rental.status == 'active', Rental.start_date <= now, Rental.end_date > now
+    )
+    db.session.execute(
+        car.update().where(car.c.id.in_(car_ids), car.c.status == 'rented', ~busy).values(status='available')
+    )
+
+
+def _stats_keys(ids):
+    """Dashboard stats cache keys affected by completing the rentals in ids."""
+    rows = db.session.execute(
+        select(Rental.customer_id, Car.owner_id, RentalCompany.user_id)
+        .join(Car, Car.id == Rental.car_id)
+        .join(RentalCompany, RentalCompany.id == Rental.rental_company_id)
+        .where(Rental.id.in_(ids))
+    ).all()
+    keys = {stats_key('admin')}
+    for customer_id, owner_id, company_user_id in rows:
+        keys.update((stats_key('customer', customer_id), stats_key('car_owner', owner_id),
+                     stats_key('rental_company', company_user_id)))
+    return keys
+
+
+class LifecycleScheduler:
+    """Runs run_once() every interval seconds on a daemon thread."""
+
+    def __init__(self, app, interval=60, batch_size=BATCH_SIZE):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rental-lifecycle', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    changes = run_once(batch_size=self.batch_size)
+                    if any(changes.values()):
+                        self.app.logger.info('Rental lifecycle: %(completed)d completed, %(started)d started', changes)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Rental lifecycle run failed')
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Complete ended rentals and update car statuses.')
+    parser.add_argument('--loop', type=float, metavar='SECONDS', help='keep running, pausing this long between runs')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    from app_simple import app
+
+    while True:
+        with app.app_context():
+            started = time.perf_counter()
+            changes = run_once(batch_size=args.batch_size)
+            print(f"✓ {changes['completed']} rentals completed, {changes['started']} cars now rented "
+                  f"({time.perf_counter() - started:.2f}s)")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
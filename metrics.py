@@ -0,0 +1,192 @@
+"""
+Request metrics in the Prometheus text exposition format.
+
+Every request is counted by endpoint, method and status, and its latency is
+added to a fixed-bucket histogram per endpoint. Streaming responses wrapped in
+tracked_stream() show up in the streaming_connections gauge while they are
+open, and requests turned away by admission control (admission.py) are
+counted by endpoint and reason in admission_rejected_total. GET /metrics
+serves it all for a scraper; each worker process keeps its own numbers, so
+scrape every worker.
+
+Each thread records into its own shard of plain dicts, so the request path
+takes no lock. Shards are summed when /metrics is scraped, and shards of
+finished threads are folded into one, so a thread-per-request server does not
+grow the list without bound.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMPACT_EVERY = 64  # new shards between folding in finished threads
+
+
+class _Shard:
+    __slots__ = ('requests', 'latency', 'gauges', 'rejected')
+
+    def __init__(self):
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.latency = {}   # endpoint -> [count per bucket..., count above the last bucket, sum]
+        self.gauges = {}    # (name, endpoint) -> value
+        self.rejected = {}  # (endpoint, reason) -> count
+
+    def merge(self, other):
+        for key, count in other.requests.items():
+            self.requests[key] = self.requests.get(key, 0) + count
+        for endpoint, histogram in other.latency.items():
+            mine = self.latency.get(endpoint)
+            self.latency[endpoint] = list(histogram) if mine is None else [a + b for a, b in zip(mine, histogram)]
+        for key, value in other.gauges.items():
+            self.gauges[key] = self.gauges.get(key, 0) + value
+        for key, count in other.rejected.items():
+            self.rejected[key] = self.rejected.get(key, 0) + count
+
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # (thread, shard)
+        self._retired = _Shard()
+        self._registrations = 0
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                self._registrations += 1
+                if self._registrations % COMPACT_EVERY == 0:
+                    self._compact()
+        return shard
+
+    def _compact(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._retired.merge(shard)
+        self._shards = live
+
+    def observe_request(self, endpoint, method, status, seconds):
+        shard = self._shard()
+        key = (endpoint, method, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        histogram = shard.latency.get(endpoint)
+        if histogram is None:
+            histogram = shard.latency[endpoint] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def add_gauge(self, name, endpoint, amount):
+        shard = self._shard()
+        key = (name, endpoint)
+        shard.gauges[key] = shard.gauges.get(key, 0) + amount
+
+    def observe_rejected(self, endpoint, reason):
+        shard = self._shard()
+        key = (endpoint, reason)
+        shard.rejected[key] = shard.rejected.get(key, 0) + 1
+
+    def tracked_stream(self, iterable, endpoint):
+        """Wrap a streaming response body so it counts as an open stream until closed."""
+        self.add_gauge('streaming_connections', endpoint, 1)
+        try:
+            yield from iterable
+        finally:
+            self.add_gauge('streaming_connections', endpoint, -1)
+
+    def snapshot(self):
+        with self._lock:
+            self._compact()
+            total = _Shard()
+            total.merge(self._retired)
+            for _, shard in self._shards:
+                # Copies, since the owning threads keep writing
+                total.merge(_frozen(shard))
+        return total
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        total = self.snapshot()
+        lines = [
+            '# HELP http_requests_total Requests handled, by endpoint, method and status.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (endpoint, method, status), count in sorted(total.requests.items()):
+            lines.append(f'http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+        lines += [
+            '# HELP http_request_duration_seconds Time to produce a response, by endpoint.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for endpoint, histogram in sorted(total.latency.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram[:-1]):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{_labels(endpoint=endpoint, le=bound)} {cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{_labels(endpoint=endpoint)} {histogram[-1]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{_labels(endpoint=endpoint)} {cumulative}')
+
+        lines += [
+            '# HELP streaming_connections Streaming responses currently open, by endpoint.',
+            '# TYPE streaming_connections gauge',
+        ]
+        for (name, endpoint), value in sorted(total.gauges.items()):
+            lines.append(f'{name}{_labels(endpoint=endpoint)} {value}')
+
+        lines += [
+            '# HELP admission_rejected_total Requests refused by admission control, by endpoint and reason.',
+            '# TYPE admission_rejected_total counter',
+        ]
+        for (endpoint, reason), count in sorted(total.rejected.items()):
+            lines.append(f'admission_rejected_total{_labels(endpoint=endpoint, reason=reason)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _frozen(shard):
+    copy = _Shard()
+    copy.requests = dict(shard.requests)
+    copy.latency = {endpoint: list(histogram) for endpoint, histogram in list(shard.latency.items())}
+    copy.gauges = dict(shard.gauges)
+    copy.rejected = dict(shard.rejected)
+    return copy
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+
+
+def _finish_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        metrics.observe_request(request.endpoint or 'unmatched', request.method, response.status_code,
+                                time.perf_counter() - started)
+    return response
+
+
+def _metrics_view():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', _metrics_view)
+
+
+# Global metrics registry
+metrics = Metrics()
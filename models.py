@@ -0,0 +1,205 @@
+"""
+Database models shared by app.py and app_simple.py.
+"""
+
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import UserMixin
+from datetime import datetime
+
+db = SQLAlchemy()
+
+# Database Models
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(120), nullable=False)
+    role = db.Column(db.String(20), nullable=False)  # 'admin', 'car_owner', 'rental_company', 'customer'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    cars = db.relationship('Car', backref='owner', lazy=True)
+    rentals = db.relationship('Rental', backref='customer', lazy=True)
+    company = db.relationship('RentalCompany', backref='user', uselist=False)
+
+class Car(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    make = db.Column(db.String(50), nullable=False)
+    model = db.Column(db.String(50), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    license_plate = db.Column(db.String(20), unique=True, nullable=False)
+    color = db.Column(db.String(20), nullable=False)
+    daily_rate = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), default='available')  # 'available', 'rented', 'maintenance'
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    rental_company_id = db.Column(db.Integer, db.ForeignKey('rental_company.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    rentals = db.relationship('Rental', backref='car', lazy=True)
+    monitoring_data = db.relationship('DriverMonitoring', backref='car', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_car_owner', 'owner_id'),
+        db.Index('ix_car_company', 'rental_company_id'),
+        db.Index('ix_car_status_make', 'status', 'make'),
+        db.Index('ix_car_status_rate', 'status', 'daily_rate', 'id'),
+        db.Index('ix_car_status_year', 'status', 'year', 'id'),
+    )
+
+class RentalCompany(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    address = db.Column(db.Text, nullable=False)
+    phone = db.Column(db.String(20), nullable=False)
+    commission_rate = db.Column(db.Float, default=0.15)  # 15% commission
+    handling_fee = db.Column(db.Float, default=50.0)  # $50 handling fee
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    cars = db.relationship('Car', backref='rental_company', lazy=True)
+    rentals = db.relationship('Rental', backref='rental_company', lazy=True)
+
+class Rental(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    rental_company_id = db.Column(db.Integer, db.ForeignKey('rental_company.id'), nullable=False)
+    start_date = db.Column(db.DateTime, nullable=False)
+    end_date = db.Column(db.DateTime, nullable=False)
+    daily_rate = db.Column(db.Float, nullable=False)
+    total_amount = db.Column(db.Float, nullable=False)
+    commission = db.Column(db.Float, nullable=False)
+    handling_fee = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), default='active')  # 'active', 'completed', 'cancelled'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    monitoring_sessions = db.relationship('DriverMonitoring', backref='rental', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_rental_car_status', 'car_id', 'status'),
+        db.Index('ix_rental_company_status', 'rental_company_id', 'status'),
+        db.Index('ix_rental_customer_status', 'customer_id', 'status'),
+        db.Index('ix_rental_status_end', 'status', 'end_date', 'id'),
+    )
+
+class DriverMonitoring(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    rental_id = db.Column(db.Integer, db.ForeignKey('rental.id'), nullable=False)
+    car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
+    driver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    session_start = db.Column(db.DateTime, nullable=False)
+    session_end = db.Column(db.DateTime)
+    total_blinks = db.Column(db.Integer, default=0)
+    drowsiness_alerts = db.Column(db.Integer, default=0)
+    avg_ear = db.Column(db.Float)  # Average Eye Aspect Ratio
+    status = db.Column(db.String(20), default='active')  # 'active', 'completed'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_monitoring_rental_status', 'rental_id', 'status'),
+    )
+
+# Revenue rollups, maintained incrementally by revenue.py whenever a rental
+# enters or leaves the 'completed' state.
+class RevenueTotal(db.Model):
+    scope = db.Column(db.String(20), primary_key=True)  # 'owner', 'company'
+    principal_id = db.Column(db.Integer, primary_key=True)  # User.id for owners, RentalCompany.id for companies
+    completed_rentals = db.Column(db.Integer, nullable=False, default=0)
+    gross_amount = db.Column(db.Float, nullable=False, default=0.0)
+    commission = db.Column(db.Float, nullable=False, default=0.0)
+    handling_fee = db.Column(db.Float, nullable=False, default=0.0)
+
+class RevenueDaily(db.Model):
+    scope = db.Column(db.String(20), primary_key=True)
+    principal_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)  # date of Rental.end_date
+    completed_rentals = db.Column(db.Integer, nullable=False, default=0)
+    gross_amount = db.Column(db.Float, nullable=False, default=0.0)
+    commission = db.Column(db.Float, nullable=False, default=0.0)
+    handling_fee = db.Column(db.Float, nullable=False, default=0.0)
+
+# Driver safety rollups, maintained incrementally by safety.py whenever a
+# monitoring session ends. One row per car, driver and rental company per day
+# (SafetyDaily) and per month (SafetyMonthly) of DriverMonitoring.session_end.
+class SafetyDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    car_id = db.Column(db.Integer, primary_key=True)
+    driver_id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, primary_key=True)  # RentalCompany.id of the session's rental
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    monitored_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    total_blinks = db.Column(db.Integer, nullable=False, default=0)
+    drowsiness_alerts = db.Column(db.Integer, nullable=False, default=0)
+    ear_sum = db.Column(db.Float, nullable=False, default=0.0)  # sum of avg_ear over sessions that have one
+    ear_sessions = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_safety_daily_car', 'car_id', 'day'),
+        db.Index('ix_safety_daily_driver', 'driver_id', 'day'),
+        db.Index('ix_safety_daily_company', 'company_id', 'day'),
+    )
+
+class SafetyMonthly(db.Model):
+    month = db.Column(db.Date, primary_key=True)  # first day of the month
+    car_id = db.Column(db.Integer, primary_key=True)
+    driver_id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, primary_key=True)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+    monitored_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    total_blinks = db.Column(db.Integer, nullable=False, default=0)
+    drowsiness_alerts = db.Column(db.Integer, nullable=False, default=0)
+    ear_sum = db.Column(db.Float, nullable=False, default=0.0)
+    ear_sessions = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_safety_monthly_car', 'car_id', 'month'),
+        db.Index('ix_safety_monthly_driver', 'driver_id', 'month'),
+        db.Index('ix_safety_monthly_company', 'company_id', 'month'),
+    )
+
+# Driver risk scores, replaced wholesale by each run of risk.py
+class DriverRisk(db.Model):
+    driver_id = db.Column(db.Integer, primary_key=True)  # User.id of the customer
+    score = db.Column(db.Float, nullable=False)  # 0 (safest) to 100 (riskiest)
+    alert_rate = db.Column(db.Float, nullable=False)  # drowsiness alerts per monitored hour
+    alert_day_share = db.Column(db.Float, nullable=False)  # share of monitored days with a long eye closure
+    ear_mean = db.Column(db.Float)
+    ear_std = db.Column(db.Float)
+    ear_trend = db.Column(db.Float)  # change in daily mean EAR per 30 days
+    monitored_hours = db.Column(db.Float, nullable=False)
+    sessions = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_driver_risk_score', 'score'),
+    )
+
+# Read-only views over hot and archived rows, created per connection by
+# archive.py. They are not part of db.metadata, so create_all() leaves them alone.
+history_metadata = db.MetaData()
+
+def _history_table(name, source):
+    return db.Table(name, history_metadata, *(
+        db.Column(column.name, column.type, primary_key=column.primary_key) for column in source.columns
+    ))
+
+class RentalHistory(db.Model):
+    __table__ = _history_table('rental_history', Rental.__table__)
+
+    car = db.relationship(Car, primaryjoin='foreign(RentalHistory.car_id) == Car.id', viewonly=True)
+    customer = db.relationship(User, primaryjoin='foreign(RentalHistory.customer_id) == User.id', viewonly=True)
+
+class MonitoringHistory(db.Model):
+    __table__ = _history_table('monitoring_history', DriverMonitoring.__table__)
+
+    car = db.relationship(Car, primaryjoin='foreign(MonitoringHistory.car_id) == Car.id', viewonly=True)
+
+def create_schema():
+    """Create missing tables, and missing indexes on tables that already exist."""
+    db.create_all()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
@@ -1,8 +1,14 @@
 from flask import Blueprint, request, jsonify, Response
 import cv2
 import base64
+import gzip
 import json
+import numpy as np
 from real_time_monitoring import fatigue_detector
+from ear_series import downsample
+from admission import AdmissionRejected, admission_control
+from metrics import metrics
+import frame_hub
 import threading
 import time
 
@@ -12,58 +18,70 @@ monitoring_bp = Blueprint('monitoring', __name__)
 monitoring_sessions = {}
 monitoring_threads = {}
 
+EAR_DEFAULT_POINTS = 1000  # readings per ear_data response unless max_points says otherwise
+EAR_MAX_POINTS = 20000
+COMPRESS_MIN_BYTES = 1024
+
+def produce_frame(session_id):
+    """Process one camera frame for the session's frame hub; None once the session is over."""
+    if session_id not in monitoring_sessions or not monitoring_sessions[session_id]['active']:
+        return None
+    result = fatigue_detector.process_frame()
+    if result is None:
+        return None
+    
+    # Update session data
+    data = {
+        'blink_count': result['blink_count'],
+        'drowsy': result['drowsy'],
+        'ear': result['ear'],
+        'avg_ear': result['avg_ear'],
+        'face_detected': result['face_detected']
+    }
+    monitoring_sessions[session_id]['data'] = data
+    
+    # Encode frame as JPEG
+    ret, buffer = cv2.imencode('.jpg', result['frame'])
+    return (buffer.tobytes() if ret else None), data
+
+def end_session(session_id, session):
+    """Release a session's slot and camera once its frame hub has stopped, however it stopped."""
+    if monitoring_sessions.get(session_id) is session:
+        session['active'] = False
+        del monitoring_sessions[session_id]
+        fatigue_detector.stop_camera()
+    admission_control.sessions.release()
+
 def generate_frames(session_id):
     """Generate video frames for streaming"""
-    global fatigue_detector
+    hub = frame_hub.get(session_id)
+    if hub is None:
+        return
     
-    while session_id in monitoring_sessions and monitoring_sessions[session_id]['active']:
-        try:
-            result = fatigue_detector.process_frame()
-            if result is None:
-                break
-            
-            # Encode frame as JPEG
-            ret, buffer = cv2.imencode('.jpg', result['frame'])
-            if not ret:
-                continue
-            
-            frame_bytes = buffer.tobytes()
-            
-            # Yield frame in MJPEG format
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            
-            # Update session data
-            monitoring_sessions[session_id]['data'] = {
-                'blink_count': result['blink_count'],
-                'drowsy': result['drowsy'],
-                'ear': result['ear'],
-                'avg_ear': result['avg_ear'],
-                'face_detected': result['face_detected']
-            }
-            
-            time.sleep(0.033)  # ~30 FPS
-            
-        except Exception as e:
-            print(f"Error in frame generation: {e}")
-            break
+    for frame_bytes in hub.frames():
+        # Yield frame in MJPEG format
+        yield (b'--frame\r\n'
+               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
 
 @monitoring_bp.route('/api/monitor/start_camera/<int:rental_id>', methods=['POST'])
 def start_camera_monitoring(rental_id):
     """Start real-time camera monitoring"""
+    admission_control.sessions.acquire('Too many monitoring sessions are running, please try again shortly')
+    started = False
     try:
-        # Start camera
-        if not fatigue_detector.start_camera():
-            return jsonify({"error": "Failed to start camera"}), 500
-        
-        # Calibrate system
-        if not fatigue_detector.calibrate_system():
-            fatigue_detector.stop_camera()
-            return jsonify({"error": "Failed to calibrate system"}), 500
+        with admission_control.calibrations.held('Too many cameras are calibrating, please try again in a few seconds'):
+            # Start camera
+            if not fatigue_detector.start_camera():
+                return jsonify({"error": "Failed to start camera"}), 500
+            
+            # Calibrate system
+            if not fatigue_detector.calibrate_system():
+                fatigue_detector.stop_camera()
+                return jsonify({"error": "Failed to calibrate system"}), 500
         
         # Create monitoring session
         session_id = f"session_{rental_id}_{int(time.time())}"
-        monitoring_sessions[session_id] = {
+        session = monitoring_sessions[session_id] = {
             'rental_id': rental_id,
             'active': True,
             'data': {
@@ -75,7 +93,12 @@ def start_camera_monitoring(rental_id):
             }
         }
         
+        fatigue_detector.ear_series.clear()
         fatigue_detector.is_running = True
+        frame_hub.start(session_id, lambda: produce_frame(session_id),
+                        on_stop=lambda: end_session(session_id, session),
+                        idle_timeout=admission_control.session_idle_seconds)
+        started = True
         
         return jsonify({
             "session_id": session_id,
@@ -83,16 +106,20 @@ def start_camera_monitoring(rental_id):
             "message": "Camera monitoring started successfully"
         })
         
+    except AdmissionRejected:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    finally:
+        # Once started, the session's slot is given back by end_session
+        if not started:
+            admission_control.sessions.release()
 
 @monitoring_bp.route('/api/monitor/stop_camera/<session_id>', methods=['POST'])
 def stop_camera_monitoring(session_id):
     """Stop real-time camera monitoring"""
     try:
-        if session_id in monitoring_sessions:
-            monitoring_sessions[session_id]['active'] = False
-            del monitoring_sessions[session_id]
+        frame_hub.stop(session_id)
         
         fatigue_detector.stop_camera()
         fatigue_detector.is_running = False
@@ -111,8 +138,8 @@ def video_feed(session_id):
     if session_id not in monitoring_sessions:
         return "Session not found", 404
     
-    return Response(generate_frames(session_id),
-                   mimetype='multipart/x-mixed-replace; boundary=frame')
+    stream = admission_control.stream(metrics.tracked_stream(generate_frames(session_id), 'monitoring.video_feed'))
+    return Response(stream, mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @monitoring_bp.route('/api/monitor/status/<session_id>')
 def get_monitoring_status(session_id):
@@ -120,6 +147,7 @@ def get_monitoring_status(session_id):
     if session_id not in monitoring_sessions:
         return jsonify({"error": "Session not found"}), 404
     
+    frame_hub.touch(session_id)
     status = fatigue_detector.get_status()
     session_data = monitoring_sessions[session_id]['data']
     
@@ -149,19 +177,49 @@ def reset_monitoring(session_id):
 
 @monitoring_bp.route('/api/monitor/ear_data/<session_id>')
 def get_ear_data(session_id):
-    """Get EAR history data for graphing"""
+    """Get EAR history data for graphing
+    
+    Optional query parameters: from/to (seconds since the session's first
+    reading), since (only readings after this sequence number, for
+    incremental updates) and max_points (min/max downsampling budget).
+    """
     if session_id not in monitoring_sessions:
         return jsonify({"error": "Session not found"}), 404
     
-    ear_history = fatigue_detector.get_ear_history()
-    ear_stats = fatigue_detector.get_ear_statistics()
+    frame_hub.touch(session_id)
+    since = request.args.get('since', type=int)
+    start = request.args.get('from', type=float)
+    end = request.args.get('to', type=float)
+    max_points = request.args.get('max_points', EAR_DEFAULT_POINTS, type=int)
+    if not 2 <= max_points <= EAR_MAX_POINTS:
+        return jsonify({"error": f"max_points must be between 2 and {EAR_MAX_POINTS}"}), 400
     
-    return jsonify({
-        "ear_history": ear_history,
-        "statistics": ear_stats,
-        "data_points": len(ear_history)
+    series = fatigue_detector.ear_series
+    first_seq, t, ear = series.window(since, start, end)
+    keep = downsample(ear, max_points)
+    
+    return _compressible_json({
+        "ear_history": np.round(ear[keep].astype(np.float64), 4).tolist(),
+        "t": np.round(t[keep], 3).tolist(),
+        "seq": (first_seq + keep).tolist(),
+        "statistics": series.statistics(),
+        "data_points": len(keep),
+        "total_points": len(ear),
+        "downsampled": len(keep) < len(ear),
+        "last_seq": series.last_seq,
+        "started_at": series.started_at
     })
 
+def _compressible_json(payload):
+    """JSON response, gzipped when it is large and the client accepts gzip."""
+    body = json.dumps(payload, separators=(',', ':')).encode()
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if len(body) >= COMPRESS_MIN_BYTES and 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @monitoring_bp.route('/api/monitor/alarm/stop', methods=['POST'])
 def stop_alarm():
     """Stop the drowsiness alarm"""
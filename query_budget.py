@@ -0,0 +1,71 @@
+"""
+SQL query counting and per-view query budgets.
+
+Views decorated with @query_budget(n) log a warning when rendering them
+takes more than n SQL statements. The check only runs when the app is in
+debug or testing mode (or CHECK_QUERY_BUDGETS is set), so a template that
+starts walking a lazy relationship per row shows up in the development log
+instead of as an N+1 in production. It never fails the request; the tests
+in tests/test_query_counts.py assert the statement counts.
+"""
+
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_local, 'counters', ()):
+        counter.count += 1
+        counter.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """Count SQL statements executed by this thread inside the block."""
+    counter = QueryCounter()
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _local.counters = []
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def budgets_checked():
+    config = current_app.config
+    return bool(config.get('CHECK_QUERY_BUDGETS', current_app.debug or current_app.testing))
+
+
+def query_budget(max_queries):
+    """Log a warning if the view issues more than max_queries statements."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not budgets_checked():
+                return f(*args, **kwargs)
+            with count_queries() as counter:
+                result = f(*args, **kwargs)
+            if counter.count > max_queries:
+                current_app.logger.warning(
+                    '%s issued %d queries (budget %d):\n%s',
+                    f.__name__, counter.count, max_queries, '\n'.join(counter.statements)
+                )
+            return result
+        return decorated_function
+    return decorator
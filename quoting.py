@@ -0,0 +1,154 @@
+"""
+Rental pricing and bulk quotes.
+
+price() is the single pricing rule used by booking. quote_batch() applies the
+same rule to many cars x many periods at once: daily rates are loaded in one
+query, company fees come from a cached fee table, and every amount is
+computed with NumPy array operations.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import event
+
+from models import Car, RentalCompany
+import availability
+
+FEE_TABLE_TTL = 60  # seconds
+MAX_QUOTE_CARS = 1000
+MAX_QUOTE_PERIODS = 20
+
+
+class QuoteError(ValueError):
+    pass
+
+
+def price(daily_rate, days, commission_rate, handling_fee):
+    """(total_amount, commission, handling_fee) for one rental."""
+    total_amount = daily_rate * days
+    return total_amount, total_amount * commission_rate, handling_fee
+
+
+class FeeTable:
+    """Commission rates and handling fees of every rental company."""
+
+    def __init__(self, companies):
+        self.company_ids = np.array([company.id for company in companies], dtype=np.int64)
+        self.commission_rates = np.array([company.commission_rate for company in companies], dtype=np.float64)
+        self.handling_fees = np.array([company.handling_fee for company in companies], dtype=np.float64)
+        # Simplified - matches booking, which assigns every rental to the first company
+        self.default_company_id = companies[0].id if companies else None
+        self.expires_at = time.monotonic() + FEE_TABLE_TTL
+
+    def lookup(self, company_ids):
+        """Commission rates and handling fees for an array of company ids."""
+        order = np.argsort(self.company_ids)
+        positions = order[np.searchsorted(self.company_ids, company_ids, sorter=order)]
+        return self.commission_rates[positions], self.handling_fees[positions]
+
+
+_fee_table = None
+_fee_table_lock = threading.Lock()
+
+
+def fee_table():
+    global _fee_table
+    table = _fee_table
+    if table is None or table.expires_at <= time.monotonic():
+        with _fee_table_lock:
+            table = _fee_table = FeeTable(RentalCompany.query.order_by(RentalCompany.id).all())
+    return table
+
+
+def invalidate_fee_table():
+    global _fee_table
+    _fee_table = None
+
+
+@event.listens_for(RentalCompany, 'after_insert')
+@event.listens_for(RentalCompany, 'after_update')
+@event.listens_for(RentalCompany, 'after_delete')
+def _company_changed(mapper, connection, target):
+    invalidate_fee_table()
+
+
+def parse_periods(periods):
+    """[(start, end)] datetimes from [{'start_date': ..., 'end_date': ...}] request data."""
+    parsed = []
+    for period in periods:
+        try:
+            start = datetime.strptime(period['start_date'], '%Y-%m-%d')
+            end = datetime.strptime(period['end_date'], '%Y-%m-%d')
+        except (KeyError, TypeError, ValueError):
+            raise QuoteError('each period needs start_date and end_date as YYYY-MM-DD')
+        if end <= start:
+            raise QuoteError('end_date must be after start_date')
+        parsed.append((start, end))
+    return parsed
+
+
+def quote_batch(car_ids, periods, check_availability=True):
+    """Quote every car for every (start, end) period.
+
+    Returns a list of dicts, one per (car, period), cars in the order given.
+    Unknown car ids are skipped.
+    """
+    if not car_ids or not periods:
+        return []
+    if len(car_ids) > MAX_QUOTE_CARS or len(periods) > MAX_QUOTE_PERIODS:
+        raise QuoteError(f'at most {MAX_QUOTE_CARS} cars and {MAX_QUOTE_PERIODS} periods per request')
+
+    fees = fee_table()
+    if fees.default_company_id is None:
+        raise QuoteError('No rental company available')
+
+    rows = {row.id: row for row in Car.query.filter(Car.id.in_(set(car_ids)))
+            .with_entities(Car.id, Car.daily_rate, Car.status).all()}
+    cars = [rows[car_id] for car_id in dict.fromkeys(car_ids) if car_id in rows]
+    if not cars:
+        return []
+
+    daily_rates = np.array([car.daily_rate for car in cars], dtype=np.float64)
+    company_ids = np.full(len(cars), fees.default_company_id, dtype=np.int64)
+    commission_rates, handling_fees = fees.lookup(company_ids)
+    days = np.array([(end - start).days for start, end in periods], dtype=np.float64)
+
+    # cars x periods
+    totals = daily_rates[:, None] * days[None, :]
+    commissions = totals * commission_rates[:, None]
+    handling = np.broadcast_to(handling_fees[:, None], totals.shape)
+    owner_income = totals - commissions - handling
+
+    if check_availability:
+        availability.refresh()
+        index = availability.availability_index
+
+    # Convert once to Python values; per-element float() calls would dominate
+    period_dates = [(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')) for start, end in periods]
+    period_days = days.astype(np.int64).tolist()
+    totals, commissions = totals.tolist(), commissions.tolist()
+    handling, owner_income = handling.tolist(), owner_income.tolist()
+    company_ids = company_ids.tolist()
+
+    quotes = []
+    for i, car in enumerate(cars):
+        for j, (start, end) in enumerate(periods):
+            quote = {
+                'car_id': car.id,
+                'start_date': period_dates[j][0],
+                'end_date': period_dates[j][1],
+                'days': period_days[j],
+                'daily_rate': car.daily_rate,
+                'total_amount': totals[i][j],
+                'commission': commissions[i][j],
+                'handling_fee': handling[i][j],
+                'owner_income': owner_income[i][j],
+                'rental_company_id': company_ids[i]
+            }
+            if check_availability:
+                quote['available'] = car.status != 'maintenance' and index.is_free(car.id, start, end)
+            quotes.append(quote)
+    return quotes
@@ -10,6 +10,8 @@ import base64
 import pygame
 import os
 
+from ear_series import EarSeries
+
 class RealTimeFatigueDetector:
     def __init__(self):
         self.FACE_DOWNSAMPLE_RATIO = 0.45
@@ -38,6 +40,19 @@ class RealTimeFatigueDetector:
         self.drowsyLimit = 0
         self.falseBlinkLimit = 0
         self.calibrated = False
+        self.lastFrameTime = None
+        
+        # Change gating: while the eyes look as they did when landmarks were
+        # last found, reuse those landmarks instead of detecting again
+        self.motionThreshold = 4.0  # mean grey-level change of an eye patch that counts as movement
+        self.earMargin = 0.03  # always detect when the last EAR was this close to thresh
+        self.refreshFrames = 10  # detect at least every this many frames
+        self.eyePatchSize = (24, 12)
+        self.eyeBoxes = None
+        self.eyeReference = None
+        self.framesSinceDetection = 0
+        self.detectedFrames = 0
+        self.reusedFrames = 0
         
         # Real-time processing
         self.cap = None
@@ -46,6 +61,7 @@ class RealTimeFatigueDetector:
         self.landmarks = None
         self.ear_history = []
         self.max_ear_history = 50
+        self.ear_series = EarSeries()  # every reading of the trip, for the charts
         
         # Alarm system
         self.alarm_playing = False
@@ -260,11 +276,20 @@ class RealTimeFatigueDetector:
                         fy = 1/IMAGE_RESIZE, 
                         interpolation = cv2.INTER_LINEAR)
 
-        # Preprocess frame
-        adjusted = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        self.track_frame_rate()
         
-        # Get landmarks
-        landmarks = self.get_landmarks(adjusted)
+        if self.eyes_unchanged(frame):
+            landmarks = self.landmarks
+            self.framesSinceDetection += 1
+            self.reusedFrames += 1
+        else:
+            # Preprocess frame
+            adjusted = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            
+            # Get landmarks
+            landmarks = self.get_landmarks(adjusted)
+            self.remember_eyes(frame, landmarks)
+            self.detectedFrames += 1
         self.landmarks = landmarks
         
         if landmarks is not None:
@@ -276,6 +301,7 @@ class RealTimeFatigueDetector:
             self.ear_history.append(ear)
             if len(self.ear_history) > self.max_ear_history:
                 self.ear_history.pop(0)
+            self.ear_series.append(ear)
             
             # Draw landmarks on frame
             self.draw_landmarks(frame, landmarks)
@@ -300,6 +326,63 @@ class RealTimeFatigueDetector:
                 "face_detected": False
             }
 
+    def track_frame_rate(self):
+        """Keep the blink and drowsiness limits, counted in frames, matched to the actual frame rate"""
+        now = time.time()
+        if self.calibrated and self.lastFrameTime is not None:
+            interval = now - self.lastFrameTime
+            # Skipped detections make frames cheaper; pauses (start-up, a stalled camera) don't count
+            if 0 < interval < 1.0:
+                self.spf = 0.9 * self.spf + 0.1 * interval
+                self.drowsyLimit = self.drowsyTime/self.spf
+                self.falseBlinkLimit = self.blinkTime/self.spf
+        self.lastFrameTime = now
+
+    def eye_patches(self, frame):
+        """Small greyscale copies of the two eye regions found at the last detection"""
+        patches = []
+        for x0, y0, x1, y1 in self.eyeBoxes:
+            eye = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            patches.append(cv2.resize(eye, self.eyePatchSize, interpolation = cv2.INTER_AREA).astype(np.float32))
+        return patches
+
+    def remember_eyes(self, frame, landmarks):
+        """Store where the eyes are and what they look like, for eyes_unchanged()"""
+        self.framesSinceDetection = 0
+        self.eyeBoxes = None
+        self.eyeReference = None
+        if landmarks is None:
+            return
+        height, width = frame.shape[:2]
+        boxes = []
+        for index in (self.leftEyeIndex, self.rightEyeIndex):
+            xs = [landmarks[i][0] for i in index]
+            ys = [landmarks[i][1] for i in index]
+            # Pad the eye's bounding box so the lids' full travel stays inside it
+            padX = max((max(xs) - min(xs)) // 4, 2)
+            padY = max(max(xs) - min(xs), max(ys) - min(ys)) // 2
+            box = (max(min(xs) - padX, 0), max(min(ys) - padY, 0),
+                   min(max(xs) + padX, width), min(max(ys) + padY, height))
+            if box[2] - box[0] < 4 or box[3] - box[1] < 4:
+                return
+            boxes.append(box)
+        self.eyeBoxes = boxes
+        self.eyeReference = self.eye_patches(frame)
+
+    def eyes_unchanged(self, frame):
+        """Whether the last landmarks can be reused for this frame"""
+        if self.eyeReference is None or self.framesSinceDetection >= self.refreshFrames - 1:
+            return False
+        # Near the threshold a small lid movement decides open or closed, so always look
+        if not self.ear_history or abs(self.ear_history[-1] - self.thresh) < self.earMargin:
+            return False
+        for patch, reference in zip(self.eye_patches(frame), self.eyeReference):
+            change = patch - reference
+            # Ignore uniform brightness shifts (auto exposure), count local change only
+            if np.mean(np.abs(change - change.mean())) >= self.motionThreshold:
+                return False
+        return True
+
     def draw_landmarks(self, frame, landmarks):
         """Draw facial landmarks on frame"""
         if landmarks is None:
@@ -329,7 +412,9 @@ class RealTimeFatigueDetector:
             "avg_ear": np.mean(self.ear_history) if self.ear_history else 0.0,
             "face_detected": self.landmarks is not None,
             "calibrated": self.calibrated,
-            "is_running": self.is_running
+            "is_running": self.is_running,
+            "frames_detected": self.detectedFrames,
+            "frames_reused": self.reusedFrames
         }
 
     def reset_counters(self):
@@ -338,6 +423,8 @@ class RealTimeFatigueDetector:
         self.drowsy = 0
         self.state = 0
         self.ear_history = []
+        self.ear_series.clear()
+        self.remember_eyes(None, None)
         self.stop_alarm()
 
     def get_ear_history(self):
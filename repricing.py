@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Bulk repricing of rentals after a company changes its commission rate or
+handling fee.
+
+Rentals are selected by company and status and rewritten with set-based
+UPDATE statements, batch_size rows per transaction, walking the rental ids in
+order. Each batch commits on its own, so bookings keep going between batches
+instead of waiting on one long write lock. Each batch takes the write lock
+first (BEGIN IMMEDIATE on SQLite, row locks elsewhere), like the lifecycle
+job, and the revenue rollups are adjusted in the same transaction only for
+the rows the repricing UPDATE changed while they were completed, so a
+rental completed by a concurrent lifecycle run is counted exactly once.
+
+total_amount depends only on the daily rate and duration, so it is left as is;
+commission and handling_fee are recomputed with the same rule as quoting.price().
+Running apps pick up new revenue figures when their stats cache entries expire.
+
+    python repricing.py --company-id 1 --commission-rate 0.12 --handling-fee 40
+"""
+
+import argparse
+import time
+from collections import defaultdict
+from datetime import date
+
+from sqlalchemy import func, select
+
+from models import db, Car, Rental, RentalCompany
+import lifecycle
+import revenue
+
+BATCH_SIZE = 500
+
+
+def reprice_rentals(company_id, commission_rate, handling_fee, statuses=('active',),
+                    batch_size=BATCH_SIZE, pause=0.0, progress=None):
+    """Recompute commission and handling_fee of a company's rentals in the given statuses.
+
+    progress, if given, is called after every batch with a dict of
+    processed/total/batches. Returns the number of rentals repriced.
+    """
+    rental = Rental.__table__
+    in_scope = (rental.c.rental_company_id == company_id, rental.c.status.in_(statuses))
+    total = db.session.execute(select(func.count()).where(*in_scope)).scalar()
+    processed = batches = 0
+    last_id = 0
+
+    while True:
+        # The batch is read and rewritten under the write lock, so the
+        # lifecycle job cannot complete one of its rentals in between
+        lifecycle._begin_write()
+        rows = db.session.execute(
+            select(rental.c.id, rental.c.status, rental.c.rental_company_id, Car.owner_id,
+                   func.date(rental.c.end_date), rental.c.total_amount, rental.c.commission, rental.c.handling_fee)
+            .join(Car, Car.id == rental.c.car_id)
+            .where(*in_scope, rental.c.id > last_id)
+            .order_by(rental.c.id)
+            .limit(batch_size)
+            .with_for_update(of=rental)
+        ).all()
+        if not rows:
+            db.session.commit()  # gives up the write lock
+            break
+        last_id = rows[-1].id
+
+        claimed = _claim(rows, statuses, commission_rate, handling_fee)
+        if 'completed' in statuses:
+            _adjust_rollups([row for row in rows if claimed.get(row.id) == 'completed'],
+                            commission_rate, handling_fee)
+        db.session.commit()
+
+        processed += len(claimed)
+        batches += 1
+        if progress:
+            progress({'processed': processed, 'total': total, 'batches': batches})
+        if pause:
+            time.sleep(pause)
+
+    # Rows already loaded in the session still hold the old amounts
+    db.session.expire_all()
+    return processed
+
+
+def _claim(rows, statuses, commission_rate, handling_fee):
+    """Reprice the rentals among rows still in statuses; return {id: status} of the rows this changed."""
+    rental = Rental.__table__
+    claim = rental.update().where(rental.c.id.in_([row.id for row in rows]), rental.c.status.in_(statuses)) \
+        .values(commission=rental.c.total_amount * commission_rate, handling_fee=handling_fee)
+    if db.engine.dialect.update_returning:
+        return dict(db.session.execute(claim.returning(rental.c.id, rental.c.status)).all())
+    # The rows are locked, so every one of them still has the status it was read with
+    db.session.execute(claim)
+    return {row.id: row.status for row in rows}
+
+
+def _adjust_rollups(rows, commission_rate, handling_fee):
+    """Apply the revenue change of repricing the completed rentals in rows, read before the claim."""
+    deltas = defaultdict(lambda: [0.0, 0.0])
+    for rental_id, status, company, owner, rental_day, total_amount, commission, old_handling_fee in rows:
+        for key in (('owner', owner, rental_day), ('company', company, rental_day)):
+            deltas[key][0] += total_amount * commission_rate - commission
+            deltas[key][1] += handling_fee - old_handling_fee
+
+    connection = db.session.connection()
+    for (scope, principal_id, rental_day), (commission_delta, handling_delta) in deltas.items():
+        revenue.apply_revenue_delta(connection, scope, principal_id, _as_date(rental_day),
+                                    (0, 0.0, commission_delta, handling_delta))
+
+
+def _as_date(value):
+    # SQLite returns date() as text
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def update_company_fees(company_id, commission_rate=None, handling_fee=None, statuses=('active',), **kwargs):
+    """Change a company's fees, then reprice its rentals in the given statuses."""
+    company = RentalCompany.query.get(company_id)
+    if company is None:
+        raise ValueError(f'No rental company with id {company_id}')
+    if commission_rate is not None:
+        company.commission_rate = commission_rate
+    if handling_fee is not None:
+        company.handling_fee = handling_fee
+    commission_rate, handling_fee = company.commission_rate, company.handling_fee
+    db.session.commit()
+    return reprice_rentals(company_id, commission_rate, handling_fee, statuses, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply new company fees to existing rentals.')
+    parser.add_argument('--company-id', type=int, required=True)
+    parser.add_argument('--commission-rate', type=float, help='new commission rate, e.g. 0.12')
+    parser.add_argument('--handling-fee', type=float, help='new handling fee')
+    parser.add_argument('--status', action='append', dest='statuses',
+                        help="rental status to reprice (repeatable, default: active)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.0, help='seconds to sleep between batches')
+    args = parser.parse_args()
+
+    from app_simple import app
+
+    def report(state):
+        print(f"\r  {state['processed']}/{state['total']} rentals repriced ({state['batches']} batches)", end='')
+
+    with app.app_context():
+        print("💲 Repricing rentals...")
+        count = update_company_fees(args.company_id, args.commission_rate, args.handling_fee,
+                                    tuple(args.statuses or ('active',)),
+                                    batch_size=args.batch_size, pause=args.pause, progress=report)
+        print(f"\n✓ Repriced {count} rentals")
+
+
+if __name__ == "__main__":
+    main()
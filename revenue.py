@@ -0,0 +1,155 @@
+"""
+Revenue aggregates for the owner and company dashboards.
+
+Completed rentals are rolled up per owner and per rental company, both as a
+running total (RevenueTotal) and per day of Rental.end_date (RevenueDaily).
+The rollups are kept current by mapper events on Rental, so dashboards read a
+single row no matter how much rental history a principal has. Code that
+changes rentals with bulk SQL (bypassing the ORM) must call
+apply_revenue_delta() itself, or rebuild_rollups() afterwards. Archiving
+rentals (archive.py) leaves the rollups as they are; rebuilds read the
+archive too.
+"""
+
+from sqlalchemy import and_, event, func, inspect, literal, select
+
+from models import db, Car, Rental, RentalHistory, RevenueTotal, RevenueDaily
+
+MEASURES = ('completed_rentals', 'gross_amount', 'commission', 'handling_fee')
+
+
+def owner_income(owner_id):
+    """Income earned by a car owner from completed rentals."""
+    row = db.session.get(RevenueTotal, ('owner', owner_id))
+    if row is None:
+        return 0.0
+    return row.gross_amount - row.commission - row.handling_fee
+
+
+def company_revenue(company_id):
+    """Commission plus handling fees earned by a rental company."""
+    row = db.session.get(RevenueTotal, ('company', company_id))
+    if row is None:
+        return 0.0
+    return row.commission + row.handling_fee
+
+
+def owner_income_sql(owner_id):
+    """Same as owner_income(), computed from hot and archived rentals with SUM."""
+    rental = RentalHistory
+    total = db.session.query(
+        func.coalesce(func.sum(rental.total_amount - rental.commission - rental.handling_fee), 0.0)
+    ).join(Car, Car.id == rental.car_id).filter(Car.owner_id == owner_id, rental.status == 'completed').scalar()
+    return float(total)
+
+
+def company_revenue_sql(company_id):
+    """Same as company_revenue(), computed from hot and archived rentals with SUM."""
+    rental = RentalHistory
+    total = db.session.query(
+        func.coalesce(func.sum(rental.commission + rental.handling_fee), 0.0)
+    ).filter(rental.rental_company_id == company_id, rental.status == 'completed').scalar()
+    return float(total)
+
+
+def apply_revenue_delta(connection, scope, principal_id, day, delta):
+    """Add delta, a tuple ordered like MEASURES, to a principal's total and daily rows."""
+    targets = (
+        (RevenueTotal.__table__, {'scope': scope, 'principal_id': principal_id}),
+        (RevenueDaily.__table__, {'scope': scope, 'principal_id': principal_id, 'day': day}),
+    )
+    for table, keys in targets:
+        where = and_(*(table.c[key] == value for key, value in keys.items()))
+        increments = {name: table.c[name] + value for name, value in zip(MEASURES, delta)}
+        result = connection.execute(table.update().where(where).values(**increments))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**keys, **dict(zip(MEASURES, delta))))
+
+
+def rebuild_rollups():
+    """Recompute every rollup row from hot and archived rentals."""
+    revenue_columns = (
+        func.count(RentalHistory.id),
+        func.sum(RentalHistory.total_amount),
+        func.sum(RentalHistory.commission),
+        func.sum(RentalHistory.handling_fee),
+    )
+    day = func.date(RentalHistory.end_date)
+    completed = RentalHistory.status == 'completed'
+
+    owner_daily = select(literal('owner'), Car.owner_id, day, *revenue_columns) \
+        .join(Car, Car.id == RentalHistory.car_id).where(completed).group_by(Car.owner_id, day)
+    company_daily = select(literal('company'), RentalHistory.rental_company_id, day, *revenue_columns) \
+        .where(completed).group_by(RentalHistory.rental_company_id, day)
+    owner_total = select(literal('owner'), Car.owner_id, *revenue_columns) \
+        .join(Car, Car.id == RentalHistory.car_id).where(completed).group_by(Car.owner_id)
+    company_total = select(literal('company'), RentalHistory.rental_company_id, *revenue_columns) \
+        .where(completed).group_by(RentalHistory.rental_company_id)
+
+    daily_table = RevenueDaily.__table__
+    total_table = RevenueTotal.__table__
+    db.session.execute(daily_table.delete())
+    db.session.execute(total_table.delete())
+    for query in (owner_daily, company_daily):
+        db.session.execute(daily_table.insert().from_select(
+            ['scope', 'principal_id', 'day', *MEASURES], query))
+    for query in (owner_total, company_total):
+        db.session.execute(total_table.insert().from_select(
+            ['scope', 'principal_id', *MEASURES], query))
+    db.session.commit()
+
+
+def _owner_of(connection, car_id):
+    return connection.execute(select(Car.owner_id).where(Car.id == car_id)).scalar()
+
+
+def _contributions(connection, values):
+    """Rollup rows a rental with these column values counts towards."""
+    if values['status'] != 'completed':
+        return []
+    delta = (1, values['total_amount'], values['commission'], values['handling_fee'])
+    day = values['end_date'].date()
+    return [
+        ('owner', _owner_of(connection, values['car_id']), day, delta),
+        ('company', values['rental_company_id'], day, delta),
+    ]
+
+
+def _current_values(target):
+    return {name: getattr(target, name) for name in
+            ('status', 'car_id', 'rental_company_id', 'end_date', 'total_amount', 'commission', 'handling_fee')}
+
+
+def _previous_values(target):
+    state = inspect(target)
+    values = _current_values(target)
+    for name in values:
+        history = state.attrs[name].history
+        if history.deleted:
+            values[name] = history.deleted[0]
+    return values
+
+
+def _apply(connection, contributions, sign):
+    for scope, principal_id, day, delta in contributions:
+        apply_revenue_delta(connection, scope, principal_id, day, tuple(sign * value for value in delta))
+
+
+@event.listens_for(Rental, 'after_insert')
+def _rental_inserted(mapper, connection, target):
+    _apply(connection, _contributions(connection, _current_values(target)), 1)
+
+
+@event.listens_for(Rental, 'after_update')
+def _rental_updated(mapper, connection, target):
+    previous = _previous_values(target)
+    current = _current_values(target)
+    if previous == current:
+        return
+    _apply(connection, _contributions(connection, previous), -1)
+    _apply(connection, _contributions(connection, current), 1)
+
+
+@event.listens_for(Rental, 'after_delete')
+def _rental_deleted(mapper, connection, target):
+    _apply(connection, _contributions(connection, _previous_values(target)), -1)
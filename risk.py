@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Nightly driver risk scores.
+
+Every customer with monitored driving in the last WINDOW_DAYS gets a score
+from 0 (safest) to 100 (riskiest), built from five features of their
+per-day safety rollups (SafetyDaily, see safety.py):
+
+    alert rate        drowsiness alerts per monitored hour
+    alert days        share of monitored days with at least one alert, i.e. a
+                      long eye closure (eyes shut for the detector's drowsyTime)
+    EAR level         mean eye aspect ratio; lower is sleepier
+    EAR spread        standard deviation of the daily mean EAR
+    EAR trend         slope of the daily mean EAR; falling is worse
+
+Each feature becomes the driver's percentile among all scored drivers, the
+percentiles are combined with WEIGHTS, and the result is pulled towards the
+middle for drivers with little monitored time (CONFIDENCE_HOURS).
+
+The whole window is read with one query into NumPy columns, the features of
+all drivers are computed at once with np.bincount, and driver_risk is
+replaced in a single transaction, so readers see either the previous run's
+scores or the new ones. Run it nightly from cron:
+
+    python risk.py
+    python risk.py --window-days 90
+"""
+
+import argparse
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+from analytics import day_number, fetch_columns
+from models import db, DriverRisk, SafetyDaily
+
+WINDOW_DAYS = 180
+EPOCH = date(1970, 1, 1)
+CONFIDENCE_HOURS = 5.0  # monitored hours at which a driver's own features count half
+WRITE_CHUNK = 50000
+WEIGHTS = {
+    'alert_rate': 0.35,
+    'alert_day_share': 0.2,
+    'ear_mean': 0.2,
+    'ear_std': 0.1,
+    'ear_trend': 0.15,
+}
+
+
+def load_window(start):
+    """Rollup columns from start on, one row per driver and day across the cars and companies they drove for."""
+    daily = SafetyDaily
+    query = select(
+        daily.driver_id, day_number(daily.day), func.sum(daily.sessions), func.sum(daily.monitored_seconds),
+        func.sum(daily.drowsiness_alerts), func.sum(daily.ear_sum), func.sum(daily.ear_sessions),
+    ).where(daily.day >= start).group_by(daily.driver_id, daily.day)
+    with db.engine.connect() as connection:
+        return fetch_columns(connection, query, 7)
+
+
+def features(driver, day, sessions, seconds, alerts, ear_sum, ear_sessions, first_day=0):
+    """Per-driver feature arrays from load_window() columns, one entry per distinct driver.
+
+    day and first_day are days since 1970-01-01; the EAR trend is fitted
+    against days since first_day, the start of the window.
+    """
+    drivers, index = np.unique(driver.astype(np.int64), return_inverse=True)
+    count = len(drivers)
+
+    def total(values):
+        return np.bincount(index, weights=values, minlength=count)
+
+    hours = total(seconds) / 3600
+    monitored_days = np.bincount(index, minlength=count)
+    alert_total = total(alerts)
+
+    # EAR: daily means weighted by the sessions that reported one
+    w = ear_sessions
+    y = np.divide(ear_sum, w, out=np.zeros_like(ear_sum), where=w > 0)
+    x = day - first_day
+    sw, sx, sy = total(w), total(w * x), total(w * y)
+    sxx, sxy, syy = total(w * x * x), total(w * x * y), total(w * y * y)
+    has_ear = sw > 0
+    ear_mean = np.divide(sy, sw, out=np.full(count, np.nan), where=has_ear)
+    variance = np.divide(syy, sw, out=np.zeros(count), where=has_ear) - np.nan_to_num(ear_mean) ** 2
+    ear_std = np.where(has_ear, np.sqrt(np.maximum(variance, 0)), np.nan)
+    spread = sw * sxx - sx * sx
+    ear_trend = np.divide(sw * sxy - sx * sy, spread, out=np.zeros(count), where=spread > 1e-9) * 30
+    ear_trend[~has_ear] = np.nan
+
+    return {
+        'driver_id': drivers,
+        'sessions': total(sessions).astype(np.int64),
+        'monitored_hours': hours,
+        'alert_rate': np.divide(alert_total, hours, out=np.zeros(count), where=hours > 0),
+        'alert_day_share': total((alerts > 0).astype(np.float64)) / monitored_days,
+        'ear_mean': ear_mean,
+        'ear_std': ear_std,
+        'ear_trend': ear_trend,
+    }
+
+
+def _percentile(values, higher_is_riskier=True):
+    """Share of drivers with a lower-risk value, in [0, 1); missing values are neutral (0.5)."""
+    known = ~np.isnan(values)
+    ordered = np.sort(values[known])
+    result = np.full(len(values), 0.5)
+    if len(ordered):
+        if higher_is_riskier:
+            result[known] = np.searchsorted(ordered, values[known], side='left') / len(ordered)
+        else:
+            result[known] = (len(ordered) - np.searchsorted(ordered, values[known], side='right')) / len(ordered)
+    return result
+
+
+def scores(feature):
+    """Risk score 0-100 per driver from the features() arrays."""
+    raw = (WEIGHTS['alert_rate'] * _percentile(feature['alert_rate'])
+           + WEIGHTS['alert_day_share'] * _percentile(feature['alert_day_share'])
+           + WEIGHTS['ear_mean'] * _percentile(feature['ear_mean'], higher_is_riskier=False)
+           + WEIGHTS['ear_std'] * _percentile(feature['ear_std'])
+           + WEIGHTS['ear_trend'] * _percentile(feature['ear_trend'], higher_is_riskier=False))
+    hours = feature['monitored_hours']
+    confidence = hours / (hours + CONFIDENCE_HOURS)
+    return 100 * (0.5 + confidence * (raw / sum(WEIGHTS.values()) - 0.5))
+
+
+def _nullable(values, digits):
+    return [None if np.isnan(value) else value for value in np.round(values, digits).tolist()]
+
+
+def write_scores(feature, score, computed_at):
+    """Replace every row of driver_risk in one transaction."""
+    columns = {
+        'driver_id': feature['driver_id'].tolist(),
+        'score': np.round(score, 2).tolist(),
+        'alert_rate': np.round(feature['alert_rate'], 4).tolist(),
+        'alert_day_share': np.round(feature['alert_day_share'], 4).tolist(),
+        'ear_mean': _nullable(feature['ear_mean'], 4),
+        'ear_std': _nullable(feature['ear_std'], 4),
+        'ear_trend': _nullable(feature['ear_trend'], 5),
+        'monitored_hours': np.round(feature['monitored_hours'], 2).tolist(),
+        'sessions': feature['sessions'].tolist(),
+    }
+    names = list(columns)
+    table = DriverRisk.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.delete())
+        for first in range(0, len(columns['driver_id']), WRITE_CHUNK):
+            rows = zip(*(columns[name][first:first + WRITE_CHUNK] for name in names))
+            connection.execute(table.insert(), [dict(zip(names, row), computed_at=computed_at) for row in rows])
+
+
+def score_drivers(window_days=WINDOW_DAYS, today=None, progress=None):
+    """Recompute every driver's risk score from the last window_days of rollups; return how many were scored.
+
+    progress, if given, is called with a message after each stage.
+    """
+    today = today or date.today()
+    started = time.perf_counter()
+
+    def report(stage):
+        if progress:
+            progress(f'{stage} ({time.perf_counter() - started:.1f}s)')
+
+    start = today - timedelta(days=window_days - 1)
+    columns = load_window(start)
+    report(f'loaded {len(columns[0])} driver-days')
+    feature = features(*columns, first_day=(start - EPOCH).days)
+    score = scores(feature)
+    report(f"scored {len(score)} drivers")
+    write_scores(feature, score, datetime.utcnow())
+    report('saved')
+    return len(score)
+
+
+def score_of(driver_id):
+    """The driver's latest risk score, or None if they have not been scored."""
+    return db.session.execute(select(DriverRisk.score).where(DriverRisk.driver_id == driver_id)).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute driver risk scores from monitoring history.')
+    parser.add_argument('--window-days', type=int, default=WINDOW_DAYS)
+    args = parser.parse_args()
+
+    from app_simple import app
+
+    with app.app_context():
+        print(f"🛡️  Scoring drivers on the last {args.window_days} days of monitoring")
+        count = score_drivers(args.window_days, progress=lambda message: print(f'  {message}'))
+        print(f"✓ Scored {count} drivers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Driver safety rollups for owners, companies and admins.
+
+Ended monitoring sessions are rolled up per car, driver and rental company,
+per day (SafetyDaily) and per month (SafetyMonthly) of session_end: session
+count, monitored time, blinks, drowsiness alerts and the sum of avg_ear. The
+rollups are kept current by mapper events on DriverMonitoring, and by
+lifecycle.py, which closes sessions with bulk SQL and calls
+add_ending_sessions() itself. Like the revenue rollups, they keep counting
+sessions that archive.py moves out of the hot table; rebuilds read the
+archive too.
+
+ranking() answers "which cars / drivers had the most alerts per hour driven
+between start and end" from the rollups alone: whole months inside the window
+come from SafetyMonthly and the partial months at either end from SafetyDaily,
+so a window costs at most about two months of daily rows plus one row per
+month, however many sessions it covers.
+"""
+
+from datetime import date, timedelta
+
+from sqlalchemy import Date, and_, cast, event, func, inspect, select, union_all
+
+from models import db, Car, DriverMonitoring, DriverRisk, MonitoringHistory, Rental, RentalHistory, SafetyDaily, \
+    SafetyMonthly, User
+
+MEASURES = ('sessions', 'monitored_seconds', 'total_blinks', 'drowsiness_alerts', 'ear_sum', 'ear_sessions')
+KEYS = ('car_id', 'driver_id', 'company_id')
+RANK_BY = ('car', 'driver')
+MAX_LIMIT = 200
+
+
+class SafetyError(ValueError):
+    pass
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def apply_safety_delta(connection, day, keys, delta):
+    """Add delta, a tuple ordered like MEASURES, to the daily and monthly rows of keys (car, driver, company)."""
+    key_values = dict(zip(KEYS, keys))
+    targets = (
+        (SafetyDaily.__table__, dict(key_values, day=day)),
+        (SafetyMonthly.__table__, dict(key_values, month=month_start(day))),
+    )
+    for table, row_keys in targets:
+        where = and_(*(table.c[key] == value for key, value in row_keys.items()))
+        increments = {name: table.c[name] + value for name, value in zip(MEASURES, delta)}
+        result = connection.execute(table.update().where(where).values(**increments))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row_keys, **dict(zip(MEASURES, delta))))
+
+
+def _delta(values):
+    ear = values['avg_ear']
+    return (1, (values['session_end'] - values['session_start']).total_seconds(), values['total_blinks'] or 0,
+            values['drowsiness_alerts'] or 0, ear or 0.0, 0 if ear is None else 1)
+
+
+def _company_of(connection, rental_id):
+    return connection.execute(select(Rental.rental_company_id).where(Rental.id == rental_id)).scalar()
+
+
+def _contributions(connection, values):
+    """Rollup rows an ended session with these column values counts towards."""
+    if values['status'] != 'completed' or values['session_end'] is None:
+        return []
+    keys = (values['car_id'], values['driver_id'], _company_of(connection, values['rental_id']))
+    return [(values['session_end'].date(), keys, _delta(values))]
+
+
+def add_ending_sessions(rental_ids, now):
+    """Roll up the active sessions of rental_ids as if they ended at now.
+
+    For code that closes sessions with bulk SQL; call it in the same
+    transaction, before the update.
+    """
+    rows = db.session.execute(
+        select(DriverMonitoring.car_id, DriverMonitoring.driver_id, Rental.rental_company_id,
+               DriverMonitoring.session_start, DriverMonitoring.total_blinks, DriverMonitoring.drowsiness_alerts,
+               DriverMonitoring.avg_ear)
+        .join(Rental, Rental.id == DriverMonitoring.rental_id)
+        .where(DriverMonitoring.rental_id.in_(rental_ids), DriverMonitoring.status == 'active')
+    ).all()
+    merged = {}
+    for car_id, driver_id, company_id, session_start, blinks, alerts, ear in rows:
+        delta = _delta({'session_start': session_start, 'session_end': now, 'total_blinks': blinks,
+                        'drowsiness_alerts': alerts, 'avg_ear': ear})
+        keys = (car_id, driver_id, company_id)
+        merged[keys] = tuple(map(sum, zip(merged[keys], delta))) if keys in merged else delta
+    connection = db.session.connection()
+    for keys, delta in merged.items():
+        apply_safety_delta(connection, now.date(), keys, delta)
+
+
+def _seconds(start, end):
+    if db.engine.url.get_backend_name() == 'sqlite':
+        return (func.julianday(end) - func.julianday(start)) * 86400.0
+    return func.extract('epoch', end - start)
+
+
+def _month(column):
+    if db.engine.url.get_backend_name() == 'sqlite':
+        return func.date(column, 'start of month')
+    return cast(func.date_trunc('month', column), Date)
+
+
+def rebuild_rollups():
+    """Recompute every safety rollup row from hot and archived sessions."""
+    session = MonitoringHistory
+    measures = (
+        func.count(session.id),
+        func.sum(_seconds(session.session_start, session.session_end)),
+        func.sum(func.coalesce(session.total_blinks, 0)),
+        func.sum(func.coalesce(session.drowsiness_alerts, 0)),
+        func.sum(func.coalesce(session.avg_ear, 0.0)),
+        func.count(session.avg_ear),
+    )
+    keys = (session.car_id, session.driver_id, RentalHistory.rental_company_id)
+    ended = (session.status == 'completed', session.session_end.isnot(None))
+
+    daily_table = SafetyDaily.__table__
+    monthly_table = SafetyMonthly.__table__
+    db.session.execute(daily_table.delete())
+    db.session.execute(monthly_table.delete())
+    for table, period_name, period in ((daily_table, 'day', func.date(session.session_end)),
+                                       (monthly_table, 'month', _month(session.session_end))):
+        query = select(period, *keys, *measures) \
+            .join(RentalHistory, RentalHistory.id == session.rental_id).where(*ended).group_by(period, *keys)
+        db.session.execute(table.insert().from_select([period_name, *KEYS, *MEASURES], query))
+    db.session.commit()
+
+
+def _window_parts(start, end):
+    """(table, period column, first, last) pieces that together cover the days start..end exactly."""
+    first_month = start if start.day == 1 else _next_month(start)
+    end_month = month_start(end + timedelta(days=1))  # first month not wholly inside the window
+    if first_month >= end_month:
+        return [(SafetyDaily, SafetyDaily.day, start, end)]
+    parts = [(SafetyMonthly, SafetyMonthly.month, first_month, end_month - timedelta(days=1))]
+    if start < first_month:
+        parts.append((SafetyDaily, SafetyDaily.day, start, first_month - timedelta(days=1)))
+    if end_month <= end:
+        parts.append((SafetyDaily, SafetyDaily.day, end_month, end))
+    return parts
+
+
+def ranking(by, start, end, owner_id=None, company_id=None, limit=20, min_hours=1.0):
+    """Cars or drivers with the most drowsiness alerts per monitored hour between start and end (inclusive).
+
+    Scoped to one owner's cars or one company's rentals when given; entries
+    with less than min_hours of monitoring are left out.
+    """
+    if by not in RANK_BY:
+        raise SafetyError(f"by must be one of {', '.join(RANK_BY)}")
+    if end < start:
+        raise SafetyError('end is before start')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise SafetyError(f'limit must be between 1 and {MAX_LIMIT}')
+
+    key = f'{by}_id'
+    pieces = []
+    for model, period, first, last in _window_parts(start, end):
+        query = select(getattr(model, key).label('key'), *(getattr(model, name) for name in MEASURES)) \
+            .where(period >= first, period <= last)
+        if owner_id is not None:
+            query = query.where(model.car_id.in_(select(Car.id).where(Car.owner_id == owner_id)))
+        if company_id is not None:
+            query = query.where(model.company_id == company_id)
+        pieces.append(query)
+    window = union_all(*pieces).subquery()
+
+    totals = [func.sum(window.c[name]).label(name) for name in MEASURES]
+    seconds = func.sum(window.c.monitored_seconds)
+    alerts = func.sum(window.c.drowsiness_alerts)
+    rows = db.session.execute(
+        select(window.c.key, *totals)
+        .group_by(window.c.key)
+        .having(seconds > 0, seconds >= min_hours * 3600)
+        .order_by((alerts * 3600.0 / seconds).desc(), alerts.desc(), window.c.key)
+        .limit(limit)
+    ).all()
+    return [dict(_rates(row), **{key: row.key}, **details) for row, details in zip(rows, _details(by, rows))]
+
+
+def _rates(row):
+    hours = row.monitored_seconds / 3600
+    return {
+        'sessions': row.sessions,
+        'monitored_hours': round(hours, 1),
+        'drowsiness_alerts': row.drowsiness_alerts,
+        'alerts_per_hour': round(row.drowsiness_alerts / hours, 3),
+        'alerts_per_session': round(row.drowsiness_alerts / row.sessions, 3),
+        'blinks_per_minute': round(row.total_blinks / (hours * 60), 2),
+        'avg_ear': round(row.ear_sum / row.ear_sessions, 4) if row.ear_sessions else None,
+    }
+
+
+def _details(by, rows):
+    ids = [row.key for row in rows]
+    if by == 'car':
+        cars = {car.id: car for car in db.session.execute(
+            select(Car.id, Car.license_plate, Car.make, Car.model).where(Car.id.in_(ids)))}
+        return [{'license_plate': cars[i].license_plate, 'make': cars[i].make, 'model': cars[i].model}
+                if i in cars else {} for i in ids]
+    names = dict(db.session.execute(select(User.id, User.username).where(User.id.in_(ids))).all())
+    risk_scores = dict(db.session.execute(select(DriverRisk.driver_id, DriverRisk.score)
+                                          .where(DriverRisk.driver_id.in_(ids))).all())
+    return [{'username': names.get(i), 'risk_score': risk_scores.get(i)} for i in ids]
+
+
+def default_range(today=None):
+    end = today or date.today()
+    return end - timedelta(days=29), end
+
+
+TRACKED = ('status', 'rental_id', 'car_id', 'driver_id', 'session_start', 'session_end',
+           'total_blinks', 'drowsiness_alerts', 'avg_ear')
+
+
+def _current_values(target):
+    return {name: getattr(target, name) for name in TRACKED}
+
+
+def _previous_values(target):
+    state = inspect(target)
+    values = _current_values(target)
+    for name in values:
+        history = state.attrs[name].history
+        if history.deleted:
+            values[name] = history.deleted[0]
+    return values
+
+
+def _apply(connection, contributions, sign):
+    for day, keys, delta in contributions:
+        apply_safety_delta(connection, day, keys, tuple(sign * value for value in delta))
+
+
+def _keep_previous(target, value, oldvalue, initiator):
+    return value
+
+
+# Sessions are often changed right after a commit expired them; active_history
+# loads the old values first, so after_update can take back what they counted
+for _name in TRACKED:
+    event.listen(getattr(DriverMonitoring, _name), 'set', _keep_previous, active_history=True, retval=True)
+
+
+@event.listens_for(DriverMonitoring, 'after_insert')
+def _session_inserted(mapper, connection, target):
+    _apply(connection, _contributions(connection, _current_values(target)), 1)
+
+
+@event.listens_for(DriverMonitoring, 'after_update')
+def _session_updated(mapper, connection, target):
+    previous = _previous_values(target)
+    current = _current_values(target)
+    if previous == current:
+        return
+    _apply(connection, _contributions(connection, previous), -1)
+    _apply(connection, _contributions(connection, current), 1)
+
+
+@event.listens_for(DriverMonitoring, 'after_delete')
+def _session_deleted(mapper, connection, target):
+    _apply(connection, _contributions(connection, _previous_values(target)), -1)
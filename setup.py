@@ -55,6 +55,7 @@ def create_env_file():
         with open(env_file, 'w') as f:
             f.write("SECRET_KEY=your-secret-key-change-this-in-production\n")
             f.write("DATABASE_URL=sqlite:///car_rental.db\n")
+            f.write("DATABASE_PROFILE=wal\n")
             f.write("DEBUG=True\n")
         print("✓ Created .env file")
     else:
@@ -0,0 +1,174 @@
+"""
+Sampled per-request SQL profiling.
+
+With SQL_PROFILING on, a SQL_PROFILE_SAMPLE_RATE share of requests record
+every statement they run: how many, the time spent waiting on the database,
+the slowest statements, and statements repeated with different parameters.
+A statement run N_PLUS_ONE_THRESHOLD or more times in one request is flagged
+as a likely N+1, usually a lazy relationship walked once per row. Results are
+aggregated per endpoint and served to admins at /admin/sql_profile.
+
+Requests that are not sampled pay one thread-local lookup per statement, so
+profiling can stay on in production at a low sample rate.
+"""
+
+import heapq
+import random
+import re
+import threading
+import time
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+N_PLUS_ONE_THRESHOLD = 5
+SLOWEST_STATEMENTS = 5
+MAX_PATTERNS_PER_ENDPOINT = 20
+STATEMENT_PREVIEW = 500
+
+# "IN (?, ?, ?)" and friends collapse to one pattern whatever the list length
+_PARAMETER_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))+\s*\)')
+
+_local = threading.local()
+
+
+def normalize(statement):
+    return ' '.join(_PARAMETER_LIST.sub('(?)', statement).split())[:STATEMENT_PREVIEW]
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.db_time = 0.0
+        self.patterns = {}
+        self.slowest = []  # min-heap of (seconds, statement)
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.db_time += seconds
+        pattern = normalize(statement)
+        self.patterns[pattern] = self.patterns.get(pattern, 0) + 1
+        entry = (seconds, pattern)
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return {pattern: count for pattern, count in self.patterns.items() if count >= threshold}
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.max_db_time = 0.0
+        self.request_time = 0.0
+        self.n_plus_one = {}  # pattern -> [requests flagged, most repeats in one request]
+        self.slowest = []
+
+    def add(self, profile, elapsed):
+        """Fold in one sampled request; return the N+1 patterns seen for the first time."""
+        new_patterns = []
+        self.requests += 1
+        self.queries += profile.count
+        self.max_queries = max(self.max_queries, profile.count)
+        self.db_time += profile.db_time
+        self.max_db_time = max(self.max_db_time, profile.db_time)
+        self.request_time += elapsed
+        for pattern, repeats in profile.repeated().items():
+            flagged = self.n_plus_one.get(pattern)
+            if flagged is None:
+                if len(self.n_plus_one) >= MAX_PATTERNS_PER_ENDPOINT:
+                    continue
+                flagged = self.n_plus_one[pattern] = [0, 0]
+                new_patterns.append((pattern, repeats))
+            flagged[0] += 1
+            flagged[1] = max(flagged[1], repeats)
+        self.slowest = heapq.nlargest(SLOWEST_STATEMENTS, self.slowest + profile.slowest)
+        return new_patterns
+
+    def to_dict(self):
+        return {
+            'sampled_requests': self.requests,
+            'avg_queries': round(self.queries / self.requests, 2),
+            'max_queries': self.max_queries,
+            'avg_db_ms': round(self.db_time / self.requests * 1000, 2),
+            'max_db_ms': round(self.max_db_time * 1000, 2),
+            'avg_request_ms': round(self.request_time / self.requests * 1000, 2),
+            'db_share': round(self.db_time / self.request_time, 3) if self.request_time else None,
+            'likely_n_plus_one': [
+                {'statement': pattern, 'requests': requests, 'max_repeats': repeats}
+                for pattern, (requests, repeats) in sorted(self.n_plus_one.items(), key=lambda item: -item[1][0])
+            ],
+            'slowest_statements': [{'ms': round(seconds * 1000, 2), 'statement': statement}
+                                   for seconds, statement in self.slowest],
+        }
+
+
+class SqlProfiler:
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, profile, elapsed):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            return stats.add(profile, elapsed)
+
+    def report(self):
+        """Per-endpoint stats, the endpoints spending the most database time first."""
+        with self._lock:
+            ranked = sorted(self._endpoints.items(), key=lambda item: -item[1].db_time)
+            return {endpoint: stats.to_dict() for endpoint, stats in ranked}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'profile', None) is not None:
+        context._sql_profiler_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_local, 'profile', None)
+    started = getattr(context, '_sql_profiler_started', None)
+    if profile is not None and started is not None:
+        profile.record(statement, time.perf_counter() - started)
+
+
+def _start_request():
+    config = current_app.config
+    if config['SQL_PROFILING'] and random.random() < config['SQL_PROFILE_SAMPLE_RATE']:
+        _local.profile = RequestProfile()
+
+
+def _finish_request(exc):
+    profile = _local.__dict__.pop('profile', None)
+    if profile is None:
+        return
+    elapsed = time.perf_counter() - profile.started
+    endpoint = request.endpoint or 'unmatched'
+    for pattern, repeats in profiler.add(endpoint, profile, elapsed):
+        current_app.logger.warning('Likely N+1 in %s: %d× %s', endpoint, repeats, pattern)
+
+
+def init_app(app):
+    app.config.setdefault('SQL_PROFILING', False)
+    app.config.setdefault('SQL_PROFILE_SAMPLE_RATE', 0.05)
+    app.before_request(_start_request)
+    app.teardown_request(_finish_request)
+
+
+# Global profiler instance
+profiler = SqlProfiler()
@@ -51,24 +51,36 @@ function initializeDashboard() {
         initializeCharts();
     }
     
+    // Initialize safety ranking if it exists
+    initializeSafetyRanking();
+    
     // Initialize real-time updates
     initializeRealTimeUpdates();
 }
 
 // Chart initialization
+let revenueChart = null;
+
 function initializeCharts() {
     // Revenue chart
     const revenueCtx = document.getElementById('revenueChart');
     if (revenueCtx) {
-        new Chart(revenueCtx, {
+        revenueChart = new Chart(revenueCtx, {
             type: 'line',
             data: {
-                labels: ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun'],
+                labels: [],
                 datasets: [{
                     label: 'Revenue',
-                    data: [12000, 19000, 3000, 5000, 2000, 3000],
+                    data: [],
                     borderColor: 'rgb(75, 192, 192)',
-                    tension: 0.1
+                    tension: 0.1,
+                    yAxisID: 'y'
+                }, {
+                    label: 'Utilization (%)',
+                    data: [],
+                    borderColor: 'rgb(255, 159, 64)',
+                    tension: 0.1,
+                    yAxisID: 'utilization'
                 }]
             },
             options: {
@@ -76,10 +88,83 @@ function initializeCharts() {
                 scales: {
                     y: {
                         beginAtZero: true
+                    },
+                    utilization: {
+                        beginAtZero: true,
+                        max: 100,
+                        position: 'right',
+                        grid: {
+                            drawOnChartArea: false
+                        }
                     }
                 }
             }
         });
+        
+        const granularity = document.getElementById('revenueGranularity');
+        if (granularity) {
+            granularity.addEventListener('change', () => loadRevenueChart(granularity.value));
+        }
+        loadRevenueChart(granularity ? granularity.value : 'month');
+    }
+}
+
+// Load revenue and utilization per period from the analytics API
+async function loadRevenueChart(granularity) {
+    try {
+        const response = await fetch(`/api/analytics/revenue?granularity=${granularity}`);
+        if (!response.ok) {
+            return;
+        }
+        const series = await response.json();
+        revenueChart.data.labels = series.periods;
+        revenueChart.data.datasets[0].label = series.measure === 'owner_income' ? 'Income' : 'Revenue';
+        revenueChart.data.datasets[0].data = series.revenue;
+        revenueChart.data.datasets[1].data = series.utilization.map(share => Math.round(share * 1000) / 10);
+        revenueChart.update();
+    } catch (error) {
+        console.error('Error loading revenue chart:', error);
+    }
+}
+
+// Drivers or cars ranked by drowsiness alerts per hour
+function initializeSafetyRanking() {
+    const table = document.getElementById('safetyRanking');
+    if (!table) {
+        return;
+    }
+    const rankBy = document.getElementById('safetyRankBy');
+    rankBy.addEventListener('change', () => loadSafetyRanking(rankBy.value));
+    loadSafetyRanking(rankBy.value);
+}
+
+async function loadSafetyRanking(by) {
+    try {
+        const response = await fetch(`/api/safety/ranking?by=${by}&limit=10`);
+        if (!response.ok) {
+            return;
+        }
+        const result = await response.json();
+        document.getElementById('safetyRankSubject').textContent = by === 'car' ? 'Car' : 'Driver';
+        const table = document.getElementById('safetyRanking');
+        table.replaceChildren();
+        if (result.ranking.length === 0) {
+            table.innerHTML = '<tr><td colspan="7" class="text-muted">No monitored trips yet.</td></tr>';
+            return;
+        }
+        result.ranking.forEach(entry => {
+            const subject = by === 'car'
+                ? `${entry.make || ''} ${entry.model || ''} (${entry.license_plate || entry.car_id})`
+                : (entry.username || `#${entry.driver_id}`);
+            const row = table.insertRow();
+            const risk = entry.risk_score === undefined || entry.risk_score === null ? '-' : Math.round(entry.risk_score);
+            [subject, entry.sessions, entry.monitored_hours, entry.drowsiness_alerts, entry.alerts_per_hour,
+             entry.avg_ear === null ? '-' : entry.avg_ear, risk].forEach(value => {
+                row.insertCell().textContent = value;
+            });
+        });
+    } catch (error) {
+        console.error('Error loading safety ranking:', error);
     }
 }
 
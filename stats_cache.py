@@ -0,0 +1,57 @@
+"""
+In-process cache for /api/dashboard/stats.
+
+Entries are keyed by (role, user id); admin stats are global and share the
+key ('admin', None). Each entry expires after `ttl` seconds, and the routes
+that change the numbers invalidate the affected keys right after committing.
+The TTL bounds staleness between processes, which do not share the cache.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+
+StatsEntry = namedtuple('StatsEntry', ['stats', 'etag', 'expires_at'])
+
+
+def stats_key(role, user_id=None):
+    """Cache key for a dashboard; admins share one entry."""
+    if role == 'admin':
+        return ('admin', None)
+    return (role, user_id)
+
+
+class StatsCache:
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the live entry for key, or None if missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        return entry
+
+    def set(self, key, stats):
+        payload = json.dumps(stats, sort_keys=True).encode()
+        entry = StatsEntry(stats, hashlib.sha1(payload).hexdigest(), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Global cache instance
+stats_cache = StatsCache()
@@ -0,0 +1,159 @@
+"""
+Non-blocking server for the camera monitoring streams.
+
+Under the threaded dev server or sync gunicorn workers every open MJPEG
+response pins a worker thread for as long as the viewer stays connected. This
+server handles the two long-lived endpoints on one asyncio event loop instead,
+so thousands of idle or slow viewers cost a socket and a small task each:
+
+    GET /api/monitor/video_feed/<session_id>   MJPEG, same as the Flask route
+    GET /api/monitor/events/<session_id>       Server-Sent Events with status
+
+Frames come from frame_hub, so a session is still processed once however many
+viewers it has. The Flask app keeps serving everything else, including its own
+video_feed route for setups without the streaming port. Start it with
+STREAMING_PORT (see app_simple.py) and point STREAMING_URL at it, or route
+/api/monitor/video_feed and /api/monitor/events to it from a reverse proxy.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import frame_hub
+from metrics import metrics
+
+HEADER_TIMEOUT = 10.0  # seconds a client gets to send its request headers
+MAX_HEADER_BYTES = 8192
+EVENT_INTERVAL = 1.0   # most status events per second unless drowsiness changes
+KEEPALIVE_INTERVAL = 15.0
+
+VIDEO_PREFIX = '/api/monitor/video_feed/'
+EVENTS_PREFIX = '/api/monitor/events/'
+
+
+class StreamingServer:
+    def __init__(self, allow_origin=None):
+        self.allow_origin = allow_origin
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HEADER_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            method, path = _request_line(head)
+            if method is None:
+                await self._reply(writer, '400 Bad Request')
+            elif not path.startswith((VIDEO_PREFIX, EVENTS_PREFIX)):
+                await self._reply(writer, '404 Not Found')
+            elif method != 'GET':
+                await self._reply(writer, '405 Method Not Allowed', 'Allow: GET\r\n')
+            elif path.startswith(VIDEO_PREFIX):
+                await self.video_feed(writer, path[len(VIDEO_PREFIX):])
+            else:
+                await self.events(writer, path[len(EVENTS_PREFIX):])
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def _headers(self, status, content_type, extra=''):
+        cors = f'Access-Control-Allow-Origin: {self.allow_origin}\r\n' if self.allow_origin else ''
+        return (f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nCache-Control: no-cache\r\n'
+                f'Connection: close\r\n{cors}{extra}\r\n').encode('latin-1')
+
+    async def _reply(self, writer, status, extra=''):
+        writer.write(self._headers(status, 'text/plain', f'Content-Length: {len(status)}\r\n' + extra)
+                     + status.encode('latin-1'))
+        await writer.drain()
+
+    async def video_feed(self, writer, session_id):
+        hub = frame_hub.get(session_id)
+        if hub is None:
+            await self._reply(writer, '404 Not Found')
+            return
+        writer.write(self._headers('200 OK', 'multipart/x-mixed-replace; boundary=frame'))
+        metrics.add_gauge('streaming_connections', 'stream.video_feed', 1)
+        try:
+            seq = 0
+            while hub.active:
+                latest = await hub.wait_async(seq)
+                if latest == seq or hub.frame is None:
+                    continue
+                seq = latest
+                writer.write(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + hub.frame + b'\r\n')
+                # A slow viewer waits here and then skips to the newest frame
+                await writer.drain()
+        finally:
+            metrics.add_gauge('streaming_connections', 'stream.video_feed', -1)
+
+    async def events(self, writer, session_id):
+        hub = frame_hub.get(session_id)
+        if hub is None:
+            await self._reply(writer, '404 Not Found')
+            return
+        writer.write(self._headers('200 OK', 'text/event-stream'))
+        metrics.add_gauge('streaming_connections', 'stream.events', 1)
+        try:
+            seq = 0
+            sent = None
+            sent_at = last_write = 0.0
+            while hub.active:
+                seq = await hub.wait_async(seq, KEEPALIVE_INTERVAL)
+                status = hub.status
+                now = time.monotonic()
+                drowsy_changed = sent is not None and status.get('drowsy') != sent.get('drowsy')
+                if status and status != sent and (drowsy_changed or now - sent_at >= EVENT_INTERVAL):
+                    writer.write(f'data: {json.dumps(status)}\n\n'.encode())
+                    sent, sent_at, last_write = status, now, now
+                elif now - last_write >= KEEPALIVE_INTERVAL:
+                    writer.write(b': keepalive\n\n')
+                    last_write = now
+                else:
+                    continue
+                await writer.drain()
+            writer.write(b'data: {"active": false}\n\n')
+            await writer.drain()
+        finally:
+            metrics.add_gauge('streaming_connections', 'stream.events', -1)
+
+
+def _request_line(head):
+    try:
+        method, target, version = head.split(b'\r\n', 1)[0].decode('latin-1').split(' ')
+    except ValueError:
+        return None, None
+    if not version.startswith('HTTP/'):
+        return None, None
+    return method, target.split('?', 1)[0]
+
+
+def start(host, port, allow_origin=None):
+    """Serve the streams from a daemon thread; raises if the port cannot be bound."""
+    server = StreamingServer(allow_origin)
+    ready = threading.Event()
+    failure = []
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            listener = loop.run_until_complete(
+                asyncio.start_server(server.handle, host, port, limit=MAX_HEADER_BYTES))
+        except OSError as e:
+            failure.append(e)
+            ready.set()
+            return
+        ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            listener.close()
+
+    threading.Thread(target=run, name='streaming-server', daemon=True).start()
+    ready.wait()
+    if failure:
+        raise failure[0]
+    return server
@@ -0,0 +1,114 @@
+"""
+Shared fixtures: app_simple against a throwaway SQLite database, emptied
+before every test, and a small seeded fleet.
+"""
+
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+# app_simple reads its configuration from the environment when imported
+_instance = tempfile.mkdtemp(prefix='car_rental_tests_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_instance, 'test.db')
+os.environ['ARCHIVE_DIR'] = os.path.join(_instance, 'archive')
+os.environ['LIFECYCLE_INTERVAL'] = '0'
+
+from models import db, Car, DriverMonitoring, Rental, RentalCompany, User, create_schema  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def flask_app():
+    from app_simple import app
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def app(flask_app):
+    import availability
+    from admission import admission_control
+    from identity_cache import identity_cache
+    from stats_cache import stats_cache
+
+    shutil.rmtree(flask_app.config['ARCHIVE_DIR'], ignore_errors=True)
+    with flask_app.app_context():
+        db.drop_all()
+        create_schema()
+        identity_cache.clear()
+        stats_cache.clear()
+        availability.availability_index.replace([])
+        availability.availability_index.loaded_at = None
+        admission_control.configure()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """Log the test client in as a user id without going through the password form."""
+    def log_in(user_id):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+    return log_in
+
+
+def _user(username, role):
+    user = User(username=username, email=f'{username}@example.com', password_hash='x', role=role)
+    db.session.add(user)
+    return user
+
+
+@pytest.fixture
+def fleet(app):
+    """An owner's six cars in one company's fleet, two of them rented by customers, plus finished rentals."""
+    now = datetime.utcnow()
+    admin = _user('admin', 'admin')
+    owner = _user('owner', 'car_owner')
+    company_user = _user('company', 'rental_company')
+    customers = [_user(f'customer{i}', 'customer') for i in range(3)]
+    db.session.flush()
+    company = RentalCompany(name='Fleet Co', address='1 Main St', phone='555-0100', user_id=company_user.id)
+    db.session.add(company)
+    db.session.flush()
+
+    makes = ('Toyota', 'Honda', 'Ford')
+    cars = []
+    for i in range(6):
+        car = Car(make=makes[i % 3], model=f'Model {i}', year=2018 + i, license_plate=f'TEST{i:03d}', color='Blue',
+                  daily_rate=40.0 + 5 * i, owner_id=owner.id, rental_company_id=company.id)
+        db.session.add(car)
+        cars.append(car)
+    db.session.flush()
+
+    def rental(car, customer, start, days, status):
+        rental = Rental(car_id=car.id, customer_id=customer.id, rental_company_id=company.id,
+                        start_date=start, end_date=start + timedelta(days=days), daily_rate=car.daily_rate,
+                        total_amount=car.daily_rate * days, commission=car.daily_rate * days * 0.15,
+                        handling_fee=50.0, status=status)
+        db.session.add(rental)
+        return rental
+
+    active = [rental(cars[i], customers[i], now - timedelta(days=1), 7, 'active') for i in range(2)]
+    cars[0].status = cars[1].status = 'rented'
+    finished = [rental(cars[i % 6], customers[i % 3], now - timedelta(days=40 - 5 * i), 3, 'completed')
+                for i in range(6)]
+    db.session.flush()
+    for r in active + finished:
+        db.session.add(DriverMonitoring(rental_id=r.id, car_id=r.car_id, driver_id=r.customer_id,
+                                        session_start=r.start_date, session_end=r.start_date + timedelta(hours=1),
+                                        total_blinks=300, drowsiness_alerts=1, avg_ear=0.3,
+                                        status='active' if r.status == 'active' else 'completed'))
+    db.session.commit()
+    return SimpleNamespace(admin=admin.id, owner=owner.id, company_user=company_user.id, company=company.id,
+                           customers=[customer.id for customer in customers], cars=[car.id for car in cars],
+                           active=[r.id for r in active], finished=[r.id for r in finished])
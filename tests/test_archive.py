@@ -0,0 +1,102 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func
+
+import archive
+from models import db, DriverMonitoring, MonitoringHistory, Rental, RentalHistory
+
+
+def _finished_rental(fleet, end_date):
+    rental = Rental(car_id=fleet.cars[3], customer_id=fleet.customers[1], rental_company_id=fleet.company,
+                    start_date=end_date - timedelta(days=2), end_date=end_date, daily_rate=50.0, total_amount=100.0,
+                    commission=15.0, handling_fee=50.0, status='completed')
+    db.session.add(rental)
+    db.session.flush()
+    db.session.add(DriverMonitoring(rental_id=rental.id, car_id=rental.car_id, driver_id=rental.customer_id,
+                                    session_start=rental.start_date, session_end=rental.start_date + timedelta(hours=2),
+                                    total_blinks=500, drowsiness_alerts=0, avg_ear=0.3, status='completed'))
+    return rental
+
+
+def _history_ids(model):
+    return sorted(row_id for (row_id,) in db.session.query(model.id))
+
+
+def test_newest_session_stays_hot(app, fleet):
+    # The newest session belongs to an old rental that is otherwise due
+    db.session.add(DriverMonitoring(rental_id=fleet.finished[0], car_id=fleet.cars[0], driver_id=fleet.customers[0],
+                                    session_start=datetime.utcnow() - timedelta(days=40), status='completed',
+                                    session_end=datetime.utcnow() - timedelta(days=39)))
+    db.session.commit()
+    newest_session = db.session.query(func.max(DriverMonitoring.id)).scalar()
+
+    archive.archive_rentals(older_than_days=10)
+
+    assert db.session.get(Rental, fleet.finished[0]) is not None
+    assert db.session.get(DriverMonitoring, newest_session) is not None
+    # A session started now cannot take an archived id
+    session = DriverMonitoring(rental_id=fleet.active[0], car_id=fleet.cars[0], driver_id=fleet.customers[0],
+                               session_start=datetime.utcnow(), status='active')
+    db.session.add(session)
+    db.session.commit()
+    ids = _history_ids(MonitoringHistory)
+    assert len(ids) == len(set(ids))
+
+
+def test_conflicting_archived_row_fails_loudly(app, fleet):
+    archive.archive_rentals(older_than_days=10)
+    archived = _history_ids(RentalHistory)
+    # Forge a hot rental reusing an archived id with different contents
+    moved = next(rental_id for rental_id in archived if db.session.get(Rental, rental_id) is None)
+    clash = _finished_rental(fleet, datetime.utcnow() - timedelta(days=30))
+    db.session.flush()
+    db.session.query(DriverMonitoring).filter_by(rental_id=clash.id).delete()
+    clash.id = moved
+    db.session.commit()
+    _finished_rental(fleet, datetime.utcnow() - timedelta(days=1))  # keeps the clash from being the newest row
+    db.session.commit()
+
+    with pytest.raises(Exception, match='UNIQUE constraint failed'):
+        archive.archive_rentals(older_than_days=10)
+    db.session.rollback()
+    assert db.session.get(Rental, moved) is not None
+
+
+def test_copies_left_by_an_interrupted_run_are_skipped(app, fleet):
+    rental = db.session.get(Rental, fleet.finished[1])
+    period = rental.end_date.year
+    archive.archive_store.create(period)
+    # As if a run copied the rental and then died before deleting it
+    with sqlite3.connect(archive.archive_store.path(period)) as archived, \
+            sqlite3.connect(db.engine.url.database) as hot:
+        row = hot.execute('SELECT * FROM rental WHERE id = ?', (rental.id,)).fetchone()
+        archived.execute(f'INSERT INTO rental VALUES ({", ".join("?" * len(row))})', row)
+    rentals = _history_ids(RentalHistory)
+
+    archive.archive_rentals(older_than_days=10)
+
+    assert db.session.get(Rental, fleet.finished[1]) is None
+    assert _history_ids(RentalHistory) == sorted(set(rentals))
+
+
+def test_old_years_are_merged_to_stay_attachable(app, fleet):
+    for years in (range(2010, 2016), range(2016, 2022)):
+        for year in years:
+            _finished_rental(fleet, datetime(year, 6, 1))
+        _finished_rental(fleet, datetime.utcnow() - timedelta(days=1))  # the newest rows stay hot
+        db.session.commit()
+        rentals = _history_ids(RentalHistory)
+        sessions = _history_ids(MonitoringHistory)
+
+        archive.archive_rentals(older_than_days=10)
+
+        assert len(archive.archive_store.periods()) <= archive.MAX_ARCHIVE_FILES
+        assert _history_ids(RentalHistory) == rentals
+        assert _history_ids(MonitoringHistory) == sessions
+
+    periods = archive.archive_store.periods()
+    assert len(periods) == archive.MAX_ARCHIVE_FILES
+    assert periods[0] == 2015 and 2021 in periods
+    assert db.session.query(Rental).filter(Rental.end_date < datetime(2022, 1, 1)).count() == 0
@@ -0,0 +1,41 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import booking
+
+
+def _failing(message, calls):
+    def try_book(*args):
+        calls.append(args)
+        raise OperationalError('INSERT INTO rental ...', {}, sqlite3.OperationalError(message))
+    return try_book
+
+
+def _book(fleet):
+    start = datetime.utcnow() + timedelta(days=30)
+    return booking.book_car(fleet.cars[2], fleet.customers[2], start, start + timedelta(days=3))
+
+
+def test_lock_timeouts_are_retried(app, fleet, monkeypatch):
+    calls = []
+    monkeypatch.setattr(booking, 'BACKOFF_SECONDS', 0)
+    monkeypatch.setattr(booking, '_try_book', _failing('database is locked', calls))
+    with pytest.raises(booking.BookingContention):
+        _book(fleet)
+    assert len(calls) == booking.MAX_ATTEMPTS
+
+
+def test_other_operational_errors_are_not_retried(app, fleet, monkeypatch):
+    calls = []
+    monkeypatch.setattr(booking, '_try_book', _failing('no such table: rental', calls))
+    with pytest.raises(OperationalError, match='no such table'):
+        _book(fleet)
+    assert len(calls) == 1
+
+
+def test_booking_succeeds(app, fleet):
+    rental = _book(fleet)
+    assert rental.id is not None and rental.status == 'active'
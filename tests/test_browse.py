@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+import car_browse
+from models import db, Car, Rental
+
+
+def _book_all_but(fleet, car_ids, free_car_ids, start, end):
+    for car_id in set(car_ids) - set(free_car_ids):
+        db.session.add(Rental(car_id=car_id, customer_id=fleet.customers[0], rental_company_id=fleet.company,
+                              start_date=start, end_date=end,
+                              daily_rate=50.0, total_amount=250.0, commission=37.5, handling_fee=50.0,
+                              status='active'))
+    db.session.commit()
+
+
+def test_period_scan_stops_early_and_resumes(app, fleet, monkeypatch):
+    monkeypatch.setattr(car_browse, 'SCAN_BATCH', 10)
+    monkeypatch.setattr(car_browse, 'MAX_SCANNED', 20)
+    for i in range(60):
+        db.session.add(Car(make='Kia', model='Rio', year=2020, license_plate=f'SCAN{i:03d}', color='Red',
+                           daily_rate=30.0, owner_id=fleet.owner))
+    db.session.commit()
+    car_ids = [car_id for (car_id,) in db.session.query(Car.id)]
+    newest_first = sorted(car_ids, reverse=True)
+    free = newest_first[25:28] + newest_first[50:53]
+    start = datetime.utcnow() + timedelta(days=30)
+    _book_all_but(fleet, car_ids, free, start - timedelta(days=1), start + timedelta(days=10))
+
+    filters = car_browse.parse_filters({'start_date': start.strftime('%Y-%m-%d'),
+                                        'end_date': (start + timedelta(days=3)).strftime('%Y-%m-%d')})
+    # The first request looks at 20 booked cars only and hands back where it stopped
+    cars, cursor = car_browse.browse_page(filters, limit=4)
+    assert cars == [] and cursor is not None
+
+    seen = []
+    pages = 1
+    while cursor:
+        cars, cursor = car_browse.browse_page(filters, cursor, limit=4)
+        seen += [car.id for car in cars]
+        pages += 1
+    assert seen == sorted(free, reverse=True)
+    assert pages <= 5
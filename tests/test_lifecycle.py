@@ -0,0 +1,83 @@
+import threading
+from datetime import datetime, timedelta
+
+import lifecycle
+import revenue
+import safety
+from models import db, DriverMonitoring, Rental, RevenueDaily, RevenueTotal, SafetyDaily, SafetyMonthly
+
+ROLLUPS = (RevenueTotal, RevenueDaily, SafetyDaily, SafetyMonthly)
+
+
+def _rollup_rows():
+    rows = {}
+    for model in ROLLUPS:
+        columns = model.__table__.columns
+        rows[model.__name__] = sorted(tuple(round(value, 1) if isinstance(value, float) else value
+                                            for value in row)
+                                      for row in db.session.execute(db.select(*columns)))
+    return rows
+
+
+def _add_due_rentals(fleet, count):
+    now = datetime.utcnow()
+    for i in range(count):
+        start = now - timedelta(days=4, hours=i)
+        rental = Rental(car_id=fleet.cars[2 + i % 4], customer_id=fleet.customers[i % 3], rental_company_id=fleet.company,
+                        start_date=start, end_date=start + timedelta(days=3), daily_rate=45.0, total_amount=135.0 + i,
+                        commission=20.25, handling_fee=50.0, status='active')
+        db.session.add(rental)
+        db.session.flush()
+        db.session.add(DriverMonitoring(rental_id=rental.id, car_id=rental.car_id, driver_id=rental.customer_id,
+                                        session_start=start, total_blinks=100 + i, drowsiness_alerts=i % 2,
+                                        avg_ear=0.3, status='active'))
+    db.session.commit()
+
+
+def test_completes_due_rentals(app, fleet):
+    _add_due_rentals(fleet, 10)
+    assert lifecycle.complete_due_rentals() == 10
+    assert lifecycle.complete_due_rentals() == 0
+    assert Rental.query.filter_by(status='active').count() == 2
+    before = _rollup_rows()
+    revenue.rebuild_rollups()
+    safety.rebuild_rollups()
+    assert _rollup_rows() == before
+
+
+def test_overlapping_runs_count_each_rental_once(app, fleet, monkeypatch):
+    _add_due_rentals(fleet, 10)
+    first_inside = threading.Event()
+    add_to_rollups = lifecycle._add_to_rollups
+
+    def slow_add_to_rollups(ids):
+        # Hold the first run inside its batch while the second one starts
+        if threading.current_thread().name == 'first':
+            first_inside.set()
+            threading.Event().wait(0.5)
+        add_to_rollups(ids)
+
+    monkeypatch.setattr(lifecycle, '_add_to_rollups', slow_add_to_rollups)
+    completed = {}
+
+    def run(name):
+        with app.app_context():
+            try:
+                completed[name] = lifecycle.complete_due_rentals()
+            finally:
+                db.session.remove()
+
+    first = threading.Thread(target=run, args=('first',), name='first')
+    second = threading.Thread(target=run, args=('second',), name='second')
+    first.start()
+    assert first_inside.wait(5)
+    second.start()
+    first.join(10)
+    second.join(10)
+
+    assert completed == {'first': 10, 'second': 0}
+    db.session.expire_all()
+    before = _rollup_rows()
+    revenue.rebuild_rollups()
+    safety.rebuild_rollups()
+    assert _rollup_rows() == before
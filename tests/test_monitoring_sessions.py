@@ -0,0 +1,103 @@
+import time
+
+import numpy as np
+import pytest
+
+import frame_hub
+import monitoring_routes
+from admission import admission_control
+
+
+class FakeDetector:
+    def __init__(self):
+        self.frames_left = None  # None = produce frames until stopped
+        self.camera_open = False
+
+    def start_camera(self):
+        self.camera_open = True
+        return True
+
+    def stop_camera(self):
+        self.camera_open = False
+
+    def calibrate_system(self):
+        return True
+
+    def process_frame(self):
+        if self.frames_left is not None:
+            if self.frames_left == 0:
+                return None
+            self.frames_left -= 1
+        return {'frame': np.zeros((8, 8, 3), np.uint8), 'blink_count': 0, 'drowsy': False,
+                'ear': 0.3, 'avg_ear': 0.3, 'face_detected': True}
+
+
+@pytest.fixture
+def detector(app, monkeypatch):
+    fake = FakeDetector()
+    for name in ('start_camera', 'stop_camera', 'calibrate_system', 'process_frame'):
+        monkeypatch.setattr(monitoring_routes.fatigue_detector, name, getattr(fake, name))
+    monkeypatch.setattr(frame_hub, 'FRAME_INTERVAL', 0.005)
+    yield fake
+    for session_id in list(monitoring_routes.monitoring_sessions):
+        frame_hub.stop(session_id)
+
+
+def _start(client, rental_id=1):
+    response = client.post(f'/api/monitor/start_camera/{rental_id}')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['session_id']
+
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_stopping_a_session_releases_its_slot_once(client, detector):
+    first = _start(client, 1)
+    _start(client, 2)
+    assert admission_control.sessions.in_use == 2
+
+    client.post(f'/api/monitor/stop_camera/{first}')
+    client.post(f'/api/monitor/stop_camera/{first}')
+    assert admission_control.sessions.in_use == 1
+    assert first not in monitoring_routes.monitoring_sessions
+
+
+def test_slot_is_released_when_the_camera_stops_producing(client, detector):
+    detector.frames_left = 3
+    session_id = _start(client)
+
+    _wait_until(lambda: admission_control.sessions.in_use == 0)
+    assert session_id not in monitoring_routes.monitoring_sessions
+    assert frame_hub.get(session_id) is None
+    assert not detector.camera_open
+
+    # A late stop from the browser must not free a slot a second time
+    client.post(f'/api/monitor/stop_camera/{session_id}')
+    detector.frames_left = None
+    _start(client, 2)
+    assert admission_control.sessions.in_use == 1
+
+
+def test_unwatched_session_is_ended_after_idle_timeout(client, detector):
+    admission_control.configure(max_sessions=1, session_idle_seconds=0.2)
+    session_id = _start(client)
+    assert client.post('/api/monitor/start_camera/2').status_code == 503
+
+    _wait_until(lambda: admission_control.sessions.in_use == 0)
+    assert client.get(f'/api/monitor/status/{session_id}').status_code == 404
+    _start(client, 2)
+
+
+def test_polling_keeps_a_session_alive(client, detector):
+    admission_control.configure(session_idle_seconds=0.2)
+    session_id = _start(client)
+
+    for _ in range(6):
+        time.sleep(0.1)
+        assert client.get(f'/api/monitor/status/{session_id}').status_code == 200
+    assert admission_control.sessions.in_use == 1
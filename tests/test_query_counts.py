@@ -0,0 +1,89 @@
+"""
+SQL statements issued by the eager-loaded views, counted inside the view
+(identity loading is cached and not included). A lazy relationship walked
+per row in a template shows up here as a higher count.
+"""
+
+import logging
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+
+from query_budget import count_queries, query_budget
+
+
+@pytest.fixture
+def view_queries(app, monkeypatch):
+    """Record the statement count of every call of the named endpoint's view."""
+    def watch(endpoint):
+        counts = []
+        view = app.view_functions[endpoint]
+
+        def counted(*args, **kwargs):
+            with count_queries() as counter:
+                response = view(*args, **kwargs)
+            counts.append(counter.count)
+            return response
+
+        monkeypatch.setitem(app.view_functions, endpoint, counted)
+        return counts
+    return watch
+
+
+def _get(client, view_queries, endpoint, url):
+    counts = view_queries(endpoint)
+    client.get(url)  # warm the identity cache and availability index
+    response = client.get(url)
+    assert response.status_code == 200
+    return counts[-1]
+
+
+@pytest.mark.parametrize('role, endpoint, url, queries', [
+    ('admin', 'admin_dashboard', '/admin', 7),
+    ('owner', 'car_owner_dashboard', '/car_owner', 3),
+    ('company_user', 'rental_company_dashboard', '/rental_company', 4),
+    ('customer', 'customer_dashboard', '/customer', 2),
+])
+def test_dashboards(client, login, fleet, view_queries, role, endpoint, url, queries):
+    user_id = fleet.customers[0] if role == 'customer' else getattr(fleet, role)
+    login(user_id)
+    assert _get(client, view_queries, endpoint, url) == queries
+
+
+@pytest.mark.parametrize('role', ['customer', 'owner', 'company_user'])
+def test_monitor_driver(client, login, fleet, view_queries, role):
+    user_id = fleet.customers[0] if role == 'customer' else getattr(fleet, role)
+    login(user_id)
+    assert _get(client, view_queries, 'monitor_driver', f'/monitor/{fleet.active[0]}') == 1
+
+
+@pytest.mark.parametrize('query_string, queries', [
+    ('', 2),
+    ('?sort=price&make=Toyota', 2),
+    ('?start_date=2030-01-01&end_date=2030-01-05', 2),
+    ('?q=Honda', 2),
+    ('?q=Honda&start_date=2030-01-01&end_date=2030-01-05', 2),
+])
+def test_browse_cars(client, login, fleet, view_queries, query_string, queries):
+    login(fleet.customers[0])
+    assert _get(client, view_queries, 'browse_cars', '/cars' + query_string) == queries
+
+
+def test_exceeded_budget_is_logged_not_raised(caplog):
+    engine = create_engine('sqlite://')
+    budget_app = Flask(__name__)
+    budget_app.testing = True
+
+    @budget_app.route('/')
+    @query_budget(1)
+    def chatty():
+        with engine.connect() as connection:
+            for _ in range(3):
+                connection.exec_driver_sql('SELECT 1')
+        return 'ok'
+
+    with caplog.at_level(logging.WARNING):
+        response = budget_app.test_client().get('/')
+    assert response.status_code == 200
+    assert 'chatty issued 3 queries (budget 1)' in caplog.text
@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.mark.parametrize('body', ['[1, 2]', '"cars"', '42', 'null', 'not json'])
+def test_body_must_be_an_object(client, login, fleet, body):
+    login(fleet.customers[0])
+    response = client.post('/api/quotes', data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Request body must be a JSON object"}
+
+
+def test_quotes(client, login, fleet):
+    login(fleet.customers[0])
+    response = client.post('/api/quotes', json={
+        'car_ids': fleet.cars[:2],
+        'periods': [{'start_date': '2030-01-01', 'end_date': '2030-01-04'}],
+    })
+    assert response.status_code == 200
+    assert [quote['car_id'] for quote in response.get_json()['quotes']] == fleet.cars[:2]
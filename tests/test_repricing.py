@@ -0,0 +1,78 @@
+import threading
+from datetime import datetime, timedelta
+
+import lifecycle
+import repricing
+import revenue
+from models import db, Rental, RevenueDaily, RevenueTotal
+
+STATUSES = ('active', 'completed')
+
+
+def _rollup_rows():
+    rows = {}
+    for model in (RevenueTotal, RevenueDaily):
+        columns = model.__table__.columns
+        rows[model.__name__] = sorted(tuple(round(value, 1) if isinstance(value, float) else value
+                                            for value in row)
+                                      for row in db.session.execute(db.select(*columns)))
+    return rows
+
+
+def _assert_rollups_match_rebuild():
+    db.session.expire_all()
+    before = _rollup_rows()
+    revenue.rebuild_rollups()
+    assert _rollup_rows() == before
+
+
+def _add_due_rental(fleet):
+    start = datetime.utcnow() - timedelta(days=4)
+    rental = Rental(car_id=fleet.cars[2], customer_id=fleet.customers[0], rental_company_id=fleet.company,
+                    start_date=start, end_date=start + timedelta(days=3), daily_rate=45.0, total_amount=135.0,
+                    commission=20.25, handling_fee=50.0, status='active')
+    db.session.add(rental)
+    db.session.commit()
+    return rental.id
+
+
+def test_repricing_keeps_rollups_in_step(app, fleet):
+    revenue.rebuild_rollups()
+    count = repricing.reprice_rentals(fleet.company, 0.2, 60.0, STATUSES, batch_size=3)
+
+    assert count == len(fleet.active) + len(fleet.finished)
+    assert {(r.commission, r.handling_fee) for r in Rental.query} == \
+        {(r.total_amount * 0.2, 60.0) for r in Rental.query}
+    _assert_rollups_match_rebuild()
+
+
+def test_rental_completed_during_a_batch_is_counted_once(app, fleet, monkeypatch):
+    due_id = _add_due_rental(fleet)
+    revenue.rebuild_rollups()
+    inside = threading.Event()
+    claim = repricing._claim
+
+    def slow_claim(rows, *args):
+        # Hold the batch holding the due rental open while the lifecycle job runs
+        if any(row.id == due_id for row in rows):
+            inside.set()
+            threading.Event().wait(0.5)
+        return claim(rows, *args)
+
+    monkeypatch.setattr(repricing, '_claim', slow_claim)
+
+    def run():
+        with app.app_context():
+            try:
+                repricing.reprice_rentals(fleet.company, 0.2, 60.0, STATUSES, batch_size=1)
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert inside.wait(5)
+    assert lifecycle.complete_due_rentals() == 1
+    thread.join(10)
+
+    assert db.session.get(Rental, due_id).commission == 135.0 * 0.2
+    _assert_rollups_match_rebuild()
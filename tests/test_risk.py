@@ -0,0 +1,44 @@
+from datetime import date, timedelta
+
+import pytest
+
+import risk
+from models import db, SafetyDaily
+
+TODAY = date(2026, 6, 30)
+
+
+def _day(driver_id, day, car_id, alerts, ear):
+    db.session.add(SafetyDaily(day=day, car_id=car_id, driver_id=driver_id, company_id=1, sessions=1,
+                               monitored_seconds=3600.0, total_blinks=900, drowsiness_alerts=alerts,
+                               ear_sum=ear, ear_sessions=1))
+
+
+def _features(window_days=30):
+    start = TODAY - timedelta(days=window_days - 1)
+    feature = risk.features(*risk.load_window(start), first_day=(start - risk.EPOCH).days)
+    return {driver_id: index for index, driver_id in enumerate(feature['driver_id'].tolist())}, feature
+
+
+def test_days_on_several_cars_count_once(app):
+    # Driver 1 drives two cars on the first day (one alert on one of them) and one car on the second
+    first = TODAY - timedelta(days=2)
+    _day(1, first, 10, 1, 0.3)
+    _day(1, first, 11, 0, 0.3)
+    _day(1, first + timedelta(days=1), 10, 0, 0.3)
+    db.session.commit()
+
+    index, feature = _features()
+    assert feature['alert_day_share'][index[1]] == pytest.approx(0.5)
+    assert feature['monitored_hours'][index[1]] == pytest.approx(3.0)
+    assert feature['sessions'][index[1]] == 3
+
+
+def test_ear_trend_per_30_days(app):
+    for offset in range(10):
+        _day(2, TODAY - timedelta(days=9 - offset), 20, 0, 0.30 - 0.001 * offset)
+    db.session.commit()
+
+    index, feature = _features(window_days=180)
+    assert feature['ear_trend'][index[2]] == pytest.approx(-0.03, abs=1e-9)
+    assert feature['ear_mean'][index[2]] == pytest.approx(0.2955)